@@ -0,0 +1,203 @@
+import argparse
+
+import utils
+import ingest
+import pushdown
+import chunked
+import risk
+import benchmark
+import stations
+import prerender
+
+
+def refresh(args):
+    client = utils.connect_gcp()
+    utils.refresh_snapshots(client, from_year=args.from_year, to_year=args.to_year)
+
+
+def memory(args):
+    client = utils.connect_gcp()
+    wildfire_df = utils.load_wildfire_data_gcp(client, compact=args.compact)
+    weather_df = utils.load_weather_data_gcp(client, compact=args.compact)
+
+    print("Wildfire data ({} rows):".format(len(wildfire_df)))
+    print(utils.get_memory_report(wildfire_df).to_string())
+    print("\nWeather data ({} rows):".format(len(weather_df)))
+    print(utils.get_memory_report(weather_df).to_string())
+
+
+# check that the push-down mode (on an embedded sqlite copy of the data), or the chunked mode on a store,
+# matches the pandas path
+def check_pushdown(args):
+    if args.store is not None:
+        wildfire_df = utils.load_wildfire_data_local_store(args.store)
+        backend = chunked.ChunkedBackend(args.store, args.chunk_rows)
+    else:
+        client = utils.connect_gcp()
+        wildfire_df = utils.read_wildfire_data_gcp(client)
+        backend = pushdown.create_sqlite_backend(wildfire_df)
+
+    specs = pushdown.get_check_specs(backend.get_metadata())
+    list_keys = pushdown.CHECK_KEYS
+
+    mismatches = pushdown.check_backend(wildfire_df, backend, specs, list_keys)
+    for spec, keys, error in mismatches:
+        print("Mismatch for {} grouped by {}:\n{}".format(spec, keys, error))
+    print("{} of {} aggregates match".format(len(specs) * len(list_keys) - len(mismatches), len(specs) * len(list_keys)))
+
+
+# fit the wildfire risk model on the loaded data and save it, evaluated on the years from test_from_year
+def train_risk(args):
+    client = utils.connect_gcp()
+    wildfire_df = utils.load_wildfire_data_gcp(client)
+    weather_df = utils.load_weather_data_gcp(client)
+
+    if args.test_from_year is not None:
+        _, metrics = risk.train(weather_df, wildfire_df, utils.FIRE_SIZE_CLASSES, test_from_year=args.test_from_year)
+        print("Evaluation on {}-: {}".format(args.test_from_year, metrics))
+    model, _ = risk.train(weather_df, wildfire_df, utils.FIRE_SIZE_CLASSES)
+    model.save(args.output)
+    print("Risk model saved to {}".format(args.output))
+
+
+# stream the original sqlite database into the partitioned store read by utils.load_wildfire_data_local_store
+def store(args):
+    num_rows = ingest.write_wildfire_store(args.directory, args.db, min_fire_size=args.min_fire_size,
+                                           chunksize=args.chunksize)
+    print("{} rows written to {}".format(num_rows, args.directory))
+
+
+# convert the visual crossing csv exports into the memory-mapped store read by utils.load_weather_data_local_store
+def weather_store(args):
+    num_rows = ingest.write_weather_store(args.directory, args.input)
+    print("{} rows written to {}".format(num_rows, args.directory))
+
+
+# weather of each fire from its nearest reporting stations, written next to the fires
+def attribute_weather(args):
+    client = utils.connect_gcp()
+    wildfire_df = utils.load_wildfire_data_gcp(client)
+    weather_df = utils.load_station_weather_gcp(client, from_year=args.from_year, to_year=args.to_year)
+
+    df = stations.attribute_weather(wildfire_df, weather_df, list(stations.WEATHER_COLUMNS), k=args.k)
+    df.to_parquet(args.output, index=False)
+    print("{} fires attributed ({} with {} stations, mean distance {:.1f} km), written to {}".format(
+        len(df), (df['num_stations'] == args.k).sum(), args.k, df['station_distance'].mean(), args.output))
+
+
+# pre-render the chart results of every state x year view of both pages, only the views whose rows changed
+def prerender_views(args):
+    num_rendered, num_carried = prerender.prerender(args.output, args.processes, utils.COMPACT_DTYPES, args.full)
+    print("{} views rendered, {} carried over, written to {}".format(num_rendered, num_carried, args.output))
+
+
+def run_benchmark(args):
+    if args.name == 'json':
+        benchmark.bench_weather_json(args.states, args.years, args.processes)
+    elif args.name == 'csv':
+        benchmark.bench_weather_csv(scale=args.scale, workers=args.processes)
+    elif args.name == 'risk':
+        benchmark.bench_risk(args.states, args.years)
+    elif args.name == 'stations':
+        benchmark.bench_stations(num_fires=args.fires)
+    elif args.name == 'suite':
+        num_regressions = benchmark.bench_suite(args.rows, args.states, args.years, args.repeat, not args.no_memory,
+                                                args.output, args.baseline, args.threshold)
+        # a non-zero exit status when a step regressed, e.g. to fail a ci job
+        if num_regressions > 0:
+            raise SystemExit(1)
+
+
+# compare two saved runs of the benchmark suite
+def compare_benchmarks(args):
+    num_regressions = benchmark.report_comparison(benchmark.load_results(args.baseline),
+                                                  benchmark.load_results(args.current), args.threshold)
+    if num_regressions > 0:
+        raise SystemExit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python .')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    # re-query the data sources and overwrite the local snapshots
+    parser_refresh = subparsers.add_parser('refresh', help='refresh the local data snapshots')
+    parser_refresh.add_argument('--from-year', type=int, default=1992)
+    parser_refresh.add_argument('--to-year', type=int, default=2015)
+    parser_refresh.set_defaults(func=refresh)
+
+    # print the memory used per column of the loaded data
+    parser_memory = subparsers.add_parser('memory', help='report the memory used by the loaded data')
+    parser_memory.add_argument('--compact', action='store_true', help='use the compact schema')
+    parser_memory.set_defaults(func=memory)
+
+    # compare the push-down sql aggregates with the pandas path
+    parser_check = subparsers.add_parser('check-pushdown', help='check the push-down mode against the pandas path')
+    parser_check.add_argument('--store', default=None, help='check the chunked mode on this store instead')
+    parser_check.add_argument('--chunk-rows', type=int, default=utils.CHUNK_ROWS)
+    parser_check.set_defaults(func=check_pushdown)
+
+    # fit and save the wildfire risk model
+    parser_risk = subparsers.add_parser('train-risk', help='train the wildfire risk model on the loaded data')
+    parser_risk.add_argument('--test-from-year', type=int, default=2012, help='evaluate on these years first')
+    parser_risk.add_argument('--output', default=risk.MODEL_FILE)
+    parser_risk.set_defaults(func=train_risk)
+
+    # build the partitioned store from the sqlite database
+    parser_store = subparsers.add_parser('store', help='write the sqlite wildfire data to a partitioned store')
+    parser_store.add_argument('--db', default='dataset/FPA_FOD_20170508.sqlite')
+    parser_store.add_argument('--directory', default=utils.WILDFIRE_STORE_DIR)
+    parser_store.add_argument('--min-fire-size', type=float, default=10)
+    parser_store.add_argument('--chunksize', type=int, default=200000)
+    parser_store.set_defaults(func=store)
+
+    # build the memory-mapped weather store from the visual crossing csv exports
+    parser_weather_store = subparsers.add_parser('weather-store', help='write the weather csv to a memory-mapped store')
+    parser_weather_store.add_argument('--input', default='input/weather_data.csv', help='csv file or pattern')
+    parser_weather_store.add_argument('--directory', default='dataset/weather_store')
+    parser_weather_store.set_defaults(func=weather_store)
+
+    # nearest-station weather of the fires
+    parser_attribute = subparsers.add_parser('attribute-weather', help='nearest station weather of the fires')
+    parser_attribute.add_argument('--from-year', type=int, default=1992)
+    parser_attribute.add_argument('--to-year', type=int, default=2015)
+    parser_attribute.add_argument('-k', type=int, default=3, help='stations averaged per fire')
+    parser_attribute.add_argument('--output', default='dataset/wildfire_weather.parquet')
+    parser_attribute.set_defaults(func=attribute_weather)
+
+    # pre-rendered state x year views of the pages
+    parser_prerender = subparsers.add_parser('prerender', help='pre-render the state x year views of the pages')
+    parser_prerender.add_argument('--output', default=utils.PRERENDERED_FILE)
+    parser_prerender.add_argument('--processes', type=int, default=None)
+    parser_prerender.add_argument('--full', action='store_true', help='render all the views again')
+    parser_prerender.set_defaults(func=prerender_views)
+
+    # offline benchmarks on generated data
+    parser_benchmark = subparsers.add_parser('benchmark', help='run an offline benchmark')
+    parser_benchmark.add_argument('name', choices=['json', 'csv', 'risk', 'stations', 'suite'])
+    parser_benchmark.add_argument('--states', type=int, default=50)
+    parser_benchmark.add_argument('--years', type=int, default=24)
+    parser_benchmark.add_argument('--processes', type=int, default=None, help='processes (json) or threads (csv)')
+    parser_benchmark.add_argument('--scale', type=int, default=50, help='copies of input/weather_data.csv (csv)')
+    parser_benchmark.add_argument('--fires', type=int, default=1000000, help='fires to attribute (stations)')
+    parser_benchmark.add_argument('--rows', type=int, default=1880000, help='wildfire rows (suite)')
+    parser_benchmark.add_argument('--repeat', type=int, default=3, help='timed calls per step (suite)')
+    parser_benchmark.add_argument('--no-memory', action='store_true', help='do not track the peak memory (suite)')
+    parser_benchmark.add_argument('--output', default=None, help='results json file (suite)')
+    parser_benchmark.add_argument('--baseline', default=None, help='results json file to compare with (suite)')
+    parser_benchmark.add_argument('--threshold', type=float, default=benchmark.REGRESSION_THRESHOLD)
+    parser_benchmark.set_defaults(func=run_benchmark)
+
+    # compare two runs of the benchmark suite and flag the regressions
+    parser_compare = subparsers.add_parser('compare-benchmarks', help='compare two runs of the benchmark suite')
+    parser_compare.add_argument('baseline')
+    parser_compare.add_argument('current')
+    parser_compare.add_argument('--threshold', type=float, default=benchmark.REGRESSION_THRESHOLD)
+    parser_compare.set_defaults(func=compare_benchmarks)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
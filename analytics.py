@@ -0,0 +1,416 @@
+import os
+import sys
+import zlib
+import pickle
+import hashlib
+import threading
+import functools
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+import pandas as pd
+
+import rollup
+import filters
+import spatial
+import joins
+import density
+import spans
+
+
+# chart computations of the pages without streamlit: pure functions of the prepared data and a normalized filter
+# (filters.WildfireFilter) returning chart-ready frames. Their results are kept in a process-wide LRU cache, bounded
+# in bytes and keyed by (function, dataset version, filter, arguments), so that a view asked by many sessions
+# (e.g. all states and years) is computed once. The callers get copies and may modify them. On a cache miss, the
+# results pre-rendered by python . prerender (see prerender.py) for the state x year views are used when they
+# were computed from the same data and code
+
+RESULT_CACHE_MB = int(os.environ.get('WILDFIRE_RESULT_CACHE_MB', '256'))
+PRERENDERED_FORMAT = 1
+PRERENDERED_DECODED_MB = 64  # decoded pre-rendered views kept in memory
+
+# modules whose code computes the results, a pre-rendered view of another version of them is not used
+CODE_MODULES = ['analytics.py', 'filters.py', 'rollup.py', 'spatial.py', 'timeseries.py', 'joins.py', 'density.py',
+                'features.py', 'risk.py']
+
+# columns of the weather measure and condition charts
+WEATHER_MEASURE_COLUMNS = ('temp', 'dew_point', 'sea_level_pressure', 'max_sustained_wind')
+WEATHER_CONDITION_COLUMNS = ('fog', 'rain_drizzle', 'thunder', 'tornado_funnel_cloud')
+
+# data of the wildfire charts: the key (dataset handle) versions the cached results, the indexes of the raw rows, of
+# the rollup cube and of the map cell cube and the time pyramid are None in push-down mode, where the backend answers
+# the queries
+WildfireData = namedtuple('WildfireData', ['key', 'index', 'cube_index', 'time_pyramid', 'cell_index', 'backend',
+                                           'fire_size_classes', 'states', 'fire_size_class_range'])
+
+# data of the weather charts: the indexed weather and wildfire rows, the key is a pair of dataset handles, the index
+# of the wildfire rows is None in chunked mode, where the backend streams the fires of a filter
+WeatherData = namedtuple('WeatherData', ['key', 'index', 'wildfire_index', 'backend', 'fire_size_classes'])
+
+# risk scores of the weather rows (region, date), indexed like them
+RiskData = namedtuple('RiskData', ['key', 'index'])
+
+MISSING = object()
+
+
+# approximate memory of a result in bytes
+def get_size(value):
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(index=True, deep=True))
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (tuple, list)):
+        return sum(get_size(item) for item in value)
+    if isinstance(value, dict):
+        return sum(get_size(item) for item in value.values())
+
+    return sys.getsizeof(value)
+
+
+# copy of a result returned to a caller, the cached value is never handed out
+def copy_result(value):
+    if isinstance(value, (pd.DataFrame, pd.Series, np.ndarray)):
+        return value.copy()
+    if isinstance(value, tuple):
+        return tuple(copy_result(item) for item in value)
+
+    return value
+
+
+# least recently used results up to max_bytes, shared by all sessions (each runs its script in its own thread)
+class ResultCache:
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.num_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return MISSING
+            self.entries.move_to_end(key)
+            self.hits += 1
+
+        return entry[0]
+
+    # a result larger than the whole cache is not kept
+    def put(self, key, value):
+        size = get_size(value)
+        if size > self.max_bytes:
+            return
+
+        with self.lock:
+            if key in self.entries:
+                self.num_bytes -= self.entries.pop(key)[1]
+            self.entries[key] = (value, size)
+            self.num_bytes += size
+            while self.num_bytes > self.max_bytes:
+                _, (_, evicted_size) = self.entries.popitem(last=False)
+                self.num_bytes -= evicted_size
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.num_bytes = 0
+
+    def get_stats(self):
+        with self.lock:
+            requests = self.hits + self.misses
+            stats = {
+                'entries': len(self.entries),
+                'MB': round(self.num_bytes / 2**20, 2),
+                'max_MB': round(self.max_bytes / 2**20, 2),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / requests, 3) if requests > 0 else None,
+                'evictions': self.evictions,
+            }
+
+        return pd.DataFrame([stats])
+
+
+result_cache = ResultCache(RESULT_CACHE_MB * 2**20)
+
+
+def get_code_version():
+    code_version = hashlib.sha1()
+    for filename in CODE_MODULES:
+        with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), filename), 'rb') as f:
+            code_version.update(f.read())
+
+    return code_version.hexdigest()
+
+
+CODE_VERSION = get_code_version()  # of the loaded modules
+
+
+# results of a function for a filter and arguments, lists in the arguments become tuples so that they are hashable
+def get_result_key(name, spec, args):
+    return name, spec, tuple(tuple(arg) if isinstance(arg, (list, np.ndarray)) else arg for arg in args)
+
+
+# artifact written by prerender.py: per view (kind of data, state, year) the fingerprint of its input rows and
+# its results (compressed pickle of {result key: result}), decoded when the view is first asked
+class PrerenderedViews:
+    def __init__(self, filename):
+        with open(filename, 'rb') as f:
+            artifact = pickle.load(f)
+
+        self.keys = artifact['keys']
+        self.views = artifact['views']
+        if artifact['format'] != PRERENDERED_FORMAT or artifact['code_version'] != CODE_VERSION:
+            self.views = {}
+        self.decoded = ResultCache(PRERENDERED_DECODED_MB * 2**20)
+
+    def __len__(self):
+        return len(self.views)
+
+    # pre-rendered result of a function for data of a kind and version (key), MISSING if there is none
+    def get(self, kind, key, name, spec, args):
+        view = (kind, spec.state, spec.year)
+        if self.keys.get(kind) != key or view not in self.views:
+            return MISSING
+
+        results = self.decoded.get(view)
+        if results is MISSING:
+            results = pickle.loads(zlib.decompress(self.views[view][1]))
+            self.decoded.put(view, results)
+
+        return results.get(get_result_key(name, spec, args), MISSING)
+
+
+prerendered = None
+
+
+# use the pre-rendered views of an artifact (None for none), in all sessions of the process
+def set_prerendered(views):
+    global prerendered
+    prerendered = views
+
+
+# decorator caching the result of func(data, spec, *args) in result_cache, under the version (key) of the data.
+# The results that are only used internally (copy=False) are returned as is and must not be modified
+def cached(copy=True):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(data, spec, *args):
+            name, spec, args = get_result_key(func.__name__, spec, args)
+            key = (name, data.key, spec, args)
+
+            result = result_cache.get(key)
+            if result is MISSING and prerendered is not None:
+                result = prerendered.get(type(data).__name__, data.key, name, spec, args)
+                if result is not MISSING:
+                    result_cache.put(key, result)
+            if result is MISSING:
+                with spans.span(func.__name__):
+                    result = func(data, spec, *args)
+                result_cache.put(key, result)
+
+            return copy_result(result) if copy else result
+
+        return wrapper
+
+    return decorator
+
+
+# percentage of the total of each value, as shown by the pie charts
+def get_percentages(values):
+    return (values / values.sum() * 100).round(decimals=2)
+
+
+# wildfire charts
+
+# rows of the wildfire data matching a filter (not cached, the rows are views of the shared data)
+def filter_rows(data, spec):
+    return filters.filter_wildfire(data.index, spec)
+
+
+# whether the charts of a filter are computed from the rollup cube: the size range is not a dimension of the cube,
+# so only no size range or the bounds of the selected classes are answered by it
+def uses_cube(data, spec):
+    if data.backend is not None:
+        return False
+    class_min, class_max = spec.fire_class or ('A', 'G')
+
+    return spec.fire_size in (None, (data.fire_size_class_range[class_min][0], data.fire_size_class_range[class_max][1]))
+
+
+# rollup cube of the rows of a filter with a custom size range
+@cached(copy=False)
+def get_filtered_cube(data, spec):
+    return rollup.build_wildfire_cube(filter_rows(data, spec))
+
+
+# incidents and acres per day, state, class and cause of a filter: a slice of the rollup cube, or the cube of the
+# filtered rows for a custom size range
+def get_fire_df(data, spec):
+    if uses_cube(data, spec):
+        df = filters.filter_wildfire(data.cube_index, spec._replace(fire_size=None, causes=None))
+    else:
+        df = get_filtered_cube(data, spec._replace(causes=None))
+    if spec.causes is not None:
+        df = df.loc[df['stat_cause'].isin(spec.causes)]
+
+    return df
+
+
+# points of the incidents of a filter (cell size None), or the incidents per grid cell and the cell size
+# when there are more than max_points incidents, from the cell cube unless the filter has a custom size or date range
+@cached()
+def get_map(data, spec, max_points):
+    if data.backend is not None:
+        cells_df = data.backend.aggregate_cells(spec, spatial.CELL_SIZES[-1])
+        if cells_df['incident'].sum() <= max_points:
+            return data.backend.select_points(spec), None
+    elif uses_cube(data, spec) and spec.date_from is None and spec.date_to is None:
+        # the cell cube has the years of the rows, not their dates
+        cells_df = filters.filter_wildfire(data.cell_index, spec._replace(fire_size=None))
+        if cells_df['incident'].sum() <= max_points:
+            return filter_rows(data, spec)[['latitude', 'longitude']], None
+        cells_df = spatial.group_cells(cells_df['cell_y'].values, cells_df['cell_x'].values,
+                                       cells_df['incident'].values, cells_df['fire_size'].values)
+    else:
+        df = filter_rows(data, spec)
+        if len(df) <= max_points:
+            return df[['latitude', 'longitude']], None
+        cells_df = spatial.get_cells(df)
+
+    return spatial.get_map_cells(cells_df)
+
+
+# total incidents and acres of a filter grouped by keys
+@cached()
+def aggregate(data, spec, keys):
+    if data.backend is not None:
+        return data.backend.aggregate(spec, keys)
+
+    return rollup.aggregate_wildfire(get_fire_df(data, spec), keys)
+
+
+# total incidents and acres per period ('D', 'M' or 'Y'), from the time pyramid when the filters are
+# dimensions of the cube
+@cached()
+def get_trend(data, spec, period):
+    if uses_cube(data, spec) and spec.causes is None:
+        selections, date_from, date_to = filters.get_series_selection(spec, data.fire_size_classes)
+        return data.time_pyramid.query(selections, date_from, date_to, period)
+
+    df = aggregate(data, spec, ['date'])
+    if period == 'D':
+        return df.set_index('date')
+
+    return df.resample(period, on='date').sum(numeric_only=True)
+
+
+# incidents (as a percentage of all incidents) and acres grouped by keys
+@cached()
+def get_shares(data, spec, keys):
+    df = aggregate(data, spec, keys)
+    df['incident'] = get_percentages(df['incident'])
+
+    return df
+
+
+# incidents with the values of one key as the rows and of another as the columns
+@cached()
+def get_pivot(data, spec, index, columns):
+    return aggregate(data, spec, [index, columns]).pivot(index=index, columns=columns, values='incident')
+
+
+# the n values of a key with the most incidents, in increasing order of incidents
+@cached()
+def get_top(data, spec, key, n=5):
+    return aggregate(data, spec, [key]).set_index(key).sort_values(by='incident').index[-n:].values
+
+
+# days with and without a fire per state, out of the days with a fire in any state
+@cached()
+def get_active_days(data, spec):
+    df = aggregate(data, spec, ['date', 'region'])
+    num_days = df['date'].nunique()
+    active_days = rollup.count_active_days(df, ['region']).set_index('region')['active_days']
+    active_days = active_days.reindex(data.states, fill_value=0)
+    active_df = pd.DataFrame({"days with no fire": num_days - active_days, "days with fire": active_days})
+    active_df.index.name = 'region'
+
+    return active_df
+
+
+# weather charts
+
+def filter_weather(data, spec):
+    return data.index.select(spec.state, spec.year, spec.date_from, spec.date_to)
+
+
+def filter_fires(data, spec):
+    return filters.filter_wildfire(data.wildfire_index, spec)[['date', 'region', 'fire_size_class', 'stat_cause',
+                                                               'fire_size']]
+
+
+# largest fire size class, incidents and acres per day and state of a filter (see joins.reduce_daily_fires)
+def get_daily_fires(data, spec):
+    if data.backend is not None:
+        return data.backend.reduce_daily_fires(spec, data.fire_size_classes)
+
+    return joins.reduce_daily_fires(filter_fires(data, spec), data.fire_size_classes)
+
+
+# weather rows of a filter with the largest fire size class of the day in their region
+@cached(copy=False)
+def get_daily_weather(data, spec):
+    return joins.join_daily(filter_weather(data, spec), get_daily_fires(data, spec), data.fire_size_classes)
+
+
+# daily temperatures with their month of year
+@cached()
+def get_month_temperatures(data, spec):
+    df = filter_weather(data, spec)[['date', 'temp', 'min_temp', 'max_temp']]
+
+    return df.assign(date_month=df['date'].dt.month)
+
+
+# incidents and acres per month of year
+@cached()
+def get_month_incidents(data, spec):
+    if data.backend is not None:
+        df = data.backend.aggregate(spec, ['date'])
+        df = df.assign(date_month=df['date'].dt.month)
+        return df.groupby('date_month')[['incident', 'fire_size']].sum().reset_index()
+
+    df = filter_fires(data, spec)[['date', 'fire_size']]
+    df = df.assign(date_month=df['date'].dt.month)
+
+    return df.groupby('date_month').agg(incident=('fire_size', 'size'), fire_size=('fire_size', 'sum')).reset_index()
+
+
+# fire size classes of the days (including the days without fire)
+@cached()
+def get_day_classes(data, spec):
+    return get_daily_weather(data, spec)['fire_size_class'].sort_values().unique()
+
+
+# density curves and means of weather columns per fire size class of the day
+@cached()
+def get_densities(data, spec, columns):
+    return density.get_densities(get_daily_weather(data, spec), list(columns), 'fire_size_class')
+
+
+# mean risk scores per day of the states of a filter
+@cached()
+def get_daily_risk(data, spec):
+    df = data.index.select(spec.state, spec.year, spec.date_from, spec.date_to)
+
+    return df.groupby('date')[['fire_probability', 'expected_acres']].mean()
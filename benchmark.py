@@ -0,0 +1,636 @@
+import os
+import glob
+import json
+import time
+import shutil
+import platform
+import datetime
+import resource
+import tempfile
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+import utils
+import ingest
+import analytics
+import filters
+import rollup
+import chunked
+import spatial
+import timeseries
+import features
+import risk
+import stations
+from filters import FilterIndex
+
+
+# offline benchmarks of the data loading and processing, on generated data with the same layout as the real exports
+
+US_STATES = ['AK', 'AL', 'AR', 'AZ', 'CA', 'CO', 'CT', 'DE', 'FL', 'GA', 'HI', 'IA', 'ID', 'IL', 'IN', 'KS', 'KY',
+             'LA', 'MA', 'MD', 'ME', 'MI', 'MN', 'MO', 'MS', 'MT', 'NC', 'ND', 'NE', 'NH', 'NJ', 'NM', 'NV', 'NY',
+             'OH', 'OK', 'OR', 'PA', 'RI', 'SC', 'SD', 'TN', 'TX', 'UT', 'VA', 'VT', 'WA', 'WI', 'WV', 'WY']
+FIRE_SIZE_CLASSES = ['A', 'B', 'C', 'D', 'E', 'F', 'G']
+
+
+# best wall time (in seconds) of repeated calls, and the result of the last call
+def time_call(func, *args, repeat=1, **kwargs):
+    best_time = None
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        result = func(*args, **kwargs)
+        elapsed = time.perf_counter() - start_time
+        best_time = elapsed if best_time is None else min(best_time, elapsed)
+
+    return best_time, result
+
+
+# timings, and speedups relative to the first one (the baseline) if relative
+def print_results(title, results, relative=True):
+    print(title)
+    baseline = results[0][1]
+    for name, elapsed in results:
+        if relative:
+            print("  {:<40} {:>9.2f}s {:>8.1f}x".format(name, elapsed, baseline / elapsed))
+        else:
+            print("  {:<40} {:>9.2f}s".format(name, elapsed))
+
+
+# write visual crossing json exports (one file per state and year) with random daily records
+def generate_weather_json(directory, states, years, seed=0):
+    rng = np.random.default_rng(seed)
+    conditions = [('Clear', 'clear-day', None), ('Partially cloudy', 'partly-cloudy-day', None),
+                  ('Rain, Overcast', 'rain', ['rain']), ('Snow, Overcast', 'snow', ['snow'])]
+
+    for state in states:
+        for year in years:
+            dates = pd.date_range('{}-01-01'.format(year), '{}-12-31'.format(year))
+            temp = rng.normal(55, 15, len(dates)).round(1)
+            days = []
+            for i, date in enumerate(dates):
+                condition, icon, preciptype = conditions[rng.integers(len(conditions))]
+                days.append({
+                    'datetime': date.strftime('%Y-%m-%d'), 'datetimeEpoch': int(date.timestamp()),
+                    'tempmax': temp[i] + 10, 'tempmin': temp[i] - 10, 'temp': temp[i], 'dew': temp[i] - 8,
+                    'humidity': round(float(rng.uniform(20, 100)), 1), 'precip': round(float(rng.exponential(0.1)), 2),
+                    'precipprob': 0.0, 'precipcover': 0.0, 'preciptype': preciptype, 'windgust': None,
+                    'windspeed': round(float(rng.uniform(0, 30)), 1), 'winddir': round(float(rng.uniform(0, 360)), 1),
+                    'pressure': round(float(rng.normal(1015, 8)), 1), 'cloudcover': round(float(rng.uniform(0, 100)), 1),
+                    'visibility': round(float(rng.uniform(2, 20)), 1), 'solarradiation': None, 'solarenergy': None,
+                    'uvindex': None, 'conditions': condition, 'icon': icon,
+                    'stations': ['KSTN{}'.format(j) for j in range(3)], 'source': 'obs'
+                })
+
+            filename = os.path.join(directory, 'weather_hist_{}_{}.json'.format(state, year))
+            with open(filename, 'w') as f:
+                json.dump({'queryCost': len(days), 'resolvedAddress': state, 'days': days}, f)
+
+
+# the previous loader of the json exports (json_normalize and a concat per file), used as the baseline
+def load_weather_json_serial(filename):
+    df = None
+    for json_file in sorted(glob.glob(filename)):
+        with open(json_file, 'r') as f:
+            weather_dict = json.loads(f.read())
+            tmp_df = pd.json_normalize(weather_dict, record_path=['days'])
+            tmp_df['region'] = ingest.get_region_from_filename(json_file)
+            df = tmp_df if df is None else pd.concat([df, tmp_df])
+
+    df.rename(columns={'datetime': 'date'}, inplace=True)
+    df['date'] = pd.to_datetime(df['date'])
+
+    return df
+
+
+def bench_weather_json(num_states=50, num_years=24, processes=None):
+    with tempfile.TemporaryDirectory() as directory:
+        generate_weather_json(directory, US_STATES[:num_states], range(1992, 1992 + num_years))
+        filename = os.path.join(directory, 'weather_hist_*_*.json')
+
+        results = []
+        elapsed, df = time_call(load_weather_json_serial, filename)
+        results.append(('serial json_normalize + concat per file', elapsed))
+        elapsed, df = time_call(ingest.ingest_weather_json, filename, processes=1)
+        results.append(('ingest_weather_json (1 process)', elapsed))
+        elapsed, df = time_call(ingest.ingest_weather_json, filename, processes=processes)
+        results.append(('ingest_weather_json (process pool)', elapsed))
+
+    print_results("Weather json ingest: {} files, {} rows".format(num_states * num_years, len(df)), results)
+
+    return results
+
+
+# the previous loader of the csv exports (type inference of every column, files read one by one), the baseline
+def load_weather_csv_serial(filename):
+    df_list = []
+    for file in sorted(glob.glob(filename)):
+        df_list.append(pd.read_csv(file, index_col=None, header=0))
+
+    df = pd.concat(df_list, ignore_index=True)
+    df['date'] = pd.to_datetime(df['date'])
+
+    return df
+
+
+# input/weather_data.csv (visual crossing export) copied scale times, read with the shared csv reader
+def bench_weather_csv(source='input/weather_data.csv', scale=50, workers=None):
+    with tempfile.TemporaryDirectory() as directory:
+        for i in range(scale):
+            shutil.copyfile(source, os.path.join(directory, 'weather_data_{:03d}.csv'.format(i)))
+        filename = os.path.join(directory, 'weather_data_*.csv')
+        schema, columns = ingest.WEATHER_VCROSS_CSV_SCHEMA, ingest.WEATHER_VCROSS_PAGE_COLUMNS
+
+        results = []
+        elapsed, df = time_call(load_weather_csv_serial, filename)
+        results.append(('serial read_csv, all columns inferred', elapsed))
+        elapsed, df = time_call(ingest.read_csv_files, filename, schema, columns, workers=1)
+        results.append(('read_csv_files (c, 1 thread)', elapsed))
+        elapsed, df = time_call(ingest.read_csv_files, filename, schema, columns, workers=workers)
+        results.append(('read_csv_files (c, thread pool)', elapsed))
+        elapsed, df = time_call(ingest.read_csv_files, filename, schema, columns, engine='pyarrow', workers=workers)
+        results.append(('read_csv_files (pyarrow, thread pool)', elapsed))
+
+    print_results("Weather csv ingest: {} files, {} rows, {} of {} columns".format(
+        scale, len(df), len(columns), len(schema)), results)
+
+    return results
+
+
+# daily weather rows of the noaa export (see utils.WEATHER_QUERY) for every state and day, with random values,
+# with the columns of utils.load_weather_data_gcp
+def generate_weather_frame(states, years, seed=0):
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range('{}-01-01'.format(years[0]), '{}-12-31'.format(years[-1]))
+    num_rows = len(states) * len(dates)
+
+    season = np.tile(np.sin(2 * np.pi * (dates.dayofyear.values - 100) / 365.25), len(states))
+    temp = 55 + 20 * season + rng.normal(0, 8, num_rows)
+    df = pd.DataFrame({
+        'date': np.tile(dates.values, len(states)),
+        'country': 'US',
+        'region': np.repeat(states, len(dates)),
+        'lat': np.repeat(rng.uniform(25, 49, len(states)), len(dates)),
+        'lon': np.repeat(rng.uniform(-124, -67, len(states)), len(dates)),
+        'count': rng.integers(1, 30, num_rows),
+        'temp': temp,
+        'dew_point': temp - rng.uniform(2, 25, num_rows),
+        'sea_level_pressure': rng.normal(1015, 8, num_rows),
+        'station_pressure': rng.normal(950, 40, num_rows),
+        'visibility': rng.uniform(2, 10, num_rows),
+        'wind_speed': rng.gamma(3, 2, num_rows),
+        'max_sustained_wind': rng.gamma(4, 3, num_rows),
+        'max_wind_gust': np.where(rng.random(num_rows) < 0.3, np.nan, rng.gamma(5, 4, num_rows)),
+        'max_temp': temp + rng.uniform(5, 15, num_rows),
+        'min_temp': temp - rng.uniform(5, 15, num_rows),
+        'precipitation': np.where(rng.random(num_rows) < 0.65, 0, rng.exponential(0.3, num_rows)),
+        'snow_depth': np.where(rng.random(num_rows) < 0.9, np.nan, rng.exponential(3, num_rows)),
+    })
+    for col in ['fog', 'rain_drizzle', 'snow_ice_pellets', 'hail', 'thunder', 'tornado_funnel_cloud']:
+        df[col] = (rng.random(num_rows) < 0.1).astype('int64')
+
+    return df
+
+
+# wildfires of the weather grid, more likely on hot and dry days
+def generate_wildfire_frame(weather_df, seed=0):
+    rng = np.random.default_rng(seed)
+    score = (weather_df['temp'].values - 55) / 20 - 3 * weather_df['precipitation'].values
+    fires = rng.random(len(weather_df)) < 1 / (1 + np.exp(-(score - 2)))
+    fire_size = 10 * np.exp(rng.exponential(1.2, fires.sum()))
+
+    return pd.DataFrame({
+        'date': weather_df['date'].values[fires],
+        'region': weather_df['region'].values[fires],
+        'stat_cause': 'Lightning',
+        'fire_size': fire_size,
+        'fire_size_class': pd.cut(fire_size, [10, 100, 300, 1000, 5000, np.inf], labels=list('CDEFG'),
+                                  right=False).astype(str),
+    })
+
+
+# features, training and scoring of the risk model on the full grid of states and days
+def bench_risk(num_states=50, num_years=24):
+    weather_df = generate_weather_frame(US_STATES[:num_states], list(range(1992, 1992 + num_years)))
+    wildfire_df = generate_wildfire_frame(weather_df)
+
+    results = []
+    elapsed, features_df = time_call(features.compute_features, weather_df)
+    results.append(('compute_features', elapsed))
+    elapsed, (model, metrics) = time_call(risk.train, weather_df, wildfire_df, FIRE_SIZE_CLASSES,
+                                          test_from_year=1992 + num_years - 4, features_df=features_df)
+    results.append(('train (newton + least squares)', elapsed))
+    elapsed, scores_df = time_call(model.score, features_df, repeat=3)
+    results.append(('score', elapsed))
+
+    print_results("Risk model: {} states x {} days = {} rows".format(
+        num_states, len(features_df) // num_states, len(features_df)), results, relative=False)
+    print("  scoring throughput: {:,.0f} rows/s".format(len(scores_df) / elapsed))
+    print("  evaluation on the last 4 years: {}".format(metrics))
+
+    return results
+
+
+# station-level weather (see utils.WEATHER_STATION_QUERY): stations at random us coordinates, each reporting on
+# most days, and fires at random coordinates and days
+def generate_station_weather_frame(num_stations, num_days, seed=0):
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range('2000-01-01', periods=num_days)
+    station_lat = rng.uniform(25, 49, num_stations)
+    station_lon = rng.uniform(-124, -67, num_stations)
+
+    reporting = rng.random(num_stations * num_days) < 0.8
+    station_codes = np.repeat(np.arange(num_stations), num_days)[reporting]
+    num_rows = len(station_codes)
+    df = pd.DataFrame({
+        'date': np.tile(dates.values, num_stations)[reporting],
+        'station': pd.Index(['{:06d}-99999'.format(i) for i in range(num_stations)])[station_codes],
+        'lat': station_lat[station_codes],
+        'lon': station_lon[station_codes],
+        'temp': rng.normal(60, 15, num_rows),
+        'precipitation': np.where(rng.random(num_rows) < 0.65, 0, rng.exponential(0.3, num_rows)),
+    })
+    df.loc[rng.random(num_rows) < 0.1, 'temp'] = np.nan
+
+    return df
+
+
+def generate_fires_frame(num_fires, num_days, seed=1):
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range('2000-01-01', periods=num_days)
+
+    return pd.DataFrame({
+        'latitude': rng.uniform(25, 49, num_fires),
+        'longitude': rng.uniform(-124, -67, num_fires),
+        'date': dates.values[rng.integers(0, num_days, num_fires)],
+    })
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+
+    return 2 * stations.EARTH_RADIUS * np.arcsin(np.sqrt(a))
+
+
+# row by row: haversine distance of each fire to every station reporting the column that day
+def attribute_weather_scan(fires_df, weather_df, columns, k=3, power=2):
+    days = {date: day_df for date, day_df in weather_df.groupby('date')}
+    result = {col: np.full(len(fires_df), np.nan) for col in columns}
+    for i, (lat, lon, date) in enumerate(fires_df[['latitude', 'longitude', 'date']].itertuples(index=False)):
+        day_df = days.get(date)
+        if day_df is None:
+            continue
+        for col in columns:
+            col_df = day_df.loc[day_df[col].notna()]
+            distances = haversine(lat, lon, col_df['lat'].values, col_df['lon'].values)
+            nearest = np.argsort(distances)[:k]
+            weights = 1 / np.maximum(distances[nearest], 1e-3) ** power
+            result[col][i] = (col_df[col].values[nearest] * weights).sum() / weights.sum()
+
+    return fires_df.assign(**result)
+
+
+# nearest-station weather of the fires with the kd-tree against a row by row haversine scan (on a sample)
+def bench_stations(num_stations=3000, num_fires=1000000, num_days=365, scan_fires=2000):
+    weather_df = generate_station_weather_frame(num_stations, num_days)
+    fires_df = generate_fires_frame(num_fires, num_days)
+    columns = ['temp', 'precipitation']
+
+    results = []
+    elapsed, _ = time_call(attribute_weather_scan, fires_df.iloc[:scan_fires], weather_df, columns)
+    results.append(('haversine scan (extrapolated)', elapsed * num_fires / scan_fires))
+    elapsed, station_index = time_call(stations.index_station_weather, weather_df)
+    results.append(('kd-tree index', elapsed))
+    elapsed, attributed_df = time_call(stations.attribute_weather, fires_df, weather_df, columns,
+                                       station_index=station_index)
+    results.append(('kd-tree attribution', elapsed))
+
+    scan_df = attribute_weather_scan(fires_df.iloc[:200], weather_df, columns)
+    max_error = max(np.nanmax(np.abs(scan_df[col].values - attributed_df[col].values[:200])) for col in columns)
+
+    print_results("Nearest-station weather: {:,} fires, {:,} stations x {} days ({:,} rows)".format(
+        num_fires, num_stations, num_days, len(weather_df)), results)
+    print("  max difference with the scan: {:.2e}, mean station distance: {:.1f} km".format(
+        max_error, attributed_df['station_distance'].mean()))
+
+    return results
+
+
+# benchmark suite of the loaders and of the computations of both pages, on synthetic data with the columns of
+# utils.load_wildfire_data_gcp / load_weather_data_gcp. The results (wall time, peak memory) are saved as json
+# and can be compared with a previous run to flag regressions
+
+SUITE_RESULTS_DIR = 'benchmarks'
+REGRESSION_THRESHOLD = 0.2  # slower (or larger) by more than this fraction
+REGRESSION_MIN_SECONDS = 0.025  # smaller time differences are noise
+REGRESSION_MIN_MB = 1.0  # smaller memory differences are noise
+
+# approximate distributions of the kaggle dataset (1.88M fires, 1992-2015)
+FIRE_CLASS_WEIGHTS = {'A': 666919, 'B': 939376, 'C': 220077, 'D': 28427, 'E': 14107, 'F': 7786, 'G': 3773}
+FIRE_CLASS_SIZES = {'A': (0.01, 0.25), 'B': (0.26, 9.9), 'C': (10, 99.9), 'D': (100, 299), 'E': (300, 999),
+                    'F': (1000, 4999), 'G': (5000, 600000)}
+STATE_WEIGHTS = {
+    'AK': 12, 'AL': 67, 'AR': 32, 'AZ': 72, 'CA': 190, 'CO': 34, 'CT': 4, 'DE': 0.2, 'FL': 90, 'GA': 169, 'HI': 10,
+    'IA': 5, 'ID': 37, 'IL': 3, 'IN': 3, 'KS': 26, 'KY': 27, 'LA': 30, 'MA': 3, 'MD': 4, 'ME': 13, 'MI': 10,
+    'MN': 45, 'MO': 18, 'MS': 79, 'MT': 41, 'NC': 111, 'ND': 21, 'NE': 14, 'NH': 3, 'NJ': 26, 'NM': 37, 'NV': 17,
+    'NY': 81, 'OH': 4, 'OK': 43, 'OR': 61, 'PA': 8, 'RI': 0.5, 'SC': 81, 'SD': 31, 'TN': 31, 'TX': 142, 'UT': 31,
+    'VA': 22, 'VT': 0.5, 'WA': 34, 'WI': 32, 'WV': 22, 'WY': 14
+}
+CAUSE_WEIGHTS = {
+    'Debris Burning': 429028, 'Miscellaneous': 323805, 'Arson': 281455, 'Lightning': 278468,
+    'Missing/Undefined': 166723, 'Equipment Use': 147612, 'Campfire': 76139, 'Children': 61167, 'Smoking': 52869,
+    'Railroad': 33455, 'Powerline': 14448, 'Fireworks': 11500, 'Structure': 3796
+}
+
+
+def get_weights(weights):
+    values = np.array(list(weights.values()), dtype='float64')
+
+    return list(weights), values / values.sum()
+
+
+# wildfire rows of the wildfire export (see utils.WILDFIRE_QUERY) with the class, state and cause skew of the
+# kaggle dataset, more fires in summer, coordinates scattered around a center per state
+def generate_wildfire_data(num_rows=1880000, states=US_STATES, years=range(1992, 2016), seed=0):
+    rng = np.random.default_rng(seed)
+    classes, class_p = get_weights(FIRE_CLASS_WEIGHTS)
+    states, state_p = get_weights({state: STATE_WEIGHTS[state] for state in states})
+    causes, cause_p = get_weights(CAUSE_WEIGHTS)
+
+    class_codes = rng.choice(len(classes), num_rows, p=class_p)
+    lows = np.log(np.array([FIRE_CLASS_SIZES[fire_class][0] for fire_class in classes]))[class_codes]
+    highs = np.log(np.array([FIRE_CLASS_SIZES[fire_class][1] for fire_class in classes]))[class_codes]
+    state_codes = rng.choice(len(states), num_rows, p=state_p)
+    centers = np.column_stack([rng.uniform(27, 47, len(states)), rng.uniform(-122, -70, len(states))])
+
+    dates = pd.date_range('{}-01-01'.format(years[0]), '{}-12-31'.format(years[-1]))
+    date_p = 1.5 + np.sin(2 * np.pi * (dates.dayofyear.values - 100) / 365.25)
+    days = rng.choice(len(dates), num_rows, p=date_p / date_p.sum())
+    minutes = rng.integers(0, 24 * 60, num_rows).astype('timedelta64[m]')
+
+    df = pd.DataFrame({
+        'date': dates.values[days] + minutes,
+        'region': np.array(states, dtype=object)[state_codes],
+        'stat_cause': np.array(causes, dtype=object)[rng.choice(len(causes), num_rows, p=cause_p)],
+        'latitude': centers[state_codes, 0] + rng.normal(0, 1.5, num_rows),
+        'longitude': centers[state_codes, 1] + rng.normal(0, 2, num_rows),
+        'fire_size': np.exp(rng.uniform(lows, highs)).round(2),
+        'fire_size_class': np.array(classes, dtype=object)[class_codes],
+    })
+
+    return df.sort_values('date', ignore_index=True)
+
+
+# best wall time of repeated calls, then the peak memory allocated (tracemalloc) during one more call
+def measure(func, repeat=1, memory=True):
+    elapsed, result = time_call(func, repeat=repeat)
+    peak_mb = None
+    if memory:
+        tracemalloc.start()
+        func()
+        peak_mb = tracemalloc.get_traced_memory()[1] / 2**20
+        tracemalloc.stop()
+
+    return {'seconds': elapsed, 'peak_MB': peak_mb}, result
+
+
+class Suite:
+    def __init__(self, repeat=3, memory=True):
+        self.repeat = repeat
+        self.memory = memory
+        self.steps = []
+
+    def run(self, name, func, repeat=None):
+        timing, result = measure(func, self.repeat if repeat is None else repeat, self.memory)
+        self.steps.append(dict(step=name, rows=len(result) if hasattr(result, '__len__') else None, **timing))
+        print("  {:<55} {:>9.3f}s {:>10}".format(name, timing['seconds'], '' if timing['peak_MB'] is None else
+                                                  '{:.1f} MB'.format(timing['peak_MB'])))
+
+        return result
+
+
+# loaders: the exports read by the local client (first load) and the snapshot (following loads), in directory
+def run_loader_steps(suite, directory, wildfire_df, weather_df):
+    wildfire_filename = os.path.join(directory, 'wildfire_data.csv')
+    weather_filename = os.path.join(directory, 'weather_noaa', 'weather_data_noaa_*.csv')
+    wildfire_df.to_csv(wildfire_filename, index=False)
+    os.makedirs(os.path.dirname(weather_filename))
+    weather_df = weather_df.rename(columns={'region': 'state'})
+    for year, year_df in weather_df.groupby(weather_df['date'].dt.year):
+        year_df.to_csv(weather_filename.replace('*', str(year)), index=False)
+
+    client = utils.LocalClient(wildfire_filename, weather_filename, os.path.join(directory, 'missing.sqlite'))
+    snapshot_dir = os.path.join(directory, 'snapshots')
+
+    # the snapshots are written relative to the working directory
+    cwd = os.getcwd()
+    os.chdir(directory)
+    try:
+        def load_cold(read):
+            shutil.rmtree(snapshot_dir, ignore_errors=True)
+            return read(client)
+
+        suite.run('load wildfire data (csv export)', lambda: load_cold(utils.read_wildfire_data_gcp), repeat=1)
+        wildfire_df = suite.run('load wildfire data (snapshot)', lambda: utils.read_wildfire_data_gcp(client))
+        suite.run('load wildfire data (compact)', lambda: utils.read_wildfire_data_gcp(client, compact=True))
+        suite.run('load weather data (csv export)', lambda: load_cold(utils.read_weather_data_gcp), repeat=1)
+        weather_df = suite.run('load weather data (snapshot)', lambda: utils.read_weather_data_gcp(client))
+        wildfire_df = suite.run('dataset registry (wildfire)',
+                                lambda: utils.DatasetRegistry().get('wildfire', lambda: wildfire_df))
+        weather_df = suite.run('dataset registry (weather)',
+                               lambda: utils.DatasetRegistry().get('weather', lambda: weather_df))
+    finally:
+        os.chdir(cwd)
+
+    return wildfire_df, weather_df
+
+
+# a chart of the analytics module timed on an empty result cache (computed from the data, as on the first run of a
+# filter) and on its cached result (as on the reruns of the page and the other sessions)
+def run_analytics_step(suite, name, func, *args):
+    def run_uncached():
+        analytics.result_cache.clear()
+        return func(*args)
+
+    result = suite.run(name, run_uncached)
+    suite.run(name + ' (cached)', lambda: func(*args))
+
+    return result
+
+
+# the charts of the wildfire page for a filter, computed by the analytics module like on the page
+def run_wildfire_page_steps(suite, name, data, spec):
+    run_analytics_step(suite, '[{}] map'.format(name), analytics.get_map, data, spec, utils.MAP_MAX_POINTS)
+    for period in (['D', 'M', 'Y'] if spec.year == 'All' else ['D', 'M']):
+        run_analytics_step(suite, '[{}] trend {}'.format(name, period), analytics.get_trend, data, spec, period)
+    for keys in [['region', 'fire_size_class'], ['fire_size_class'], ['region']]:
+        run_analytics_step(suite, '[{}] shares {}'.format(name, ' x '.join(keys)), analytics.get_shares, data, spec,
+                           keys)
+    for index, columns in [('region', 'fire_size_class'), ('year', 'fire_size_class'), ('year', 'region'),
+                           ('year', 'stat_cause'), ('stat_cause', 'fire_size_class'), ('region', 'stat_cause')]:
+        run_analytics_step(suite, '[{}] pivot {} x {}'.format(name, index, columns), analytics.get_pivot, data, spec,
+                           index, columns)
+    run_analytics_step(suite, '[{}] days with fire'.format(name), analytics.get_active_days, data, spec)
+    run_analytics_step(suite, '[{}] causes'.format(name), analytics.aggregate, data, spec, ['stat_cause'])
+
+
+# the charts of the weather page for a filter: monthly totals, joins with the daily fires (densities) and risk
+def run_weather_page_steps(suite, name, data, risk_data, spec):
+    run_analytics_step(suite, '[{}] temperatures by month'.format(name), analytics.get_month_temperatures, data,
+                       spec)
+    run_analytics_step(suite, '[{}] fires by month'.format(name), analytics.get_month_incidents, data, spec)
+    run_analytics_step(suite, '[{}] densities (measures)'.format(name), analytics.get_densities, data, spec,
+                       analytics.WEATHER_MEASURE_COLUMNS)
+    run_analytics_step(suite, '[{}] densities (conditions)'.format(name), analytics.get_densities, data, spec,
+                       analytics.WEATHER_CONDITION_COLUMNS)
+    run_analytics_step(suite, '[{}] risk chart'.format(name), analytics.get_daily_risk, risk_data, spec)
+
+
+# the chunked mode over a partitioned store of the rows: the peak memory of each step is bounded by the chunk size
+# (and the number of groups), compare with the same steps of the wildfire page on the loaded rows
+def run_chunked_steps(suite, directory, wildfire_df, spec, classes):
+    for i, start in enumerate(range(0, len(wildfire_df), chunked.CHUNK_ROWS)):
+        ingest.write_store_chunk(directory, wildfire_df.iloc[start:start + chunked.CHUNK_ROWS], i)
+    backend = chunked.ChunkedBackend(directory)
+
+    suite.run('[chunked] metadata', lambda: backend.get_metadata()[0], repeat=1)
+    suite.run('[chunked] map cells', lambda: backend.aggregate_cells(spec, spatial.CELL_SIZES[-1]))
+    suite.run('[chunked] trend D', lambda: backend.aggregate(spec, ['date']))
+    for keys in [['region', 'fire_size_class'], ['year', 'region'], ['date', 'region'], ['stat_cause']]:
+        suite.run('[chunked] aggregate {}'.format(' x '.join(keys)), lambda: backend.aggregate(spec, keys))
+    suite.run('[chunked] daily fires', lambda: backend.reduce_daily_fires(spec, classes)['keys'])
+
+
+def run_suite(num_rows=1880000, num_states=50, num_years=24, repeat=3, memory=True):
+    states = US_STATES[:num_states]
+    years = list(range(1992, 1992 + num_years))
+    suite = Suite(repeat, memory)
+    start_time = time.perf_counter()
+
+    print("Generating {:,} wildfire rows, {} states x {} years of weather".format(num_rows, num_states, num_years))
+    wildfire_df = generate_wildfire_data(num_rows, states, years)
+    weather_df = generate_weather_frame(states, years)
+
+    print("Loaders:")
+    with tempfile.TemporaryDirectory() as directory:
+        wildfire_df, weather_df = run_loader_steps(suite, directory, wildfire_df, weather_df)
+
+    print("Wildfire page:")
+    wildfire_index = suite.run('filter index (wildfire)', lambda: FilterIndex(wildfire_df), repeat=1)
+    cube_df = suite.run('rollup cube', lambda: rollup.build_wildfire_cube(wildfire_df), repeat=1)
+    cube_index = suite.run('filter index (cube)', lambda: FilterIndex(cube_df), repeat=1)
+    time_pyramid = suite.run('time pyramid', lambda: timeseries.TimePyramid(cube_df), repeat=1)
+    cell_df = suite.run('cell cube', lambda: spatial.build_cell_cube(wildfire_df), repeat=1)
+    cell_index = suite.run('filter index (cells)', lambda: FilterIndex(cell_df), repeat=1)
+    classes = list(FIRE_CLASS_WEIGHTS)
+    max_fire_size = int(wildfire_df['fire_size'].max()) + 1
+    top_state = wildfire_df['region'].value_counts().index[0]
+    scenarios = [
+        ('all', filters.make_wildfire_filter('C', 'G', 10, max_fire_size, max_fire_size)),
+        ('all classes', filters.make_wildfire_filter('A', 'G', 0, max_fire_size, max_fire_size)),
+        (top_state, filters.make_wildfire_filter('C', 'G', 10, max_fire_size, max_fire_size, state=top_state)),
+        (str(years[-1]), filters.make_wildfire_filter('C', 'G', 10, max_fire_size, max_fire_size, year=years[-1])),
+    ]
+    # versioned by the parameters of the generated data, the result cache is cleared by the uncached steps
+    wildfire_handle = utils.DatasetHandle('benchmark wildfire', (num_rows, num_states, num_years))
+    wildfire_data = analytics.WildfireData(wildfire_handle, wildfire_index, cube_index, time_pyramid, cell_index,
+                                           None, classes, states,
+                                           utils.get_wildfire_size_class_range(max_fire_size))
+    for name, spec in scenarios:
+        run_wildfire_page_steps(suite, name, wildfire_data, spec)
+
+    print("Chunked mode:")
+    with tempfile.TemporaryDirectory() as directory:
+        run_chunked_steps(suite, directory, wildfire_df.drop(columns=['incident', 'datetime'], errors='ignore'),
+                          scenarios[1][1],
+                          classes)
+
+    print("Weather page:")
+    weather_index = suite.run('filter index (weather)', lambda: FilterIndex(weather_df), repeat=1)
+    features_df = suite.run('weather features', lambda: features.compute_features(weather_df), repeat=1)
+    model, _ = suite.run('risk model (train)', lambda: risk.train(weather_df, wildfire_df, classes,
+                                                                  features_df=features_df), repeat=1)
+    risk_index = FilterIndex(suite.run('risk model (score)', lambda: model.score(features_df)))
+    weather_handle = utils.DatasetHandle('benchmark weather', (num_states, num_years))
+    weather_data = analytics.WeatherData((weather_handle, wildfire_handle), weather_index, wildfire_index, None,
+                                         classes)
+    risk_data = analytics.RiskData((weather_handle, wildfire_handle, 'benchmark'), risk_index)
+    for name, spec in [scenarios[0], scenarios[2], scenarios[3]]:
+        run_weather_page_steps(suite, name, weather_data, risk_data, spec)
+
+    return {
+        'created': datetime.datetime.now().isoformat(timespec='seconds'),
+        'params': {'rows': num_rows, 'states': num_states, 'years': num_years, 'repeat': repeat},
+        'environment': {'python': platform.python_version(), 'numpy': np.__version__, 'pandas': pd.__version__,
+                        'machine': platform.machine(), 'cpus': os.cpu_count()},
+        'total_seconds': time.perf_counter() - start_time,
+        'max_rss_MB': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**10,
+        'steps': suite.steps,
+    }
+
+
+def save_results(results, filename=None):
+    if filename is None:
+        filename = os.path.join(SUITE_RESULTS_DIR, 'suite-{}.json'.format(results['created'].replace(':', '')))
+    os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
+    with open(filename, 'w') as f:
+        json.dump(results, f, indent=1)
+
+    return filename
+
+
+def load_results(filename):
+    with open(filename) as f:
+        return json.load(f)
+
+
+# steps of both runs side by side, a step regressed if it is slower (or allocates more) by more than threshold
+def compare_results(baseline, current, threshold=REGRESSION_THRESHOLD):
+    baseline_df = pd.DataFrame(baseline['steps']).set_index('step')
+    current_df = pd.DataFrame(current['steps']).set_index('step')
+    df = baseline_df[['seconds', 'peak_MB']].join(current_df[['seconds', 'peak_MB']], how='outer',
+                                                 lsuffix='_baseline', rsuffix='_current')
+    df = df.reindex([step for step in current_df.index] + [step for step in baseline_df.index
+                                                           if step not in current_df.index])
+    df['ratio'] = df['seconds_current'] / df['seconds_baseline']
+
+    slower = (df['ratio'] > 1 + threshold) & (df['seconds_current'] - df['seconds_baseline'] > REGRESSION_MIN_SECONDS)
+    larger = (df['peak_MB_current'] > df['peak_MB_baseline'] * (1 + threshold)) & \
+        (df['peak_MB_current'] - df['peak_MB_baseline'] > REGRESSION_MIN_MB)
+    df['regression'] = np.where(slower & larger, 'time, memory',
+                                np.where(slower, 'time', np.where(larger, 'memory', '')))
+
+    return df
+
+
+def print_comparison(comparison):
+    print("  {:<55} {:>9} {:>9} {:>7} {:>10} {:>10}".format('step', 'baseline', 'current', 'ratio', 'base MB',
+                                                          'cur MB'))
+    for step, row in comparison.iterrows():
+        print("  {:<55} {:>8.3f}s {:>8.3f}s {:>6.2f}x {:>10.1f} {:>10.1f}  {}".format(
+            step, row['seconds_baseline'], row['seconds_current'], row['ratio'], row['peak_MB_baseline'],
+            row['peak_MB_current'], ('REGRESSION (' + row['regression'] + ')') if row['regression'] else ''))
+
+
+# run the suite, save the results and compare them with a baseline run, returns the number of regressions
+def bench_suite(num_rows=1880000, num_states=50, num_years=24, repeat=3, memory=True, output=None, baseline=None,
+                threshold=REGRESSION_THRESHOLD):
+    results = run_suite(num_rows, num_states, num_years, repeat, memory)
+    filename = save_results(results, output)
+    print("Results saved to {} ({:.1f}s, max rss {:.0f} MB)".format(filename, results['total_seconds'],
+                                                                   results['max_rss_MB']))
+    if baseline is None:
+        return 0
+
+    return report_comparison(load_results(baseline), results, threshold)
+
+
+def report_comparison(baseline, current, threshold=REGRESSION_THRESHOLD):
+    comparison = compare_results(baseline, current, threshold)
+    print("Comparison with the run of {}:".format(baseline['created']))
+    print_comparison(comparison)
+    num_regressions = int((comparison['regression'] != '').sum())
+    print("{} regression(s) above {:.0%}".format(num_regressions, threshold))
+
+    return num_regressions
@@ -0,0 +1,237 @@
+import os
+import glob
+import hashlib
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as parquet
+
+import ingest
+import joins
+import rollup
+import spatial
+from filters import WildfireFilter
+
+
+# chunked query mode: the wildfire filters and the grouped totals of the charts stream over the partitioned store
+# (see python . store) one chunk of rows at a time, and the partial aggregates of the chunks are combined (sums of
+# the incidents and acres, largest class per day), so the peak memory is bounded by the chunk size and the number
+# of groups instead of the number of rows, e.g. to serve the full dataset (classes A and B) on a small instance.
+# The partitions of the other states and years of a filter are not read. Same interface as pushdown.SQLBackend
+
+CHUNK_ROWS = 100000
+COMBINE_EVERY = 16  # partial aggregates kept before they are combined into one
+
+
+# rows of a chunk (one partition) matching a filter, the state and year were already selected by the partition
+def filter_chunk(df, spec):
+    mask = np.ones(len(df), dtype=bool)
+
+    if spec.year == 'All':
+        if spec.date_from is not None:
+            mask &= (df['date'] >= pd.Timestamp(spec.date_from)).values
+        if spec.date_to is not None:
+            mask &= (df['date'] < pd.Timestamp(spec.date_to) + pd.Timedelta(days=1)).values
+    if spec.fire_class is not None:
+        mask &= ((df['fire_size_class'] >= spec.fire_class[0]) & (df['fire_size_class'] <= spec.fire_class[1])).values
+    if spec.fire_size is not None:
+        mask &= ((df['fire_size'] >= spec.fire_size[0]) & (df['fire_size'] < spec.fire_size[1])).values
+    if spec.causes is not None:
+        mask &= df['stat_cause'].isin(spec.causes).values
+
+    return df if mask.all() else df.loc[mask]
+
+
+# rows of the buffered batches (and their regions) matching a filter, the dates without their time of day
+def get_chunk(batches, regions, spec, columns):
+    df = pa.concat_tables([pa.Table.from_batches([batch]) for batch in batches], promote_options='default').to_pandas()
+    if 'date' in df.columns:
+        df['date'] = ingest.normalize_dates(df['date'])
+    df['region'] = np.repeat(np.array(regions, dtype=object), [batch.num_rows for batch in batches])
+
+    return filter_chunk(df, spec)[columns]
+
+
+# columns read to apply a filter
+def get_filter_columns(spec):
+    columns = []
+    if spec.year == 'All' and (spec.date_from is not None or spec.date_to is not None):
+        columns.append('date')
+    if spec.fire_class is not None:
+        columns.append('fire_size_class')
+    if spec.fire_size is not None:
+        columns.append('fire_size')
+    if spec.causes is not None:
+        columns.append('stat_cause')
+
+    return columns
+
+
+# partial aggregates grouped by keys, combined (sum, max per column) whenever COMBINE_EVERY of them are kept,
+# so that they never hold more than COMBINE_EVERY times the number of groups
+class Partials:
+    def __init__(self, keys, how):
+        self.keys = list(keys)
+        self.how = how
+        self.frames = []
+
+    def add(self, df):
+        if len(df) > 0:
+            self.frames.append(df)
+        if len(self.frames) >= COMBINE_EVERY:
+            self.frames = [self.combine()]
+
+    # the combined aggregate sorted by the keys, None if no chunk had rows
+    def combine(self):
+        if len(self.frames) == 0:
+            return None
+
+        df = pd.concat(self.frames, ignore_index=True)
+
+        return df.groupby(self.keys, sort=True).agg(self.how).reset_index()
+
+
+# changes whenever a part file of the store is added, removed or rewritten, versions the backend and its results
+def get_store_version(directory):
+    signature = ingest.get_files_signature(os.path.join(ingest.get_store_partition(directory, '*', '*'), '*.parquet'))
+
+    return hashlib.sha1(repr(signature).encode('utf-8')).hexdigest()
+
+
+class ChunkedBackend:
+    def __init__(self, directory, chunk_rows=CHUNK_ROWS):
+        if not os.path.isdir(directory):
+            raise FileNotFoundError("No wildfire store found: {}".format(directory))
+
+        self.directory = directory
+        self.chunk_rows = chunk_rows
+        # (year, region, part files) of each partition
+        self.partitions = []
+        for partition in sorted(glob.glob(ingest.get_store_partition(directory, '*', '*'))):
+            year = os.path.basename(os.path.dirname(partition)).split('=', 1)[1]
+            region = os.path.basename(partition).split('=', 1)[1]
+            self.partitions.append((int(year), region, sorted(glob.glob(os.path.join(partition, '*.parquet')))))
+
+        self.version = get_store_version(directory)
+
+    # part files (with their region) of the partitions of the state and years of a filter
+    def get_files(self, spec):
+        year_min, year_max = None, None
+        if spec.year != 'All':
+            year_min, year_max = int(spec.year), int(spec.year)
+        else:
+            if spec.date_from is not None:
+                year_min = pd.Timestamp(spec.date_from).year
+            if spec.date_to is not None:
+                year_max = pd.Timestamp(spec.date_to).year
+
+        files = []
+        for year, region, part_files in self.partitions:
+            if spec.state != 'All' and region != spec.state:
+                continue
+            if (year_min is not None and year < year_min) or (year_max is not None and year > year_max):
+                continue
+            files.extend((region, filename) for filename in part_files)
+
+        return files
+
+    # rows of a filter with the given columns (and the region), about chunk_rows rows at a time: the small batches
+    # of the part files are buffered up to a chunk, so that the filters and groupings run once per chunk
+    def iter_chunks(self, spec, columns):
+        columns = list(columns)
+        read_columns = [col for col in dict.fromkeys(columns + get_filter_columns(spec)) if col != 'region']
+
+        batches, regions, num_rows = [], [], 0
+        for region, filename in self.get_files(spec):
+            for batch in parquet.ParquetFile(filename).iter_batches(batch_size=self.chunk_rows, columns=read_columns):
+                batches.append(batch)
+                regions.append(region)
+                num_rows += batch.num_rows
+                if num_rows >= self.chunk_rows:
+                    df = get_chunk(batches, regions, spec, columns)
+                    batches, regions, num_rows = [], [], 0
+                    if len(df) > 0:
+                        yield df
+        if num_rows > 0:
+            df = get_chunk(batches, regions, spec, columns)
+            if len(df) > 0:
+                yield df
+
+    # total incidents and acres grouped by keys (date, year, region, fire_size_class, stat_cause)
+    def aggregate(self, spec, keys):
+        keys = list(keys)
+        columns = list(dict.fromkeys('date' if key == 'year' else key for key in keys))
+        partials = Partials(keys, {'incident': 'sum', 'fire_size': 'sum'})
+        for df in self.iter_chunks(spec, columns + ['fire_size']):
+            partials.add(rollup.aggregate_wildfire(df, keys)[keys + ['incident', 'fire_size']])
+
+        df = partials.combine()
+        if df is None:
+            df = pd.DataFrame({key: pd.Series(dtype='datetime64[ns]' if key == 'date' else 'int64' if key == 'year'
+                                              else 'object') for key in keys})
+            df['incident'] = pd.Series(dtype='int64')
+            df['fire_size'] = pd.Series(dtype='float64')
+        if 'year' in keys:
+            df['year'] = df['year'].astype('int64')
+        df['incident'] = df['incident'].astype('int64')
+
+        return df
+
+    def select_points(self, spec):
+        df_list = list(self.iter_chunks(spec, ['latitude', 'longitude']))
+        if len(df_list) == 0:
+            return pd.DataFrame({'latitude': pd.Series(dtype='float64'), 'longitude': pd.Series(dtype='float64')})
+
+        return pd.concat(df_list, ignore_index=True)
+
+    # incidents and acres per map cell of cell_size degrees (see spatial.get_cells)
+    def aggregate_cells(self, spec, cell_size):
+        partials = Partials(['cell_y', 'cell_x'], {'incident': 'sum', 'fire_size': 'sum'})
+        for df in self.iter_chunks(spec, ['latitude', 'longitude', 'fire_size']):
+            partials.add(spatial.get_cells(df, cell_size))
+
+        df = partials.combine()
+        if df is None:
+            return spatial.group_cells(np.zeros(0, dtype='int64'), np.zeros(0, dtype='int64'),
+                                       np.zeros(0, dtype='int64'), np.zeros(0, dtype='float64'))
+
+        return df
+
+    # largest fire size class, incidents and acres per day and state of a filter (see joins.reduce_daily_fires)
+    def reduce_daily_fires(self, spec, classes):
+        partials = Partials(['day', 'region'], joins.DAILY_COMBINE)
+        for df in self.iter_chunks(spec, ['date', 'region', 'fire_size_class', 'fire_size']):
+            partials.add(joins.get_daily_frame(joins.reduce_daily_fires(df, classes)))
+
+        df = partials.combine()
+        if df is None:
+            df = joins.get_daily_frame(joins.reduce_daily_fires(
+                pd.DataFrame({'date': pd.Series(dtype='datetime64[ns]'), 'region': pd.Series(dtype='object'),
+                              'fire_size_class': pd.Series(dtype='object'),
+                              'fire_size': pd.Series(dtype='float64')}), classes))
+
+        return joins.from_daily_frame(df)
+
+    # option lists and ranges used by the forms, same as pushdown.SQLBackend.get_metadata, in one pass
+    def get_metadata(self):
+        fire_size_classes, regions, years, causes = set(), set(), set(), set()
+        max_fire_size, min_date, max_date = None, None, None
+        spec = WildfireFilter(None, None, 'All', 'All', None, None, None)
+        for df in self.iter_chunks(spec, ['date', 'region', 'fire_size_class', 'stat_cause', 'fire_size']):
+            fire_size_classes.update(df['fire_size_class'].dropna().unique())
+            regions.update(df['region'].unique())
+            years.update(df['date'].dt.year.unique())
+            causes.update(df['stat_cause'].dropna().unique())
+            chunk_max = df['fire_size'].max()
+            max_fire_size = chunk_max if max_fire_size is None else max(max_fire_size, chunk_max)
+            min_date = df['date'].min() if min_date is None else min(min_date, df['date'].min())
+            max_date = df['date'].max() if max_date is None else max(max_date, df['date'].max())
+        # the forms have no range to offer without a row (e.g. a store written from an empty database)
+        if max_fire_size is None:
+            raise ValueError("No wildfire rows found in the store: {}".format(self.directory))
+
+        lists = (np.array(sorted(fire_size_classes), dtype=object), np.array(sorted(regions), dtype=object),
+                 np.array([str(year) for year in sorted(years)]), np.array(sorted(causes), dtype=object))
+
+        return lists, (int(max_fire_size) + 1, pd.Timestamp(min_date), pd.Timestamp(max_date))
@@ -0,0 +1,90 @@
+import numpy as np
+import pandas as pd
+
+
+# kernel density estimates of the weather measures per group (e.g. fire_size_class), computed on all rows
+# so that only the curves are sent to the charts instead of the rows
+
+GRID_SIZE = 100  # evaluation points of each curve
+NUM_BINS = 512  # the rows are binned first, the kernel is evaluated on the bin centers
+
+
+# gaussian kernel bandwidth (normal reference rule, same as the vega density transform)
+def get_bandwidth(values):
+    if len(values) < 2:
+        return 1.0
+
+    q75, q25 = np.percentile(values, [75, 25])
+    spread = min(np.std(values, ddof=1), (q75 - q25) / 1.34)
+    if not spread > 0:
+        spread = np.std(values, ddof=1)
+    if not spread > 0:
+        return 1.0
+
+    return 1.06 * spread * len(values) ** -0.2
+
+
+# binary indicators (0 / 1 flags) get exact proportions instead of a smoothed curve
+def is_binary(values):
+    return len(values) > 0 and np.isin(values, (0, 1)).all()
+
+
+# densities of one column for all groups at once, on a grid shared by the groups: the rows are binned
+# (groups x bins counts) and the counts are multiplied by the kernel matrix (bins x grid)
+def get_column_density(values, group_codes, num_groups, extent, grid_size=GRID_SIZE, num_bins=NUM_BINS):
+    low, high = extent
+    if not high > low:
+        low, high = low - 0.5, high + 0.5
+
+    edges = np.linspace(low, high, num_bins + 1)
+    centers = (edges[:-1] + edges[1:]) / 2
+    bins = np.clip(np.searchsorted(edges, values, side='right') - 1, 0, num_bins - 1)
+    counts = np.bincount(group_codes * num_bins + bins, minlength=num_groups * num_bins).reshape(num_groups, num_bins)
+
+    bandwidths = np.array([get_bandwidth(values[group_codes == i]) for i in range(num_groups)])
+    grid = np.linspace(low, high, grid_size)
+    sizes = np.maximum(counts.sum(axis=1), 1)
+
+    densities = np.empty((num_groups, grid_size))
+    for i in range(num_groups):
+        kernel = np.exp(-0.5 * ((grid[:, None] - centers[None, :]) / bandwidths[i]) ** 2)
+        densities[i] = kernel @ counts[i] / (sizes[i] * bandwidths[i] * np.sqrt(2 * np.pi))
+
+    return grid, densities
+
+
+# density curves (or proportions of binary indicators) and means of columns per group, as a long frame
+# with the columns group_col, 'column', 'value', 'density' and 'mean'
+def get_densities(df, columns, group_col, grid_size=GRID_SIZE):
+    group_codes, groups = pd.factorize(df[group_col], sort=True)
+
+    df_list = []
+    for col in columns:
+        values = df[col].to_numpy(dtype='float64', na_value=np.nan)
+        valid = ~np.isnan(values)
+        values, codes = values[valid], group_codes[valid]
+        sizes = np.bincount(codes, minlength=len(groups))
+        means = np.bincount(codes, weights=values, minlength=len(groups)) / np.maximum(sizes, 1)
+
+        if is_binary(values):
+            grid = np.array([0.0, 1.0])
+            ones = np.bincount(codes, weights=values, minlength=len(groups))
+            densities = np.stack([sizes - ones, ones], axis=1) / np.maximum(sizes, 1)[:, None]
+        elif len(values) > 0:
+            grid, densities = get_column_density(values, codes, len(groups), (values.min(), values.max()), grid_size)
+        else:
+            continue
+
+        present = sizes > 0
+        df_list.append(pd.DataFrame({
+            group_col: np.repeat(np.asarray(groups)[present], len(grid)),
+            'column': col,
+            'value': np.tile(grid, present.sum()),
+            'density': densities[present].ravel(),
+            'mean': np.repeat(means[present], len(grid)),
+        }))
+
+    if len(df_list) == 0:
+        return pd.DataFrame(columns=[group_col, 'column', 'value', 'density', 'mean'])
+
+    return pd.concat(df_list, ignore_index=True)
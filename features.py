@@ -0,0 +1,126 @@
+import numpy as np
+import pandas as pd
+
+from filters import FilterIndex
+
+
+# daily weather features per region for the wildfire risk model: lags, rolling windows over calendar days,
+# dry-day streaks and seasonality. The frame is sorted once by (region, date) and each row is keyed by
+# region code * KEY_SPAN + day number, so the window of every row is found with one binary search over
+# all regions, and the windows are aggregated with prefix sums (sum, mean) or a sparse table (max)
+
+# (column, aggregation, window in days)
+ROLLING_FEATURES = [
+    ('temp', 'mean', 7), ('temp', 'mean', 30),
+    ('dew_point', 'mean', 7), ('dew_point', 'mean', 30),
+    ('max_temp', 'max', 7),
+    ('precipitation', 'sum', 7), ('precipitation', 'sum', 30),
+    ('max_wind_gust', 'max', 7), ('max_wind_gust', 'max', 30),
+    ('max_sustained_wind', 'max', 7),
+]
+
+# (column, lag in days), the value of the same region that many days before
+LAG_FEATURES = [('temp', 1), ('dew_point', 1), ('precipitation', 1)]
+
+# consecutive days without precipitation nor rain / drizzle, capped so that an append only needs the last days
+DRY_STREAK_MAX = 90
+
+# days of history needed to compute the features of a new day
+CONTEXT_DAYS = max([window for _, _, window in ROLLING_FEATURES] + [lag for _, lag in LAG_FEATURES] + [DRY_STREAK_MAX])
+
+KEY_SPAN = 1 << 20  # more days than any series spans
+
+
+def get_feature_columns():
+    columns = ['{}_{}_{}d'.format(col, agg, window) for col, agg, window in ROLLING_FEATURES]
+    columns += ['{}_lag_{}d'.format(col, lag) for col, lag in LAG_FEATURES]
+
+    return columns + ['dry_streak', 'day_of_year_sin', 'day_of_year_cos']
+
+
+# sum and number of the non-missing values of the rows [starts, stops), from prefix sums
+def get_window_sums(values, starts, stops):
+    valid = ~np.isnan(values)
+    sums = np.concatenate(([0.0], np.cumsum(np.where(valid, values, 0.0))))
+    counts = np.concatenate(([0], np.cumsum(valid)))
+
+    return sums[stops] - sums[starts], counts[stops] - counts[starts]
+
+
+# max of the non-missing values of the rows [starts, stops), from a sparse table of the maxima of 2^k rows
+def get_window_max(values, starts, stops):
+    lengths = stops - starts
+    max_length = int(lengths.max()) if len(lengths) > 0 else 0
+
+    table = [values]
+    while (1 << len(table)) <= max_length:
+        half = 1 << (len(table) - 1)
+        previous = table[-1]
+        table.append(np.fmax(previous[:-half], previous[half:]) if len(previous) > half else previous[:0])
+
+    result = np.full(len(values), np.nan)
+    nonempty = lengths > 0
+    levels = np.floor(np.log2(np.maximum(lengths, 1))).astype('int64')
+    for k in np.unique(levels[nonempty]):
+        rows = np.flatnonzero(nonempty & (levels == k))
+        result[rows] = np.fmax(table[k][starts[rows]], table[k][stops[rows] - (1 << k)])
+
+    return result
+
+
+# features of every row of a weather frame (date, region and the weather columns), sorted by (region, date)
+def compute_features(df):
+    index = FilterIndex(df)
+    sorted_df = index.df
+    days = index.dates.astype('datetime64[D]').astype('int64')
+    keys = index.codes.astype('int64') * KEY_SPAN + days
+    stops = np.arange(1, len(keys) + 1)
+
+    features = {'date': sorted_df['date'].values, 'region': sorted_df['region'].values}
+    for col, agg, window in ROLLING_FEATURES:
+        values = sorted_df[col].to_numpy(dtype='float64', na_value=np.nan)
+        starts = np.searchsorted(keys, keys - (window - 1), side='left')
+        name = '{}_{}_{}d'.format(col, agg, window)
+        if agg == 'max':
+            features[name] = get_window_max(values, starts, stops)
+        else:
+            sums, counts = get_window_sums(values, starts, stops)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                features[name] = np.where(counts > 0, sums / counts if agg == 'mean' else sums, np.nan)
+
+    for col, lag in LAG_FEATURES:
+        values = sorted_df[col].to_numpy(dtype='float64', na_value=np.nan)
+        positions = np.searchsorted(keys, keys - lag, side='left')
+        found = (positions < len(keys)) & (keys[np.minimum(positions, len(keys) - 1)] == keys - lag)
+        features['{}_lag_{}d'.format(col, lag)] = np.where(found, values[np.minimum(positions, len(keys) - 1)], np.nan)
+
+    # a streak restarts at a wet day, after a missing day or at the start of a region: the streak of a dry day
+    # counts the days since the last restart (including it if it was dry)
+    dry = (sorted_df['precipitation'].fillna(0).values == 0) & (sorted_df['rain_drizzle'].fillna(0).values == 0)
+    restarts = ~dry
+    restarts[:1] = True
+    restarts[1:] |= np.diff(keys) != 1
+    last_restarts = np.maximum.accumulate(np.where(restarts, np.arange(len(keys)), 0))
+    streaks = np.where(dry, keys - keys[last_restarts] + dry[last_restarts], 0)
+    features['dry_streak'] = np.minimum(streaks, DRY_STREAK_MAX)
+
+    day_of_year = sorted_df['date'].dt.dayofyear.values
+    features['day_of_year_sin'] = np.sin(2 * np.pi * day_of_year / 365.25)
+    features['day_of_year_cos'] = np.cos(2 * np.pi * day_of_year / 365.25)
+
+    return pd.DataFrame(features, index=sorted_df.index)
+
+
+# features of new days appended to the features of the history, only the last CONTEXT_DAYS of history are read
+def append_features(features_df, history_df, new_df):
+    start = new_df['date'].min() - pd.Timedelta(days=CONTEXT_DAYS)
+    context_df = history_df.loc[history_df['date'] >= start]
+    context_df = pd.concat([context_df, new_df], ignore_index=True)
+    context_df = context_df.drop_duplicates(subset=['region', 'date'], keep='last')
+
+    new_features = compute_features(context_df)
+    new_keys = pd.MultiIndex.from_frame(new_df[['region', 'date']])
+    new_features = new_features.loc[pd.MultiIndex.from_frame(new_features[['region', 'date']]).isin(new_keys)]
+    old_features = features_df.loc[~pd.MultiIndex.from_frame(features_df[['region', 'date']]).isin(new_keys)]
+
+    return FilterIndex(pd.concat([old_features, new_features], ignore_index=True)).df
\ No newline at end of file
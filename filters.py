@@ -0,0 +1,149 @@
+import datetime
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+
+# normalized selection of the wildfire filter widgets, a filter set to None is not applied
+WildfireFilter = namedtuple('WildfireFilter', ['fire_class', 'fire_size', 'state', 'year', 'date_from', 'date_to', 'causes'])
+
+
+def make_wildfire_filter(class_min, class_max, size_min, size_max, max_fire_size, state='All', year='All',
+                         date_from=None, date_to=None, causes=None, min_date=None, max_date=None):
+    fire_class = None if (class_min == 'A' and class_max == 'G') else (class_min, class_max)
+    fire_size = (size_min, size_max) if (size_min > 0 or size_max < max_fire_size) else None
+
+    # a selected year overrides the date range, a date range bound covering all the data (min_date / max_date)
+    # is not applied, so that the same selection always makes the same filter
+    if year != 'All':
+        year = int(year)
+        date_from, date_to = None, None
+    if date_from is not None and min_date is not None and pd.Timestamp(date_from) <= pd.Timestamp(min_date):
+        date_from = None
+    if date_to is not None and max_date is not None and \
+            pd.Timestamp(date_to) >= pd.Timestamp(max_date).normalize():
+        date_to = None
+    if causes is not None:
+        causes = tuple(sorted(causes))
+
+    return WildfireFilter(fire_class, fire_size, state, year, date_from, date_to, causes)
+
+
+# selected series and date range of a wildfire filter, for timeseries.TimePyramid.query
+# (the size range and causes are not dimensions of the pyramid)
+def get_series_selection(spec, fire_size_classes):
+    selections = {}
+    if spec.state != 'All':
+        selections['region'] = [spec.state]
+    if spec.fire_class is not None:
+        selections['fire_size_class'] = [fire_class for fire_class in fire_size_classes \
+                                         if spec.fire_class[0] <= fire_class <= spec.fire_class[1]]
+
+    if spec.year != 'All':
+        return selections, datetime.date(spec.year, 1, 1), datetime.date(spec.year, 12, 31)
+
+    return selections, spec.date_from, spec.date_to
+
+
+# filter engine over a frame sorted once by (region, date): each region is a contiguous block found
+# through an offset table, and a date or year range within a block is found by binary search, so
+# the common filters resolve to slices (views) of the sorted frame instead of full-column masks
+# frame in the row order of its FilterIndex (by region, rows without a region first, then by date), so that the
+# index is built on it without copying it, e.g. the datasets sorted once by their loader
+def sort_for_index(df, region_col='region', date_col='date'):
+    codes, _ = pd.factorize(df[region_col], sort=True)
+    order = np.lexsort((df[date_col].values, codes))
+    if (np.diff(order) == 1).all():
+        return df
+
+    return df.take(order)
+
+
+class FilterIndex:
+    def __init__(self, df, region_col='region', date_col='date'):
+        codes, regions = pd.factorize(df[region_col], sort=True)
+        dates = df[date_col].values
+        order = np.lexsort((dates, codes))
+
+        if (np.diff(order) == 1).all():
+            self.df = df
+        else:
+            self.df = df.take(order)
+        self.regions = pd.Index(regions)
+        self.codes = codes[order]
+        self.dates = dates[order]
+
+        # rows of region i are self.df[offsets[i]:offsets[i + 1]], rows without a region come first
+        self.offsets = np.searchsorted(self.codes, np.arange(len(regions) + 1))
+
+    def __len__(self):
+        return len(self.df)
+
+    def get_region_span(self, region):
+        if region not in self.regions:
+            return 0, 0
+        i = self.regions.get_loc(region)
+
+        return self.offsets[i], self.offsets[i + 1]
+
+    # narrow the rows [start, stop) of one region block to the dates between date_from and date_to (inclusive)
+    def get_date_span(self, start, stop, date_from=None, date_to=None):
+        dates = self.dates[start:stop]
+        lo = 0 if date_from is None else np.searchsorted(dates, np.datetime64(date_from, 'D'), side='left')
+        hi = len(dates) if date_to is None else \
+            np.searchsorted(dates, np.datetime64(date_to, 'D') + np.timedelta64(1, 'D'), side='left')
+
+        return start + lo, start + max(lo, hi)
+
+    def get_spans(self, region='All', year='All', date_from=None, date_to=None):
+        if year != 'All':
+            date_from = datetime.date(int(year), 1, 1)
+            date_to = datetime.date(int(year), 12, 31)
+
+        if region != 'All':
+            blocks = [self.get_region_span(region)]
+        else:
+            blocks = [(0, self.offsets[0])] + list(zip(self.offsets[:-1], self.offsets[1:]))
+
+        spans = [self.get_date_span(start, stop, date_from, date_to) for start, stop in blocks]
+
+        return [(start, stop) for start, stop in spans if stop > start]
+
+    def select(self, region='All', year='All', date_from=None, date_to=None):
+        spans = self.get_spans(region, year, date_from, date_to)
+
+        if len(spans) == 0:
+            return self.df.iloc[0:0]
+        if len(spans) == 1:
+            return self.df.iloc[spans[0][0]:spans[0][1]]
+        if sum(stop - start for start, stop in spans) == len(self.df):
+            return self.df
+
+        # a date range over all regions spans one slice per region, gather them in a single take
+        return self.df.iloc[np.concatenate([np.arange(start, stop) for start, stop in spans])]
+
+
+# mask of the rows of a column between two values (inclusive). Pandas cannot compare the read-only object arrays of
+# the shared frames with a scalar, so the values of an object column in range are found once and matched with isin
+def get_range_mask(series, lo, hi):
+    if series.dtype != object:
+        return (series >= lo) & (series <= hi)
+    values = [value for value in pd.unique(series.values) if isinstance(value, str) and lo <= value <= hi]
+
+    return series.isin(values)
+
+
+# apply a wildfire filter to an indexed frame (raw rows or rollup cube): state and dates through the index,
+# the remaining filters as masks on the already narrowed rows
+def filter_wildfire(index, spec):
+    df = index.select(spec.state, spec.year, spec.date_from, spec.date_to)
+
+    if spec.fire_class is not None:
+        df = df.loc[get_range_mask(df['fire_size_class'], spec.fire_class[0], spec.fire_class[1])]
+    if spec.fire_size is not None:
+        df = df.loc[(df['fire_size'] >= spec.fire_size[0]) & (df['fire_size'] < spec.fire_size[1])]
+    if spec.causes is not None:
+        df = df.loc[df['stat_cause'].isin(spec.causes)]
+
+    return df
@@ -0,0 +1,403 @@
+import os
+import re
+import glob
+import json
+import shutil
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from pyarrow import csv, parquet
+
+
+# declared schemas of the csv exports (column: dtype), date columns are parsed once while reading,
+# the noaa flags are floats since a flag may be missing
+
+WILDFIRE_CSV_SCHEMA = {
+    'date': 'datetime64[ns]', 'region': 'object', 'stat_cause': 'object', 'latitude': 'float64',
+    'longitude': 'float64', 'fire_size': 'float64', 'fire_size_class': 'object'
+}
+
+WEATHER_NOAA_CSV_SCHEMA = {
+    'date': 'datetime64[ns]', 'country': 'object', 'state': 'object', 'lat': 'float64', 'lon': 'float64',
+    'count': 'int64', 'temp': 'float64', 'dew_point': 'float64', 'sea_level_pressure': 'float64',
+    'station_pressure': 'float64', 'visibility': 'float64', 'wind_speed': 'float64',
+    'max_sustained_wind': 'float64', 'max_wind_gust': 'float64', 'max_temp': 'float64', 'min_temp': 'float64',
+    'precipitation': 'float64', 'snow_depth': 'float64', 'fog': 'float64', 'rain_drizzle': 'float64',
+    'snow_ice_pellets': 'float64', 'hail': 'float64', 'thunder': 'float64', 'tornado_funnel_cloud': 'float64'
+}
+
+# columns of the noaa export used by the weather page
+WEATHER_NOAA_PAGE_COLUMNS = ['date', 'state', 'temp', 'dew_point', 'sea_level_pressure', 'max_sustained_wind',
+                             'max_temp', 'min_temp', 'fog', 'rain_drizzle', 'thunder', 'tornado_funnel_cloud']
+
+# station-level noaa export (one row per station per day, see utils.WEATHER_STATION_QUERY)
+WEATHER_STATION_CSV_SCHEMA = {
+    'date': 'datetime64[ns]', 'station': 'object', 'state': 'object', 'lat': 'float64', 'lon': 'float64',
+    'temp': 'float64', 'dew_point': 'float64', 'sea_level_pressure': 'float64', 'wind_speed': 'float64',
+    'max_sustained_wind': 'float64', 'max_wind_gust': 'float64', 'max_temp': 'float64', 'min_temp': 'float64',
+    'precipitation': 'float64', 'fog': 'float64', 'rain_drizzle': 'float64', 'thunder': 'float64'
+}
+
+WEATHER_VCROSS_CSV_SCHEMA = {
+    'date': 'datetime64[ns]', 'tempmax': 'float64', 'tempmin': 'float64', 'temp': 'float64', 'dew': 'float64',
+    'humidity': 'float64', 'precip': 'float64', 'precipprob': 'float64', 'precipcover': 'float64',
+    'windgust': 'float64', 'windspeed': 'float64', 'winddir': 'float64', 'pressure': 'float64',
+    'cloudcover': 'float64', 'visibility': 'float64', 'solarradiation': 'float64', 'solarenergy': 'float64',
+    'uvindex': 'float64', 'conditions': 'category', 'icon': 'category', 'tzoffset': 'float64', 'region': 'object'
+}
+
+# columns of the visual crossing export used by the weather page (visual crossing version)
+WEATHER_VCROSS_PAGE_COLUMNS = ['date', 'region', 'temp', 'tempmin', 'tempmax', 'dew', 'pressure', 'windspeed',
+                               'precip', 'conditions']
+
+ARROW_TYPES = {
+    'datetime64[ns]': pa.timestamp('ns'), 'object': pa.string(), 'category': pa.dictionary(pa.int32(), pa.string()),
+    'float64': pa.float64(), 'float32': pa.float32(), 'int64': pa.int64(), 'int32': pa.int32(), 'int8': pa.int8()
+}
+
+
+# region of a visual crossing export, from its filename (e.g. weather_hist_CA_1992.json)
+VCROSS_FILENAME_PATTERN = re.compile(r'^weather_hist_(?P<region>[^_]+)_')
+
+
+def get_region_from_filename(filename):
+    match = VCROSS_FILENAME_PATTERN.match(os.path.basename(filename))
+    if match is None:
+        raise ValueError("Unexpected weather export filename: {}".format(filename))
+
+    return match.group('region')
+
+
+# parse one visual crossing json export into a frame of its daily records,
+# only scalar fields are kept (nested lists such as hours, stations or preciptype are not used)
+def parse_weather_json(filename):
+    with open(filename, 'rb') as f:
+        days = json.load(f)['days']
+
+    keys = {}
+    for day in days:
+        for key, value in day.items():
+            if not isinstance(value, (list, dict)):
+                keys[key] = None
+
+    df = pd.DataFrame.from_records(days, columns=list(keys))
+    df['region'] = get_region_from_filename(filename)
+
+    return df
+
+
+# load visual crossing json exports, parsed in parallel (one file per task) and concatenated once
+def ingest_weather_json(filename='dataset/weather_vcross/weather_hist_*_*.json', processes=None):
+    json_files = sorted(glob.glob(filename))
+    if len(json_files) == 0:
+        raise FileNotFoundError("No weather exports found: {}".format(filename))
+
+    if processes == 1:
+        df_list = [parse_weather_json(json_file) for json_file in json_files]
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            df_list = list(executor.map(parse_weather_json, json_files, chunksize=8))
+
+    df = pd.concat(df_list, ignore_index=True)
+    df.rename(columns={'datetime': 'date'}, inplace=True)
+    df['date'] = pd.to_datetime(df['date'])
+
+    return df
+
+
+# signature of the files matching a pattern, changes whenever a file is added, removed or modified
+def get_files_signature(filename):
+    return [(file, os.path.getmtime(file), os.path.getsize(file)) for file in sorted(glob.glob(filename))]
+
+
+# dates without their time of day, vectorized (instead of a round-trip through python date objects)
+def normalize_dates(series):
+    if getattr(series.dt, 'tz', None) is not None:
+        series = series.dt.tz_localize(None)
+
+    return series.dt.normalize()
+
+
+# read one csv file with a declared schema (column: dtype, for the columns it declares),
+# only the given columns (all of the file if None), with the c or pyarrow parser
+def read_csv_file(filename, schema, columns=None, engine='c'):
+    if engine == 'pyarrow':
+        column_types = {col: ARROW_TYPES[dtype] for col, dtype in schema.items() if columns is None or col in columns}
+        convert_options = csv.ConvertOptions(include_columns=columns, column_types=column_types)
+        df = csv.read_csv(filename, convert_options=convert_options).to_pandas()
+    else:
+        dtypes = {col: dtype for col, dtype in schema.items() if dtype != 'datetime64[ns]'}
+        df = pd.read_csv(filename, usecols=columns, dtype=dtypes)
+        for col in df.columns:
+            if schema.get(col) == 'datetime64[ns]':
+                df[col] = pd.to_datetime(df[col])
+
+    return df if columns is None else df[list(columns)]
+
+
+# read csv files matching a pattern with a thread pool (both parsers release the gil) and concatenate once
+def read_csv_files(filename, schema, columns=None, engine='c', workers=None):
+    csv_files = sorted(glob.glob(filename))
+    if len(csv_files) == 0:
+        raise FileNotFoundError("No csv files found: {}".format(filename))
+
+    if workers == 1 or len(csv_files) == 1:
+        df_list = [read_csv_file(file, schema, columns, engine) for file in csv_files]
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            df_list = list(executor.map(lambda file: read_csv_file(file, schema, columns, engine), csv_files))
+
+    df = pd.concat(df_list, ignore_index=True)
+
+    # string columns declared as categories may have different categories per file
+    for col in df.columns:
+        if schema.get(col) == 'category' and df[col].dtype != 'category':
+            df[col] = df[col].astype('category')
+
+    return df
+
+
+# original kaggle sqlite database (FPA_FOD_20170508.sqlite), the Fires table is streamed in chunks and each chunk
+# is converted to the schema of the wildfire export (see WILDFIRE_CSV_SCHEMA)
+
+FIRES_QUERY = "SELECT FIRE_YEAR, DISCOVERY_DATE, DISCOVERY_TIME, STATE, STAT_CAUSE_DESCR, LATITUDE, LONGITUDE, \
+                      FIRE_SIZE, FIRE_SIZE_CLASS \
+               FROM Fires WHERE {} ORDER BY FIRE_YEAR, DISCOVERY_DATE"
+
+JULIAN_UNIX_EPOCH = 2440587.5  # julian day of 1970-01-01 00:00
+
+
+# where clause and parameters of the filters pushed into the sqlite query
+def get_fires_where(min_fire_size=None, states=None, years=None):
+    conditions, params = [], []
+
+    if min_fire_size is not None:
+        conditions.append('FIRE_SIZE >= ?')
+        params.append(float(min_fire_size))
+    if states is not None:
+        conditions.append('STATE IN ({})'.format(', '.join('?' * len(states))))
+        params.extend(states)
+    if years is not None:
+        conditions.append('FIRE_YEAR IN ({})'.format(', '.join('?' * len(years))))
+        params.extend(int(year) for year in years)
+
+    where = ' AND '.join(conditions) if len(conditions) > 0 else '1 = 1'
+
+    return where, params
+
+
+# julian day numbers and hhmm discovery times to datetimes, vectorized
+def convert_fires_chunk(chunk):
+    hhmm = pd.to_numeric(chunk['DISCOVERY_TIME'], errors='coerce').fillna(0)
+    days = chunk['DISCOVERY_DATE'] - JULIAN_UNIX_EPOCH + (hhmm // 100 * 60 + hhmm % 100) / (24 * 60)
+
+    return pd.DataFrame({
+        'date': pd.to_datetime(days * 24 * 60, unit='m').dt.round('min'),
+        'region': chunk['STATE'],
+        'stat_cause': chunk['STAT_CAUSE_DESCR'],
+        'latitude': chunk['LATITUDE'],
+        'longitude': chunk['LONGITUDE'],
+        'fire_size': chunk['FIRE_SIZE'],
+        'fire_size_class': chunk['FIRE_SIZE_CLASS'],
+    })
+
+
+# yield the fires matching the filters, chunksize rows at a time, so the peak memory does not depend on the table size
+def read_fires_sqlite(filename='dataset/FPA_FOD_20170508.sqlite', min_fire_size=None, states=None, years=None,
+                      chunksize=200000):
+    if not os.path.exists(filename):
+        raise FileNotFoundError("No sqlite database found: {}".format(filename))
+
+    where, params = get_fires_where(min_fire_size, states, years)
+    # read-only, so that a missing file is not created and the database can be shared
+    connection = sqlite3.connect('file:{}?mode=ro'.format(filename), uri=True)
+    try:
+        for chunk in pd.read_sql_query(FIRES_QUERY.format(where), connection, params=params, chunksize=chunksize):
+            yield convert_fires_chunk(chunk)
+    finally:
+        connection.close()
+
+
+def ingest_fires_sqlite(filename='dataset/FPA_FOD_20170508.sqlite', min_fire_size=None, states=None, years=None,
+                        chunksize=200000):
+    df_list = [chunk for chunk in read_fires_sqlite(filename, min_fire_size, states, years, chunksize) if len(chunk) > 0]
+    if len(df_list) == 0:
+        return pd.DataFrame({col: pd.Series(dtype=dtype) for col, dtype in WILDFIRE_CSV_SCHEMA.items()})
+
+    return pd.concat(df_list, ignore_index=True)
+
+
+# partitioned columnar store of the wildfire data: one directory per year and state
+# (directory/year=YYYY/region=XX/part-N.parquet), so that loads only read the partitions they need
+
+def get_store_partition(directory, year, region):
+    return os.path.join(directory, 'year={}'.format(year), 'region={}'.format(region))
+
+
+# stream the fires of the sqlite database into a partitioned store, one part file per chunk and partition,
+# returns the number of rows written
+def write_wildfire_store(directory, filename='dataset/FPA_FOD_20170508.sqlite', min_fire_size=None, chunksize=200000):
+    # write to a temp directory first so readers never see a partial store (nor lose the previous one if it fails)
+    tmp_directory = directory.rstrip(os.sep) + '.tmp'
+    if os.path.exists(tmp_directory):
+        shutil.rmtree(tmp_directory)
+    os.makedirs(tmp_directory)
+
+    num_rows = 0
+    for i, chunk in enumerate(read_fires_sqlite(filename, min_fire_size, chunksize=chunksize)):
+        write_store_chunk(tmp_directory, chunk, i)
+        num_rows += len(chunk)
+
+    if os.path.exists(directory):
+        shutil.rmtree(directory)
+    os.replace(tmp_directory, directory)
+
+    return num_rows
+
+
+# write the rows of a chunk (with the columns of the wildfire export) to the part file i of their partitions
+def write_store_chunk(directory, chunk, i):
+    for (year, region), part_df in chunk.groupby([chunk['date'].dt.year, 'region'], sort=False):
+        partition = get_store_partition(directory, year, region)
+        os.makedirs(partition, exist_ok=True)
+        table = pa.Table.from_pandas(part_df.drop(columns='region'), preserve_index=False)
+        parquet.write_table(table, os.path.join(partition, 'part-{}.parquet'.format(i)))
+
+
+# read the partitions of the given states and years (all if None), with the columns of the wildfire export
+def read_wildfire_store(directory, states=None, years=None, columns=None):
+    if not os.path.isdir(directory):
+        raise FileNotFoundError("No wildfire store found: {}".format(directory))
+
+    partitions = []
+    for year in (['*'] if years is None else years):
+        for region in (['*'] if states is None else states):
+            partitions.extend(glob.glob(get_store_partition(directory, year, region)))
+
+    columns = list(WILDFIRE_CSV_SCHEMA) if columns is None else list(columns)
+    df_list = []
+    for partition in sorted(partitions):
+        table = parquet.read_table(partition, columns=[col for col in columns if col != 'region'])
+        df = table.to_pandas()
+        df['region'] = os.path.basename(partition).split('=', 1)[1]
+        df_list.append(df[columns])
+
+    if len(df_list) == 0:
+        return pd.DataFrame({col: pd.Series(dtype=WILDFIRE_CSV_SCHEMA[col]) for col in columns})
+
+    return pd.concat(df_list, ignore_index=True)
+
+
+# memory-mapped store of the visual crossing weather: one .npy file per column with the rows sorted by (region, date),
+# the row range of each region in index.json and the categories of the dictionary-encoded columns in
+# dictionaries.json. Opening maps the files without reading them, a selection binary-searches the dates of its
+# regions and only copies their rows, so only those pages of the files are read
+
+WEATHER_STORE_DICTIONARY_COLUMNS = ['conditions', 'icon']
+
+
+def get_weather_store_file(directory, col):
+    return os.path.join(directory, col + '.npy')
+
+
+def get_day_number(date):
+    return np.datetime64(pd.Timestamp(date).normalize(), 'D').astype('int64')
+
+
+# convert the visual crossing csv exports matching filename (e.g. input/weather_data.csv) into a store,
+# returns the number of rows written
+def write_weather_store(directory, filename='input/weather_data.csv', schema=WEATHER_VCROSS_CSV_SCHEMA):
+    df = read_csv_files(filename, schema, columns=list(schema))
+    df = df.sort_values(['region', 'date'], kind='mergesort', ignore_index=True)
+
+    # write to a temp directory first so readers never see a partial store
+    tmp_directory = directory.rstrip(os.sep) + '.tmp'
+    if os.path.exists(tmp_directory):
+        shutil.rmtree(tmp_directory)
+    os.makedirs(tmp_directory)
+
+    dictionaries = {}
+    for col in df.columns:
+        if col == 'region':
+            continue
+        if col == 'date':
+            values = normalize_dates(df[col]).values.astype('datetime64[D]').astype('int32')
+        elif col in WEATHER_STORE_DICTIONARY_COLUMNS:
+            codes, categories = pd.factorize(df[col], sort=True)
+            values = codes.astype('int16')
+            dictionaries[col] = [str(category) for category in categories]
+        else:
+            values = df[col].to_numpy(dtype='float64', na_value=np.nan)
+        np.save(get_weather_store_file(tmp_directory, col), values)
+
+    regions, starts = np.unique(df['region'].values.astype(str), return_index=True)
+    index = {
+        'columns': [col for col in df.columns if col != 'region'],
+        'regions': {region: [int(start), int(stop)] for region, start, stop in
+                    zip(regions, starts, list(starts[1:]) + [len(df)])},
+    }
+    with open(os.path.join(tmp_directory, 'index.json'), 'w') as f:
+        json.dump(index, f)
+    with open(os.path.join(tmp_directory, 'dictionaries.json'), 'w') as f:
+        json.dump(dictionaries, f)
+
+    if os.path.exists(directory):
+        shutil.rmtree(directory)
+    os.replace(tmp_directory, directory)
+
+    return len(df)
+
+
+class WeatherStore:
+    def __init__(self, directory):
+        if not os.path.isdir(directory):
+            raise FileNotFoundError("No weather store found: {}".format(directory))
+
+        with open(os.path.join(directory, 'index.json')) as f:
+            index = json.load(f)
+        with open(os.path.join(directory, 'dictionaries.json')) as f:
+            self.dictionaries = json.load(f)
+        self.columns = index['columns']
+        self.regions = {region: tuple(bounds) for region, bounds in index['regions'].items()}
+        self.arrays = {col: np.load(get_weather_store_file(directory, col), mmap_mode='r') for col in self.columns}
+
+    # row ranges of the regions (all if None) between two dates (inclusive, None for no bound)
+    def get_row_ranges(self, states=None, date_from=None, date_to=None):
+        dates = self.arrays['date']
+        ranges = []
+        for region in (sorted(self.regions) if states is None else states):
+            if region not in self.regions:
+                continue
+            start, stop = self.regions[region]
+            lo, hi = start, stop
+            if date_from is not None:
+                lo = start + int(np.searchsorted(dates[start:stop], get_day_number(date_from), side='left'))
+            if date_to is not None:
+                hi = start + int(np.searchsorted(dates[start:stop], get_day_number(date_to), side='right'))
+            if hi > lo:
+                ranges.append((region, lo, hi))
+
+        return ranges
+
+    # rows of the regions and dates, with the given columns (all if None) and the region
+    def read(self, states=None, date_from=None, date_to=None, columns=None):
+        columns = [col for col in self.columns if columns is None or col in columns]
+        ranges = self.get_row_ranges(states, date_from, date_to)
+
+        data = {}
+        for col in columns:
+            values = np.concatenate([self.arrays[col][lo:hi] for _, lo, hi in ranges]) if len(ranges) > 0 \
+                else self.arrays[col][:0]
+            if col == 'date':
+                data[col] = values.astype('datetime64[D]').astype('datetime64[ns]')
+            elif col in self.dictionaries:
+                data[col] = pd.Categorical.from_codes(values, categories=self.dictionaries[col])
+            else:
+                data[col] = np.array(values)
+        data['region'] = np.repeat(np.array([region for region, _, _ in ranges], dtype=object),
+                                   [hi - lo for _, lo, hi in ranges])
+
+        return pd.DataFrame(data)
@@ -0,0 +1,91 @@
+import numpy as np
+import pandas as pd
+
+
+# join of the daily weather rows with the wildfires of the same day and region, without streamlit:
+# the fires are first reduced to one row per (date, region), then aligned to the weather rows by integer keys,
+# so the join never has more rows than the weather data and keeps its order
+
+NO_FIRE = 'No Fire'
+
+
+# days since the epoch of a datetime column
+def get_day_numbers(dates):
+    return dates.values.astype('datetime64[D]').view('int64')
+
+
+# one row per (date, region) with the largest fire size class (as a code in classes), the number of fires and
+# their total acres, reduced over integer codes (no sort)
+def reduce_daily_fires(df, classes):
+    region_codes, regions = pd.factorize(df['region'])
+    days = get_day_numbers(df['date'])
+    keys = days * len(regions) + region_codes
+
+    key_codes, unique_keys = pd.factorize(keys)
+    class_codes = pd.Categorical(df['fire_size_class'], categories=classes).codes.astype('int64')
+    max_class = np.full(len(unique_keys), -1, dtype='int64')
+    np.maximum.at(max_class, key_codes, class_codes)
+
+    return {
+        'regions': regions,
+        'keys': pd.Index(unique_keys),
+        'fire_size_class': max_class,
+        'incident': np.bincount(key_codes, minlength=len(unique_keys)),
+        'fire_size': np.bincount(key_codes, weights=df['fire_size'].values, minlength=len(unique_keys)),
+    }
+
+
+# the daily fires of reduce_daily_fires as a frame (day number, region, class code, fires, acres), e.g. to combine
+# the reductions of chunks of rows: the largest class code (DAILY_COMBINE) and the sums of the fires and acres
+def get_daily_frame(daily):
+    keys = daily['keys'].values
+    num_regions = max(len(daily['regions']), 1)
+
+    return pd.DataFrame({
+        'day': keys // num_regions,
+        'region': np.asarray(daily['regions'], dtype=object)[keys % num_regions],
+        'fire_size_class': daily['fire_size_class'],
+        'incident': daily['incident'],
+        'fire_size': daily['fire_size'],
+    })
+
+
+DAILY_COMBINE = {'fire_size_class': 'max', 'incident': 'sum', 'fire_size': 'sum'}
+
+
+# daily fires (as returned by reduce_daily_fires) of a frame of daily fires (see get_daily_frame)
+def from_daily_frame(df):
+    region_codes, regions = pd.factorize(df['region'])
+
+    return {
+        'regions': regions,
+        'keys': pd.Index(df['day'].values.astype('int64') * len(regions) + region_codes),
+        'fire_size_class': df['fire_size_class'].values.astype('int64'),
+        'incident': df['incident'].values.astype('int64'),
+        'fire_size': df['fire_size'].values.astype('float64'),
+    }
+
+
+# weather rows with the largest fire size class of the day (NO_FIRE if none), the number of fires and their acres
+def join_daily_fires(weather_df, fire_df, classes, no_fire=NO_FIRE):
+    return join_daily(weather_df, reduce_daily_fires(fire_df, classes), classes, no_fire)
+
+
+# same as join_daily_fires, from the daily fires already reduced (see reduce_daily_fires)
+def join_daily(weather_df, daily, classes, no_fire=NO_FIRE):
+    region_codes = daily['regions'].get_indexer(weather_df['region'])
+    keys = get_day_numbers(weather_df['date']) * len(daily['regions']) + region_codes
+    positions = daily['keys'].get_indexer(keys)
+    positions[region_codes < 0] = -1
+    has_fire = positions >= 0
+    positions = positions[has_fire]
+
+    labels = np.append(np.asarray(classes, dtype=object), no_fire)
+    class_codes = np.full(len(weather_df), len(classes), dtype='int64')
+    class_codes[has_fire] = daily['fire_size_class'][positions]
+    incident = np.zeros(len(weather_df), dtype='int64')
+    incident[has_fire] = daily['incident'][positions]
+    fire_size = np.zeros(len(weather_df), dtype='float64')
+    fire_size[has_fire] = daily['fire_size'][positions]
+
+    return weather_df.assign(fire_size_class=labels[class_codes], incident=incident, fire_size=fire_size)
@@ -6,31 +6,69 @@ import altair as alt
 import pandas as pd
 
 import utils
-
-# load data and vars
+import filters
+import timeseries
+import analytics
+import startup
+import spans
+
+# start the independent loads at once, each section below renders as soon as the data it needs is ready
+page_startup = startup.Startup()
+page_trace = spans.start_trace('weather')
+spans.section('startup')
 client = utils.connect_gcp()
-wildfire_df = utils.load_wildfire_data_gcp(client)
-weather_df = utils.load_weather_data_gcp(client)
-list_fire_size_classes, _, list_years, list_causes = utils.get_wildfire_lists(wildfire_df)
-max_fire_size, min_date, max_date = utils.get_wildfire_ranges(wildfire_df)
-fire_size_class_range = utils.get_wildfire_size_class_range(max_fire_size)
-
-list_states = utils.get_weather_lists(weather_df)
-descr_dict = utils.load_descriptions_weather()
-shared_descr_dict = utils.load_descriptions_shared()
+if utils.QUERY_MODE != 'chunked':
+    page_startup.submit('wildfire data', utils.load_wildfire_data_gcp, client, compact=utils.COMPACT_DTYPES)
+page_startup.submit('weather data', utils.load_weather_data_gcp, client, compact=utils.COMPACT_DTYPES)
+page_startup.submit('descriptions', utils.load_descriptions, utils.DESCRIPTIONS_WEATHER_FILE)
+page_startup.submit('shared descriptions', utils.load_descriptions, utils.DESCRIPTIONS_SHARED_FILE)
 
 # tile and short background
 st.title("Weather and Wildfire Data")
 st.sidebar.header("Weather and Wildfire Data")
 st.sidebar.subheader("Background:")
+
+descr_dict = page_startup.get('descriptions')
+shared_descr_dict = page_startup.get('shared descriptions')
 for descr in descr_dict['header']:
     st.sidebar.markdown(descr)
 for descr in shared_descr_dict['header']:
     st.sidebar.markdown(descr)
 for descr in shared_descr_dict['caption']:
     st.sidebar.caption(descr)
+page_startup.mark('first paint')
+
+if utils.DEBUG:
+    debug_placeholder = st.sidebar.empty()
+
+# load data and vars
+spans.section('load data')
+with st.spinner("Loading the wildfire and weather data..."):
+    weather_df = page_startup.get('weather data')
+    weather_handle = utils.get_dataset_handle(weather_df)
+    if utils.QUERY_MODE == 'chunked':
+        # the fires of the charts are streamed over the partitioned store, the wildfire rows are not loaded
+        backend = utils.get_query_backend(client)
+        wildfire_df = None
+        wildfire_handle = utils.get_backend_handle(backend)
+        (list_fire_size_classes, _, list_years, list_causes), (max_fire_size, min_date, max_date) = \
+            utils.get_wildfire_metadata(backend)
+        weather_data = utils.get_weather_backend_analytics(weather_df, backend, weather_handle)
+    else:
+        backend = None
+        wildfire_df = page_startup.get('wildfire data')
+        wildfire_handle = utils.get_dataset_handle(wildfire_df)
+        list_fire_size_classes, _, list_years, list_causes = utils.get_wildfire_lists(wildfire_df, wildfire_handle)
+        max_fire_size, min_date, max_date = utils.get_wildfire_ranges(wildfire_df, wildfire_handle)
+        weather_data = utils.get_weather_analytics(weather_df, wildfire_df, weather_handle, wildfire_handle)
+    fire_size_class_range = utils.get_wildfire_size_class_range(max_fire_size)
+
+    list_states = utils.get_weather_lists(weather_df, weather_handle)
+    analytics.set_prerendered(utils.get_prerendered_views())
+page_startup.mark('widgets')
 
 # define forms
+spans.section('widgets')
 st.markdown("Use the following widgets to filter the data used in below charts:")
 left_col, right_col = st.columns((4, 1))
 choice_fire_class_min, choice_fire_class_max = left_col.select_slider("Filter by Fire Size Class:", list_fire_size_classes, \
@@ -49,49 +87,22 @@ choice_date_to = right_col.date_input("", min_value=choice_date_from, max_value=
 choice_cause = st.multiselect("Cause of Fire:", list_causes, default=list_causes)
 
 # filter data based on form inputs
-wildfire_df = wildfire_df[['date', 'region', 'fire_size_class', 'stat_cause', 'fire_size', 'incident']]
-if choice_fire_class_min != 'A' or choice_fire_class_max != 'G':
-    wildfire_df = wildfire_df.loc[(wildfire_df['fire_size_class'] >= choice_fire_class_min) & \
-        (wildfire_df['fire_size_class'] <= choice_fire_class_max)]
-if choice_fire_size_min > 0 or choice_fire_size_max < max_fire_size:
-    wildfire_df = wildfire_df.loc[(wildfire_df['fire_size'] >= choice_fire_size_min) & \
-        (wildfire_df['fire_size'] < choice_fire_size_max)]
-
-if choice_state != 'All':
-    wildfire_df = wildfire_df.loc[wildfire_df['region'] == choice_state]
-    weather_df = weather_df.loc[weather_df['region'] == choice_state]
-
-if choice_year != 'All':
-    choice_year = int(choice_year)
-    wildfire_df = wildfire_df.loc[wildfire_df['date'].dt.year == choice_year]
-    weather_df = weather_df.loc[weather_df.date.dt.year == choice_year]
-else:
-    wildfire_df = wildfire_df.loc[(wildfire_df['date'].dt.date >= choice_date_from) & (wildfire_df['date'].dt.date <= choice_date_to)]
-    weather_df = weather_df.loc[(weather_df['date'].dt.date >= choice_date_from) & (weather_df['date'].dt.date <= choice_date_to)]
-
-wildfire_df = wildfire_df.loc[wildfire_df['stat_cause'].isin(choice_cause)]
-
-# merge the weather dataframe with the wildfire dataframe
-merged_df = weather_df.merge(wildfire_df, how='left')
-merged_df[['fire_size', 'incident']] = merged_df[['fire_size', 'incident']].fillna(0)
-merged_df[['fire_size_class', 'stat_cause']] = merged_df[['fire_size_class', 'stat_cause']].fillna('No Fire')
-# merged_df.fillna(0, inplace=True)
-merged_df.sort_values(by=['date', 'region', 'fire_size_class'], inplace=True)
-merged_df.drop(columns=['fire_size', 'stat_cause'], inplace=True)
-merged_df.drop_duplicates(subset=['date', 'region'], keep='last', inplace=True)
+spans.section('filter')
+# the charts below are computed by analytics.py (cached per filter for all sessions)
+weather_filter = filters.make_wildfire_filter(choice_fire_class_min, choice_fire_class_max, \
+    choice_fire_size_min, choice_fire_size_max, max_fire_size, choice_state, choice_year, choice_date_from, choice_date_to, \
+    causes=choice_cause)
 
 # display temperatures and wildfires by month of year
+spans.section('month charts')
 st.header("Temperature vs. Wildfires by Month of Year")
-tmp_df = weather_df[['date', 'temp', 'min_temp', 'max_temp']]
-tmp_df['date_month'] = tmp_df.date.dt.month
+tmp_df = analytics.get_month_temperatures(weather_data, weather_filter)
 chart1 = alt.Chart(tmp_df, width=600, height=200).mark_boxplot(extent='min-max').encode(
     x='date_month:O',
     y=alt.Y('temp:Q', scale=alt.Scale(zero=False))
 )
 
-tmp_df = wildfire_df[['date', 'incident', 'fire_size']]
-tmp_df['date_month'] = tmp_df.date.dt.month
-tmp_df = tmp_df.groupby('date_month').sum(numeric_only=True).reset_index()
+tmp_df = analytics.get_month_incidents(weather_data, weather_filter)
 chart2 = alt.Chart(tmp_df, width=600, height=50).mark_area().encode(
     x='date_month:N',
     y='incident:Q'
@@ -106,104 +117,138 @@ else:
 
 
 # display
+spans.section('weather measure charts')
 st.header("Weather Measurements & Data Distribution")
 tabs = st.tabs(["Temperature", "Dew Point", "Sea Level Pressure", "Max Sustained Wind"])
-col_list = ['temp', 'dew_point', 'sea_level_pressure', 'max_sustained_wind']
+col_list = analytics.WEATHER_MEASURE_COLUMNS
 
-if len(merged_df.index) > len(weather_df.index) * 0.2:
-    merged_df = merged_df.sample(int(len(weather_df.index) * 0.2))
+# density curves and means of all the rows per fire size class, computed here instead of by the charts
+density_df = analytics.get_densities(weather_data, weather_filter, col_list)
 
 i = 0
-col_width = 100 * (len(list_fire_size_classes) + 1) / len(merged_df['fire_size_class'].sort_values().unique()) - 15
+col_width = 100 * (len(list_fire_size_classes) + 1) / max(len(analytics.get_day_classes(weather_data, weather_filter)), 1) - 15
 for col in col_list:
-    tmp_df = merged_df[['date', 'fire_size_class', col]]
+    tmp_df = density_df.loc[density_df['column'] == col].rename(columns={'value': col}).drop(columns='column')
 
     with tabs[i]:
-        scale_range = (min(tmp_df[col]), max(tmp_df[col]))
+        # no rows match the filters (e.g. a state and year without wildfire days)
+        if len(tmp_df) == 0:
+            st.info("No weather data for the selected filters.")
+        else:
+            scale_range = (float(min(tmp_df[col])), float(max(tmp_df[col])))
         
-        violins =  alt.Chart().transform_density(
-            col, 
-            as_=[col, 'density'], 
-            groupby=['fire_size_class']
-        ).mark_area(orient='horizontal').encode(
-            x=alt.X('density:Q', 
-                    stack='center', 
-                    impute=None, 
-                    title=None,
-                    axis=alt.Axis(labels=False, 
-                                  values=[0], 
-                                  grid=False, 
-                                  ticks=False)),
-            y=alt.Y(col + ':Q', 
-                    scale=alt.Scale(domain=[scale_range[0], scale_range[1]])),
-            color=alt.Color('fire_size_class:N', 
-                            legend=None)
-        )
-
-        chart = alt.layer(
-            violins,
-            alt.Chart().mark_rule(clip=False).encode(
-                y='mean('+col+'):Q',
-                color=alt.value('black')),
-        ).properties(
-            width=col_width
-        ).facet(
-            data=tmp_df,
-            column=alt.Column('fire_size_class:N')
-        )
-
-        st.altair_chart(chart)
+            violins =  alt.Chart().mark_area(orient='horizontal').encode(
+                x=alt.X('density:Q', 
+                        stack='center', 
+                        impute=None, 
+                        title=None,
+                        axis=alt.Axis(labels=False, 
+                                      values=[0], 
+                                      grid=False, 
+                                      ticks=False)),
+                y=alt.Y(col + ':Q', 
+                        scale=alt.Scale(domain=[scale_range[0], scale_range[1]])),
+                color=alt.Color('fire_size_class:N', 
+                                legend=None)
+            )
+
+            chart = alt.layer(
+                violins,
+                alt.Chart().mark_rule(clip=False).encode(
+                    y=alt.Y('mean(mean):Q', title=col),
+                    color=alt.value('black')),
+            ).properties(
+                width=col_width
+            ).facet(
+                data=tmp_df,
+                column=alt.Column('fire_size_class:N')
+            )
+
+            st.altair_chart(chart)
 
         expander = st.expander(shared_descr_dict["charts"]["label"])
         expander.markdown(descr_dict["charts"]["weather_measures"][col])
 
     i = i + 1
 
+spans.section('weather condition charts')
 st.header("Weather Conditions & Data Distribution")
 tabs = st.tabs(["Fog", "Rain/Drizzle",  "Thunder", "Tornado/Funnel Cloud"])
-col_list = ['fog', 'rain_drizzle', 'thunder', 'tornado_funnel_cloud']
+col_list = analytics.WEATHER_CONDITION_COLUMNS
+density_df = analytics.get_densities(weather_data, weather_filter, col_list)
 
 i = 0
-col_width = 100 * (len(list_fire_size_classes) + 1) / len(merged_df['fire_size_class'].sort_values().unique()) - 15
+col_width = 100 * (len(list_fire_size_classes) + 1) / max(len(analytics.get_day_classes(weather_data, weather_filter)), 1) - 15
 for col in col_list:
-    tmp_df = merged_df[['date', 'fire_size_class', col]] 
+    tmp_df = density_df.loc[density_df['column'] == col].rename(columns={'value': col}).drop(columns='column')
     with tabs[i]:
-        scale_range = (min(tmp_df[col]), max(tmp_df[col]))
+        # no rows match the filters (e.g. a state and year without wildfire days)
+        if len(tmp_df) == 0:
+            st.info("No weather data for the selected filters.")
+        else:
+            # padded so that the bars at 0 and 1 fit
+            scale_range = (float(min(tmp_df[col])) - 0.5, float(max(tmp_df[col])) + 0.5)
         
-        violins =  alt.Chart().transform_density(
-            col, 
-            as_=[col, 'density'], 
-            groupby=['fire_size_class']
-        ).mark_area(orient='horizontal').encode(
-            x=alt.X('density:Q', 
-                    stack='center', 
-                    impute=None, 
-                    title=None,
-                    axis=alt.Axis(labels=False, 
-                                  values=[0], 
-                                  grid=False, 
-                                  ticks=False)),
-            y=alt.Y(col + ':Q', 
-                    scale=alt.Scale(domain=[scale_range[0], scale_range[1]])),
-            color=alt.Color('fire_size_class:N', 
-                            legend=None)
-        )
-
-        chart = alt.layer(
-            violins,
-            alt.Chart().mark_rule(clip=False).encode(
-                y='mean('+col+'):Q',
-                color=alt.value('black')),
-        ).properties(
-            width=col_width
-        ).facet(
-            data=tmp_df,
-            column=alt.Column('fire_size_class:N')
-        )
-
-        st.altair_chart(chart)
+            # share of days without / with the condition
+            violins =  alt.Chart().mark_bar(orient='horizontal', size=20).encode(
+                x=alt.X('density:Q', 
+                        stack='center', 
+                        impute=None, 
+                        title=None,
+                        axis=alt.Axis(labels=False, 
+                                      values=[0], 
+                                      grid=False, 
+                                      ticks=False)),
+                y=alt.Y(col + ':Q', 
+                        scale=alt.Scale(domain=[scale_range[0], scale_range[1]])),
+                color=alt.Color('fire_size_class:N', 
+                                legend=None)
+            )
+
+            chart = alt.layer(
+                violins,
+                alt.Chart().mark_rule(clip=False).encode(
+                    y=alt.Y('mean(mean):Q', title=col),
+                    color=alt.value('black')),
+            ).properties(
+                width=col_width
+            ).facet(
+                data=tmp_df,
+                column=alt.Column('fire_size_class:N')
+            )
+
+            st.altair_chart(chart)
 
         expander = st.expander(shared_descr_dict["charts"]["label"])
         expander.markdown(descr_dict["charts"]["weather_conditions"][col])
 
     i = i + 1
+
+
+# display the modelled risk of wildfires, per day for the selected state (averaged over the states if all)
+spans.section('risk charts')
+st.header("Wildfire Risk")
+with st.spinner("Scoring the wildfire risk..."):
+    risk_data = utils.get_risk_analytics(weather_df, wildfire_df, weather_handle, wildfire_handle, backend)
+risk_df = analytics.get_daily_risk(risk_data, weather_filter)
+left_col, right_col = st.columns(2)
+left_col.line_chart(timeseries.downsample(risk_df, 'fire_probability')[['fire_probability']] \
+    .rename(columns={'fire_probability': 'probability of a fire (class C or larger)'}))
+right_col.line_chart(timeseries.downsample(risk_df, 'expected_acres')[['expected_acres']] \
+    .rename(columns={'expected_acres': 'expected acres'}))
+st.caption("Logistic regression on the rolling weather features of the last 7 and 30 days (temperature, dew point, " \
+    "precipitation, wind, dry days) and the state, see risk.py.")
+page_startup.mark('charts')
+spans.end_trace()
+
+# debug information (loaded datasets, startup timings, stages of this run, result cache) in the sidebar
+if utils.DEBUG:
+    with debug_placeholder.container():
+        expander = st.expander("Dataset Registry")
+        expander.dataframe(utils.get_dataset_registry().get_stats())
+        expander = st.expander("Startup Timings")
+        expander.dataframe(page_startup.get_report())
+        expander = st.expander("Stage Spans")
+        expander.dataframe(page_trace.get_report())
+        expander = st.expander("Result Cache")
+        expander.dataframe(analytics.result_cache.get_stats())
@@ -0,0 +1,233 @@
+import os
+import zlib
+import pickle
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import utils
+import filters
+import analytics
+
+
+# pre-rendering of the chart results of every state x year view of both pages (the other widgets at their default
+# values) into one artifact read by analytics.PrerenderedViews. The views are rendered by a process pool, each worker
+# loads and indexes the data once and renders all the years of a state. Each view is saved with a fingerprint of
+# the rows it is computed from (per state and year), so that a later run after a change of the source snapshot only
+# renders the views whose rows changed and carries over the others
+
+TREND_PERIODS = ('D', 'M', 'Y')
+
+# data of the views, loaded once per process (see load_context)
+context = None
+
+
+class Context:
+    def __init__(self, compact=False):
+        client = utils.connect_gcp()
+        self.wildfire_df = utils.load_wildfire_data_gcp(client, compact=compact)
+        self.weather_df = utils.load_weather_data_gcp(client, compact=compact)
+        wildfire_handle = utils.get_dataset_handle(self.wildfire_df)
+        weather_handle = utils.get_dataset_handle(self.weather_df)
+
+        self.fire_size_classes, self.states, self.years, self.causes = \
+            utils.get_wildfire_lists(self.wildfire_df, wildfire_handle)
+        self.max_fire_size, self.min_date, self.max_date = utils.get_wildfire_ranges(self.wildfire_df, wildfire_handle)
+        self.fire_size_class_range = utils.get_wildfire_size_class_range(self.max_fire_size)
+        self.weather_states = utils.get_weather_lists(self.weather_df, weather_handle)
+
+        self.data = {
+            'WildfireData': utils.get_wildfire_analytics(self.wildfire_df, wildfire_handle),
+            'WeatherData': utils.get_weather_analytics(self.weather_df, self.wildfire_df, weather_handle,
+                                                       wildfire_handle),
+            'RiskData': utils.get_risk_analytics(self.weather_df, self.wildfire_df, weather_handle, wildfire_handle),
+        }
+
+    def get_keys(self):
+        return {kind: data.key for kind, data in self.data.items()}
+
+    # states of the views of a kind of data, as listed by the state filter of its page
+    def get_states(self, kind):
+        return ['All'] + list(self.states if kind == 'WildfireData' else self.weather_states)
+
+    # filter of the wildfire page for a state and year, the other widgets at their default values
+    def get_wildfire_filter(self, state, year):
+        class_min, class_max = 'C', self.fire_size_classes[-1]
+
+        return filters.make_wildfire_filter(class_min, class_max, self.fire_size_class_range[class_min][0],
+                                            self.fire_size_class_range[class_max][1], self.max_fire_size, state, year,
+                                            self.min_date.date(), self.max_date.date(), min_date=self.min_date,
+                                            max_date=self.max_date)
+
+    # filter of the weather page for a state and year, the other widgets at their default values
+    def get_weather_filter(self, state, year):
+        return filters.make_wildfire_filter('C', 'G', self.fire_size_class_range['C'][0],
+                                            self.fire_size_class_range['G'][1], self.max_fire_size, state, year,
+                                            self.min_date.date(), self.max_date.date(), causes=self.causes)
+
+    # analytics calls (function, filter, arguments) of a page for a state and year
+    def get_calls(self, kind, state, year):
+        if kind == 'WildfireData':
+            spec = self.get_wildfire_filter(state, year)
+            cause_spec = spec._replace(causes=tuple(sorted(self.causes)))
+            calls = [(analytics.get_map, spec, (utils.MAP_MAX_POINTS,))]
+            calls += [(analytics.get_trend, spec, (period,)) for period in TREND_PERIODS]
+            calls += [(analytics.aggregate, spec, (keys,)) for keys in
+                      (['region', 'fire_size_class'], ['fire_size_class'], ['region'])]
+            calls += [(analytics.get_shares, spec, (keys,)) for keys in (['fire_size_class'], ['region'])]
+            calls += [(analytics.get_pivot, spec, keys) for keys in
+                      (('region', 'fire_size_class'), ('year', 'fire_size_class'), ('year', 'region'))]
+            calls += [(analytics.get_top, spec, ('region',)), (analytics.get_active_days, spec, ())]
+            calls += [(analytics.aggregate, cause_spec, (['stat_cause'],)),
+                      (analytics.get_shares, cause_spec, (['stat_cause'],)),
+                      (analytics.get_top, cause_spec, ('stat_cause',))]
+            calls += [(analytics.get_pivot, cause_spec, keys) for keys in
+                      (('year', 'stat_cause'), ('stat_cause', 'fire_size_class'), ('region', 'stat_cause'))]
+        elif kind == 'WeatherData':
+            spec = self.get_weather_filter(state, year)
+            calls = [(analytics.get_month_temperatures, spec, ()), (analytics.get_month_incidents, spec, ()),
+                     (analytics.get_day_classes, spec, ()),
+                     (analytics.get_densities, spec, (analytics.WEATHER_MEASURE_COLUMNS,)),
+                     (analytics.get_densities, spec, (analytics.WEATHER_CONDITION_COLUMNS,))]
+        else:
+            calls = [(analytics.get_daily_risk, self.get_weather_filter(state, year), ())]
+
+        return calls
+
+    # view (kind, state, year) as looked up by analytics.PrerenderedViews
+    def get_view(self, kind, state, year):
+        spec = self.get_calls(kind, state, year)[0][1]
+
+        return kind, spec.state, spec.year
+
+
+# context of a worker process (already there when the workers are forked)
+def load_context(compact, keys):
+    global context
+    if context is None:
+        context = Context(compact)
+    if context.get_keys() != keys:
+        raise RuntimeError("The data changed while the views were pre-rendered")
+
+
+# results of the views of a state for some years, as compressed pickles
+def render_views(kind, state, years):
+    views = []
+    for year in years:
+        results = {}
+        for func, spec, args in context.get_calls(kind, state, year):
+            results[analytics.get_result_key(func.__name__, spec, args)] = func(context.data[kind], spec, *args)
+        views.append((context.get_view(kind, state, year),
+                      zlib.compress(pickle.dumps(results, protocol=pickle.HIGHEST_PROTOCOL))))
+
+    return views
+
+
+# order independent fingerprint (sum of the row hashes) and number of rows of each (region, year) of a frame
+def get_group_fingerprints(df):
+    hashes = pd.util.hash_pandas_object(df, index=False).values
+    region_codes, regions = pd.factorize(df['region'])
+    year_codes, years = pd.factorize(df['date'].dt.year)
+    # rows without a region (code -1) are a group of their own
+    codes, groups = pd.factorize((region_codes + 1) * len(years) + year_codes)
+
+    sums = np.zeros(len(groups), dtype='uint64')
+    np.add.at(sums, codes, hashes)
+    counts = np.bincount(codes, minlength=len(groups))
+    regions = np.append(None, np.asarray(regions, dtype=object))
+
+    return [(regions[group // len(years)], int(years[group % len(years)]), int(total), int(count))
+            for group, total, count in zip(groups, sums, counts)]
+
+
+# fingerprint of the rows of a view (state, year), with everything the views share (lists, ranges, code)
+def get_view_fingerprint(shared, groups, state, year):
+    fingerprint = hashlib.sha1(repr(shared).encode('utf-8'))
+    for region, group_year, total, count in sorted(groups, key=repr):
+        if (state == 'All' or region == state) and (year == 'All' or group_year == int(year)):
+            fingerprint.update(repr((region, group_year, total, count)).encode('utf-8'))
+
+    return fingerprint.hexdigest()
+
+
+# fingerprints of all the views
+def get_fingerprints(ctx):
+    code_version = analytics.get_code_version()
+    shared = (code_version, list(ctx.fire_size_classes), list(ctx.states), list(ctx.years), list(ctx.causes),
+              ctx.max_fire_size, str(ctx.min_date), str(ctx.max_date), list(ctx.weather_states), utils.MAP_MAX_POINTS)
+    wildfire_groups = get_group_fingerprints(ctx.wildfire_df)
+    weather_groups = get_group_fingerprints(ctx.weather_df)
+
+    fingerprints = {}
+    for kind in ctx.data:
+        for state in ctx.get_states(kind):
+            for year in list(ctx.years) + ['All']:
+                if kind == 'WildfireData':
+                    fingerprint = get_view_fingerprint(shared, wildfire_groups, state, year)
+                elif kind == 'WeatherData':
+                    fingerprint = get_view_fingerprint((shared, get_view_fingerprint((), weather_groups, state, year)),
+                                                       wildfire_groups, state, year)
+                else:
+                    # the risk scores of a day depend on the previous days, and on all the data without a saved model
+                    fingerprint = hashlib.sha1(repr((shared, ctx.data[kind].key)).encode('utf-8')).hexdigest()
+                fingerprints[(kind, state, year)] = fingerprint
+
+    return fingerprints
+
+
+def read_artifact(filename):
+    if not os.path.exists(filename):
+        return None
+    with open(filename, 'rb') as f:
+        artifact = pickle.load(f)
+    if artifact['format'] != analytics.PRERENDERED_FORMAT or artifact['code_version'] != analytics.get_code_version():
+        return None
+
+    return artifact
+
+
+def write_artifact(filename, keys, views):
+    artifact = {'format': analytics.PRERENDERED_FORMAT, 'code_version': analytics.get_code_version(), 'keys': keys,
+                'views': views}
+
+    # write to a temp file first so that the pages never read a partial artifact
+    os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
+    with open(filename + '.tmp', 'wb') as f:
+        pickle.dump(artifact, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(filename + '.tmp', filename)
+
+
+# render the views whose rows changed since the last run (all of them if full), returns the numbers of views
+# rendered and carried over
+def prerender(filename=utils.PRERENDERED_FILE, processes=None, compact=False, full=False):
+    global context
+    context = Context(compact)
+    keys = context.get_keys()
+    fingerprints = get_fingerprints(context)
+    previous = None if full else read_artifact(filename)
+
+    views, tasks = {}, {}
+    for (kind, state, year), fingerprint in fingerprints.items():
+        view = context.get_view(kind, state, year)
+        if previous is not None and previous['views'].get(view, (None,))[0] == fingerprint:
+            views[view] = previous['views'][view]
+        else:
+            tasks.setdefault((kind, state), []).append(year)
+    num_carried = len(views)
+
+    if processes == 1 or len(tasks) <= 1:
+        rendered = [render_views(kind, state, years) for (kind, state), years in tasks.items()]
+    else:
+        with ProcessPoolExecutor(max_workers=processes, initializer=load_context, initargs=(compact, keys)) as executor:
+            futures = [executor.submit(render_views, kind, state, years) for (kind, state), years in tasks.items()]
+            rendered = [future.result() for future in futures]
+
+    view_fingerprints = {context.get_view(kind, state, year): fingerprint
+                         for (kind, state, year), fingerprint in fingerprints.items()}
+    for view, blob in [view for task_views in rendered for view in task_views]:
+        views[view] = (view_fingerprints[view], blob)
+    write_artifact(filename, keys, views)
+
+    return len(views) - num_carried, num_carried
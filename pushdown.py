@@ -0,0 +1,245 @@
+import sqlite3
+import datetime
+import threading
+
+import pandas as pd
+
+import rollup
+from filters import FilterIndex, filter_wildfire, make_wildfire_filter
+
+
+# push-down query mode: the wildfire filters compile to a parameterized sql where clause and the grouped
+# totals each chart needs are computed by the database, so only the small aggregates are transferred
+
+WILDFIRE_COLUMNS = ['date', 'region', 'fire_size_class', 'stat_cause', 'fire_size', 'latitude', 'longitude']
+
+# groupings of the charts compared by check_backend
+CHECK_KEYS = [['date'], ['region', 'fire_size_class'], ['year', 'fire_size_class'], ['year', 'region'],
+              ['date', 'region'], ['stat_cause'], ['year', 'stat_cause'], ['fire_size_class', 'stat_cause'],
+              ['region', 'stat_cause']]
+
+
+class SQLBackend:
+    table = 'wildfire'
+    date_expr = 'date'
+    year_expr = 'year'
+    floor_expr = 'FLOOR({})'
+
+    def get_param(self, params, name, value):
+        raise NotImplementedError
+
+    def get_list_param(self, params, name, values):
+        raise NotImplementedError
+
+    def execute(self, query_stmt, params):
+        raise NotImplementedError
+
+    def get_key_expr(self, key):
+        if key == 'date':
+            return '{} AS date'.format(self.date_expr)
+        if key == 'year':
+            return '{} AS year'.format(self.year_expr)
+        return key
+
+    # compile a wildfire filter (see filters.make_wildfire_filter) to a where clause and its parameters
+    def compile_where(self, spec):
+        conditions, params = [], {}
+
+        if spec.fire_class is not None:
+            conditions.append('fire_size_class BETWEEN {} AND {}'.format(
+                self.get_param(params, 'class_min', spec.fire_class[0]),
+                self.get_param(params, 'class_max', spec.fire_class[1])))
+        if spec.fire_size is not None:
+            conditions.append('fire_size >= {} AND fire_size < {}'.format(
+                self.get_param(params, 'size_min', float(spec.fire_size[0])),
+                self.get_param(params, 'size_max', float(spec.fire_size[1]))))
+        if spec.state != 'All':
+            conditions.append('region = {}'.format(self.get_param(params, 'state', spec.state)))
+        if spec.year != 'All':
+            conditions.append('{} = {}'.format(self.year_expr, self.get_param(params, 'year', int(spec.year))))
+        else:
+            if spec.date_from is not None:
+                conditions.append('{} >= {}'.format(self.date_expr, self.get_param(params, 'date_from', spec.date_from)))
+            if spec.date_to is not None:
+                conditions.append('{} <= {}'.format(self.date_expr, self.get_param(params, 'date_to', spec.date_to)))
+        if spec.causes is not None:
+            conditions.append('stat_cause IN {}'.format(self.get_list_param(params, 'causes', spec.causes)))
+
+        where = ' AND '.join(conditions) if len(conditions) > 0 else '1 = 1'
+
+        return where, params
+
+    # total incidents and acres grouped by keys (date, year, region, fire_size_class, stat_cause)
+    def aggregate(self, spec, keys):
+        where, params = self.compile_where(spec)
+        query_stmt = "SELECT {}, COUNT(*) AS incident, SUM(fire_size) AS fire_size \
+                        FROM {} WHERE {} GROUP BY {} ORDER BY {}".format(
+            ', '.join(self.get_key_expr(key) for key in keys), self.table, where, ', '.join(keys), ', '.join(keys))
+
+        df = self.execute(query_stmt, params)
+        if 'date' in keys:
+            df['date'] = pd.to_datetime(df['date'])
+        if 'year' in keys:
+            df['year'] = df['year'].astype('int64')
+        df['incident'] = df['incident'].astype('int64')
+        df['fire_size'] = df['fire_size'].astype('float64')
+
+        return df
+
+    def select_points(self, spec):
+        where, params = self.compile_where(spec)
+        query_stmt = "SELECT latitude, longitude FROM {} WHERE {}".format(self.table, where)
+
+        return self.execute(query_stmt, params)
+
+    # incidents and acres per map cell of cell_size degrees (see spatial.get_cells)
+    def aggregate_cells(self, spec, cell_size):
+        where, params = self.compile_where(spec)
+        size = self.get_param(params, 'cell_size', float(cell_size))
+        query_stmt = "SELECT {} AS cell_y, {} AS cell_x, COUNT(*) AS incident, SUM(fire_size) AS fire_size \
+                        FROM {} WHERE {} GROUP BY cell_y, cell_x".format(
+            self.floor_expr.format('latitude / ' + size), self.floor_expr.format('longitude / ' + size),
+            self.table, where)
+
+        df = self.execute(query_stmt, params)
+        for col in ['cell_y', 'cell_x', 'incident']:
+            df[col] = df[col].astype('int64')
+        df['fire_size'] = df['fire_size'].astype('float64')
+
+        return df
+
+    # option lists and ranges used by the forms, same as utils.get_wildfire_lists / get_wildfire_ranges
+    def get_metadata(self):
+        lists = []
+        for key in ['fire_size_class', 'region', 'year', 'stat_cause']:
+            query_stmt = "SELECT DISTINCT {} FROM {} ORDER BY {}".format(self.get_key_expr(key), self.table, key)
+            lists.append(self.execute(query_stmt, {})[key].values)
+        lists[2] = lists[2].astype(int).astype(str)
+
+        query_stmt = "SELECT MAX(fire_size) AS max_fire_size, MIN({}) AS min_date, MAX({}) AS max_date FROM {}".format(
+            self.date_expr, self.date_expr, self.table)
+        df = self.execute(query_stmt, {})
+        max_fire_size = int(df['max_fire_size'][0]) + 1
+        min_date = pd.to_datetime(df['min_date'][0])
+        max_date = pd.to_datetime(df['max_date'][0])
+
+        return tuple(lists), (max_fire_size, min_date, max_date)
+
+
+class BigQueryBackend(SQLBackend):
+    date_expr = 'DATE(date)'
+    year_expr = 'EXTRACT(YEAR FROM date)'
+    floor_expr = 'CAST(FLOOR({}) AS INT64)'
+
+    def __init__(self, client, table='`vernal-shine-239106.US_Wildfire_Dataset.wildfire`'):
+        self.client = client
+        self.table = table
+
+    def get_param(self, params, name, value):
+        params[name] = value
+        return '@' + name
+
+    def get_list_param(self, params, name, values):
+        params[name] = list(values)
+        return 'UNNEST(@{})'.format(name)
+
+    def execute(self, query_stmt, params):
+        from google.cloud import bigquery
+
+        query_params = []
+        for name, value in params.items():
+            if isinstance(value, list):
+                query_params.append(bigquery.ArrayQueryParameter(name, 'STRING', value))
+            elif isinstance(value, str):
+                query_params.append(bigquery.ScalarQueryParameter(name, 'STRING', value))
+            elif isinstance(value, int):
+                query_params.append(bigquery.ScalarQueryParameter(name, 'INT64', value))
+            elif isinstance(value, float):
+                query_params.append(bigquery.ScalarQueryParameter(name, 'FLOAT64', value))
+            else:
+                query_params.append(bigquery.ScalarQueryParameter(name, 'DATE', value))
+
+        job_config = bigquery.QueryJobConfig(query_parameters=query_params)
+        query_job = self.client.query(query_stmt, job_config=job_config)
+
+        return query_job.result().to_dataframe()
+
+
+# embedded backend, e.g. to run the push-down mode offline or to check it against the pandas path
+class SQLiteBackend(SQLBackend):
+    date_expr = 'date(date)'
+    year_expr = "CAST(strftime('%Y', date) AS INTEGER)"
+    # sqlite may be built without the math functions, the cast truncates towards zero
+    floor_expr = '(CAST({0} AS INTEGER) - ({0} < CAST({0} AS INTEGER)))'
+
+    def __init__(self, connection, table='wildfire'):
+        self.connection = connection
+        self.table = table
+        self.lock = threading.Lock()
+
+    def get_param(self, params, name, value):
+        if hasattr(value, 'isoformat'):
+            value = value.isoformat()[:10]
+        params[name] = value
+        return ':' + name
+
+    def get_list_param(self, params, name, values):
+        names = [self.get_param(params, '{}_{}'.format(name, i), value) for i, value in enumerate(values)]
+        return '({})'.format(', '.join(names)) if len(names) > 0 else '(NULL)'
+
+    def execute(self, query_stmt, params):
+        # the connection is shared by the sessions (threads) of the app
+        with self.lock:
+            return pd.read_sql_query(query_stmt, self.connection, params=params)
+
+
+# load wildfire rows (as returned by utils.load_wildfire_data_gcp) into an in-memory sqlite database
+def create_sqlite_backend(df, filename=':memory:'):
+    connection = sqlite3.connect(filename, check_same_thread=False)
+
+    df = df[WILDFIRE_COLUMNS].copy()
+    for col in ['region', 'fire_size_class', 'stat_cause']:
+        df[col] = df[col].astype(str)
+    df['date'] = df['date'].dt.strftime('%Y-%m-%d %H:%M:%S')
+    df.to_sql('wildfire', connection, index=False, if_exists='replace')
+    connection.execute('CREATE INDEX idx_wildfire_region_date ON wildfire (region, date)')
+
+    return SQLiteBackend(connection)
+
+
+# filters compared by check_backend, from the metadata of a backend (see SQLBackend.get_metadata): all rows, class,
+# size, state, year, cause and date range filters
+def get_check_specs(metadata):
+    (list_fire_size_classes, list_states, list_years, list_causes), (max_fire_size, min_date, max_date) = metadata
+
+    return [
+        make_wildfire_filter('A', 'G', 0, max_fire_size, max_fire_size),
+        make_wildfire_filter('C', 'G', 10, max_fire_size, max_fire_size, date_from=min_date.date(),
+                             date_to=max_date.date()),
+        make_wildfire_filter('D', 'F', 200, 3000, max_fire_size, state=list_states[0]),
+        make_wildfire_filter('C', 'E', 10, 1000, max_fire_size, year=list_years[-1], causes=list_causes[:3]),
+        make_wildfire_filter('C', 'G', 10, max_fire_size, max_fire_size, state=list_states[-1],
+                             date_from=datetime.date(2000, 3, 1), date_to=datetime.date(2004, 7, 15)),
+    ]
+
+
+# compare the push-down aggregates of a backend with the pandas path on the same rows,
+# returns the list of (spec, keys, error) that do not match
+def check_backend(df, backend, specs, list_keys):
+    index = FilterIndex(df)
+    mismatches = []
+    for spec in specs:
+        for keys in list_keys:
+            expected = rollup.aggregate_wildfire(filter_wildfire(index, spec), keys)
+            expected = expected[list(keys) + ['incident', 'fire_size']]
+            for key in keys:
+                if key not in ('date', 'year'):
+                    expected[key] = expected[key].astype(str)
+            actual = backend.aggregate(spec, keys)
+            try:
+                pd.testing.assert_frame_equal(expected.reset_index(drop=True), actual.reset_index(drop=True),
+                                              check_dtype=False, check_exact=False, rtol=1e-9)
+            except AssertionError as e:
+                mismatches.append((spec, keys, str(e)))
+
+    return mismatches
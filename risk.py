@@ -0,0 +1,171 @@
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+import joins
+import features
+
+
+# wildfire risk model per (date, region) on the daily weather features (see features.py): a logistic regression
+# of P(fire of class C or larger) and a regression of the log acres on the days with such a fire, so that the
+# expected acres are P(fire) * E[acres | fire]. Both are fitted with numpy (newton / least squares) and scored
+# for all regions and days at once as matrix products
+
+MODEL_FILE = 'models/risk_model.npz'
+RISK_CLASS_MIN = 'C'
+
+
+# fire (0 / 1) and acres of the fires of class RISK_CLASS_MIN or larger of each weather row (same index)
+def get_labels(weather_df, fire_df, classes, class_min=RISK_CLASS_MIN):
+    classes = list(classes)
+    fire_df = fire_df.loc[fire_df['fire_size_class'].astype(object).isin(classes[classes.index(class_min):])]
+
+    return get_daily_labels(weather_df, joins.reduce_daily_fires(fire_df, classes), classes)
+
+
+# same as get_labels, from the daily fires of class_min or larger already reduced (see joins.reduce_daily_fires),
+# e.g. streamed from the partitioned store in chunked mode
+def get_daily_labels(weather_df, daily, classes):
+    merged_df = joins.join_daily(weather_df[['date', 'region']], daily, list(classes))
+
+    return pd.DataFrame({'fire': (merged_df['incident'] > 0).astype('int8'), 'acres': merged_df['fire_size']},
+                        index=weather_df.index)
+
+
+def sigmoid(x):
+    return 1 / (1 + np.exp(-np.clip(x, -30, 30)))
+
+
+class RiskModel:
+    def __init__(self, columns, regions, means, scales, fire_weights, acres_weights, acres_variance):
+        self.columns = list(columns)
+        self.regions = pd.Index(regions)
+        self.means = np.asarray(means)
+        self.scales = np.asarray(scales)
+        self.fire_weights = np.asarray(fire_weights)
+        self.acres_weights = np.asarray(acres_weights)
+        self.acres_variance = float(acres_variance)
+
+    # standardized features (missing values at the mean), one indicator per region and an intercept
+    @staticmethod
+    def get_design(features_df, columns, regions, means, scales):
+        values = features_df[columns].to_numpy(dtype='float64', na_value=np.nan)
+        values = np.nan_to_num((values - means) / scales, nan=0.0)
+
+        design = np.zeros((len(features_df), len(columns) + len(regions) + 1))
+        design[:, :len(columns)] = values
+        region_codes = regions.get_indexer(features_df['region'])
+        known = region_codes >= 0
+        design[np.flatnonzero(known), len(columns) + region_codes[known]] = 1
+        design[:, -1] = 1
+
+        return design
+
+    @classmethod
+    def fit(cls, features_df, labels_df, l2=1.0, iterations=10):
+        labels_df = labels_df.loc[features_df.index]
+        columns = features.get_feature_columns()
+        regions = pd.Index(np.sort(features_df['region'].astype(object).unique()))
+        values = features_df[columns].to_numpy(dtype='float64', na_value=np.nan)
+        means = np.nan_to_num(np.nanmean(values, axis=0))
+        scales = np.nan_to_num(np.nanstd(values, axis=0), nan=1.0)
+        scales[scales == 0] = 1.0
+
+        design = cls.get_design(features_df, columns, regions, means, scales)
+        penalty = np.full(design.shape[1], l2)
+        penalty[-1] = 0
+
+        # logistic regression by newton steps
+        fire = labels_df['fire'].values.astype('float64')
+        fire_weights = np.zeros(design.shape[1])
+        for _ in range(iterations):
+            p = sigmoid(design @ fire_weights)
+            hessian = design.T @ (design * (p * (1 - p))[:, None]) + np.diag(penalty)
+            gradient = design.T @ (p - fire) + penalty * fire_weights
+            fire_weights -= np.linalg.solve(hessian, gradient)
+
+        # ridge regression of the log acres on the days with a fire
+        has_fire = fire > 0
+        log_acres = np.log1p(labels_df['acres'].values[has_fire])
+        fire_design = design[has_fire]
+        acres_weights = np.linalg.solve(fire_design.T @ fire_design + np.diag(penalty), fire_design.T @ log_acres)
+        residuals = log_acres - fire_design @ acres_weights
+        acres_variance = residuals.var() if len(residuals) > 0 else 0.0
+
+        return cls(columns, regions, means, scales, fire_weights, acres_weights, acres_variance)
+
+    # risk of every row of a features frame (any number of regions and days) in one vectorized pass
+    def score(self, features_df):
+        design = self.get_design(features_df, self.columns, self.regions, self.means, self.scales)
+        fire_probability = sigmoid(design @ self.fire_weights)
+        # mean of a log-normal
+        acres = np.expm1(design @ self.acres_weights + self.acres_variance / 2)
+
+        return pd.DataFrame({
+            'date': features_df['date'].values,
+            'region': features_df['region'].values,
+            'fire_probability': fire_probability,
+            'expected_acres': fire_probability * acres,
+        }, index=features_df.index)
+
+    def save(self, filename=MODEL_FILE):
+        os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
+        np.savez(filename, columns=np.array(self.columns), regions=np.asarray(self.regions, dtype=str),
+                 means=self.means, scales=self.scales, fire_weights=self.fire_weights,
+                 acres_weights=self.acres_weights, acres_variance=self.acres_variance)
+
+    @classmethod
+    def load(cls, filename=MODEL_FILE):
+        with np.load(filename) as artifact:
+            return cls(artifact['columns'], artifact['regions'], artifact['means'], artifact['scales'],
+                       artifact['fire_weights'], artifact['acres_weights'], artifact['acres_variance'])
+
+
+# scores and scoring throughput (rows per second)
+def score_timed(model, features_df):
+    start_time = time.perf_counter()
+    scores_df = model.score(features_df)
+    elapsed = time.perf_counter() - start_time
+
+    return scores_df, len(features_df) / max(elapsed, 1e-9)
+
+
+# log loss and area under the roc curve of the fire probabilities, mean absolute error of the expected acres
+def evaluate(scores_df, labels_df):
+    fire = labels_df['fire'].values
+    p = np.clip(scores_df['fire_probability'].values, 1e-12, 1 - 1e-12)
+    log_loss = -np.mean(fire * np.log(p) + (1 - fire) * np.log(1 - p))
+
+    num_pos, num_neg = fire.sum(), len(fire) - fire.sum()
+    ranks = pd.Series(p).rank().values
+    auc = (ranks[fire == 1].sum() - num_pos * (num_pos + 1) / 2) / (num_pos * num_neg) if num_pos * num_neg > 0 \
+        else np.nan
+
+    return {
+        'rows': len(fire),
+        'fire_rate': fire.mean(),
+        'log_loss': log_loss,
+        'auc': auc,
+        'acres_mae': np.abs(scores_df['expected_acres'].values - labels_df['acres'].values).mean(),
+    }
+
+
+# fit the model on the weather rows before test_from_year (all if None) and evaluate it on the following ones,
+# with the labels of the fires (see get_labels) unless they are given
+def train(weather_df, fire_df, classes, test_from_year=None, features_df=None, labels_df=None):
+    if features_df is None:
+        features_df = features.compute_features(weather_df)
+    if labels_df is None:
+        labels_df = get_labels(weather_df, fire_df, classes)
+    labels_df = labels_df.loc[features_df.index]
+
+    if test_from_year is None:
+        return RiskModel.fit(features_df, labels_df), None
+
+    test = (features_df['date'].dt.year >= test_from_year).values
+    model = RiskModel.fit(features_df.loc[~test], labels_df.loc[~test])
+    metrics = evaluate(model.score(features_df.loc[test]), labels_df.loc[test])
+
+    return model, metrics
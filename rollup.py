@@ -0,0 +1,66 @@
+import numpy as np
+import pandas as pd
+
+
+# dimensions of the wildfire rollup cube, the charts only group by (subsets of) these
+CUBE_KEYS = ['date', 'region', 'fire_size_class', 'stat_cause']
+
+
+# pre-aggregate wildfire incidents (count) and total acres per day, region, fire size class and cause
+def build_wildfire_cube(df):
+    cube = df.groupby(CUBE_KEYS, observed=True, sort=True)['fire_size'].agg(['size', 'sum']).reset_index()
+    cube.rename(columns={'size': 'incident', 'sum': 'fire_size'}, inplace=True)
+
+    return cube
+
+
+# total incidents and acres of raw rows or of a (sliced) cube grouped by keys, 'year' is derived from the date
+def aggregate_wildfire(df, keys):
+    keys = list(keys)
+    if 'year' in keys and 'year' not in df.columns:
+        df = df.assign(year=df['date'].dt.year)
+
+    group = df.groupby(keys, observed=True, sort=True)
+    if 'incident' in df.columns:
+        agg_df = group[['incident', 'fire_size']].sum()
+    else:
+        agg_df = group['fire_size'].agg(['size', 'sum']).rename(columns={'size': 'incident', 'sum': 'fire_size'})
+
+    return agg_df.reset_index()
+
+
+# number of distinct days with at least one row per group of keys (e.g. region, or year / fire_size_class and region),
+# counted over sorted integer-coded (group, day) pairs instead of a grid of every date and region
+def count_active_days(df, keys=('region',)):
+    keys = list(keys)
+    if 'year' in keys and 'year' not in df.columns:
+        df = df.assign(year=df['date'].dt.year)
+
+    # combine the codes of the keys into one group code, the uniques of each key decode it
+    group_codes = np.zeros(len(df), dtype='int64')
+    list_uniques = []
+    for key in keys:
+        codes, uniques = pd.factorize(df[key])
+        group_codes = group_codes * len(uniques) + codes
+        list_uniques.append(uniques)
+    group_codes, groups = pd.factorize(group_codes)
+
+    # (group, day) codes sorted in place instead of hashed: the distinct pairs start where the sorted code changes,
+    # and are grouped by their group since the group is the high part of the code
+    days = df['date'].values.astype('datetime64[D]').view('int64')
+    day_min = days.min() if len(days) > 0 else 0
+    num_days = days.max() - day_min + 1 if len(days) > 0 else 1
+    pairs = group_codes * num_days + (days - day_min)
+    pairs.sort()
+    starts = np.ones(len(pairs), dtype=bool)
+    np.not_equal(pairs[1:], pairs[:-1], out=starts[1:])
+    active_days = np.bincount(pairs[starts] // num_days, minlength=len(groups))
+
+    columns = {}
+    for key, uniques in zip(reversed(keys), reversed(list_uniques)):
+        groups, codes = np.divmod(groups, len(uniques))
+        columns[key] = uniques.take(codes)
+    active_df = pd.DataFrame({key: columns[key] for key in keys})
+    active_df['active_days'] = active_days
+
+    return active_df.sort_values(keys, ignore_index=True)
@@ -0,0 +1,245 @@
+import os
+import json
+import time
+import uuid
+import logging
+import functools
+import threading
+
+import numpy as np
+import pandas as pd
+
+
+# spans of the stages of a page run (cache lookups, filters, groupings, joins, charts): wall time, rows in / out
+# and resident memory delta of each stage, shown in the sidebar debug panel (WILDFIRE_DEBUG=1) and written as one
+# json log line per span (WILDFIRE_SPANS=1, to stderr or to the file WILDFIRE_SPANS_LOG). When neither is set,
+# the decorated functions are not wrapped and span() returns a shared no-op span
+
+LOG_SPANS = os.environ.get('WILDFIRE_SPANS', '0') == '1'
+ENABLED = LOG_SPANS or os.environ.get('WILDFIRE_DEBUG', '0') == '1'
+
+logger = logging.getLogger('wildfire.spans')
+if LOG_SPANS and not logger.handlers:
+    log_file = os.environ.get('WILDFIRE_SPANS_LOG')
+    handler = logging.FileHandler(log_file) if log_file else logging.StreamHandler()
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+# the trace of the run of the current script thread (each session runs its script in its own thread)
+local = threading.local()
+
+
+# resident memory of the process in bytes (linux), None if unknown
+def get_rss():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+# number of rows of a frame, series, array or indexed frame (e.g. FilterIndex), None for anything else
+def get_rows(obj):
+    if isinstance(obj, (pd.DataFrame, pd.Series, np.ndarray)):
+        return len(obj)
+    if isinstance(getattr(obj, 'df', None), pd.DataFrame):
+        return len(obj.df)
+
+    return None
+
+
+class Span:
+    __slots__ = ('trace', 'name', 'depth', 'rows_in', 'rows_out', 'start', 'seconds', 'start_rss', 'rss_delta')
+
+    def __init__(self, trace, name, rows_in=None):
+        self.trace = trace
+        self.name = name
+        self.rows_in = rows_in
+        self.rows_out = None
+        self.depth = 0
+        self.start = None
+        self.seconds = None
+        self.start_rss = None
+        self.rss_delta = None
+
+    def set(self, rows_out=None, rows_in=None):
+        if rows_out is not None:
+            self.rows_out = rows_out
+        if rows_in is not None:
+            self.rows_in = rows_in
+
+    def __enter__(self):
+        self.depth = len(self.trace.stack)
+        self.trace.stack.append(self)
+        self.start_rss = get_rss()
+        self.start = time.perf_counter()
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.seconds = time.perf_counter() - self.start
+        end_rss = get_rss()
+        if end_rss is not None and self.start_rss is not None:
+            self.rss_delta = end_rss - self.start_rss
+        self.trace.stack.pop()
+        self.trace.spans.append(self)
+
+        return False
+
+
+class NullSpan:
+    def set(self, rows_out=None, rows_in=None):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+NULL_SPAN = NullSpan()
+
+
+class Trace:
+    def __init__(self, page):
+        self.page = page
+        self.run_id = uuid.uuid4().hex[:12]
+        self.start = time.perf_counter()
+        self.spans = []
+        self.stack = []
+        self.section = None
+
+    def span(self, name, rows_in=None):
+        return Span(self, name, rows_in)
+
+    # top-level span of the page section from here to the next section (or the end of the run)
+    def begin_section(self, name):
+        self.end_section()
+        self.section = self.span(name).__enter__()
+
+    def end_section(self):
+        if self.section is not None:
+            self.section.__exit__(None, None, None)
+            self.section = None
+
+    # spans in the order they started, nested spans indented under their parent
+    def get_report(self):
+        spans = sorted(self.spans, key=lambda span: span.start)
+        report = pd.DataFrame({
+            'stage': ['  ' * span.depth + span.name for span in spans],
+            'ms': [round(span.seconds * 1000, 1) for span in spans],
+            'rows_in': pd.array([span.rows_in for span in spans], dtype='Int64'),
+            'rows_out': pd.array([span.rows_out for span in spans], dtype='Int64'),
+            'rss_delta_MB': [None if span.rss_delta is None else round(span.rss_delta / 2**20, 1) for span in spans],
+        })
+
+        return report
+
+    # one json log line per span
+    def log(self):
+        if not LOG_SPANS:
+            return
+
+        for span in sorted(self.spans, key=lambda span: span.start):
+            logger.info(json.dumps({
+                'run': self.run_id, 'page': self.page, 'span': span.name, 'depth': span.depth,
+                'start_ms': round((span.start - self.start) * 1000, 3), 'ms': round(span.seconds * 1000, 3),
+                'rows_in': span.rows_in, 'rows_out': span.rows_out, 'rss_delta': span.rss_delta,
+            }))
+
+
+# trace of a run as seen from a worker thread (e.g. the startup loads): the spans are recorded in the trace of the
+# run, under the spans that were open when the work was submitted, with a stack of their own since the script
+# thread keeps opening and closing spans meanwhile
+class WorkerTrace:
+    def __init__(self, trace, stack):
+        self.trace = trace
+        self.spans = trace.spans
+        self.stack = list(stack)
+
+    def span(self, name, rows_in=None):
+        return Span(self, name, rows_in)
+
+
+# start the trace of a page run in the current thread, None if the spans are disabled
+def start_trace(page):
+    local.trace = Trace(page) if ENABLED else None
+
+    return local.trace
+
+
+def get_trace():
+    return getattr(local, 'trace', None)
+
+
+# start a section of the page (closing the previous one), page scripts run top to bottom so that a section
+# spans all the code until the next one without indenting it
+def section(name):
+    trace = getattr(local, 'trace', None)
+    if trace is not None:
+        trace.begin_section(name)
+
+
+# close the last section and write the log lines of the run, returns the trace (None if disabled)
+def end_trace():
+    trace = getattr(local, 'trace', None)
+    if trace is not None:
+        trace.end_section()
+        trace.log()
+    local.trace = None
+
+    return trace
+
+
+# func run in the trace of the current thread, to be called from another thread (e.g. a pool), whose thread local
+# trace is restored afterwards (the pool threads are reused by the runs of all sessions)
+def bind(func):
+    trace = getattr(local, 'trace', None)
+    if trace is None:
+        return func
+    stack = list(trace.stack)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        previous = getattr(local, 'trace', None)
+        local.trace = WorkerTrace(trace, stack)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            local.trace = previous
+
+    return wrapper
+
+
+# span of a stage of the current run, a no-op without a trace (disabled, or outside of a run)
+def span(name, rows_in=None):
+    trace = getattr(local, 'trace', None)
+    if trace is None:
+        return NULL_SPAN
+
+    return trace.span(name, rows_in)
+
+
+# decorator recording a span for each call, rows in from the first argument and rows out from the result,
+# the function is returned as is when the spans are disabled
+def traced(name):
+    def decorator(func):
+        if not ENABLED:
+            return func
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name, get_rows(args[0]) if len(args) > 0 else None) as current_span:
+                result = func(*args, **kwargs)
+                current_span.set(rows_out=get_rows(result))
+
+            return result
+
+        return wrapper
+
+    return decorator
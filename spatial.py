@@ -0,0 +1,99 @@
+import numpy as np
+import pandas as pd
+import pydeck as pdk
+
+
+# level of detail of the incident map: above a number of points the map shows grid cells (incidents and acres
+# per cell) instead of every point. The cell sizes (in degrees) halve from one level to the next, so the cells
+# of the finest level are counted once and the coarser levels are derived from them by integer division
+
+CELL_SIZES = [8.0, 4.0, 2.0, 1.0, 0.5, 0.25]
+MAX_CELLS = 5000  # the finest level with at most this many cells is displayed
+
+# dimensions of the cell cube besides the cells, the filters of the map: the year is kept as the date of its first
+# day, so that the cube is sliced by a FilterIndex like the rollup cube
+CELL_CUBE_KEYS = ['region', 'date', 'fire_size_class', 'stat_cause']
+
+
+# incidents and acres per cell of the finest level, the cell of a point is (floor(lat / size), floor(lon / size))
+def get_cells(df, cell_size=CELL_SIZES[-1]):
+    cell_y = np.floor(df['latitude'].to_numpy(dtype='float64') / cell_size).astype('int64')
+    cell_x = np.floor(df['longitude'].to_numpy(dtype='float64') / cell_size).astype('int64')
+
+    return group_cells(cell_y, cell_x, np.ones(len(df), dtype='int64'), df['fire_size'].to_numpy(dtype='float64'))
+
+
+# incidents and acres per cell of the finest level, year, state, fire size class and cause, built once per dataset:
+# the map of a filter on these dimensions is a slice of the cube grouped per cell (coarser levels are derived from
+# the finest one) instead of the filtered rows binned on every filter change. Sorted by state and year, the order of
+# its filter index
+def build_cell_cube(df, cell_size=CELL_SIZES[-1]):
+    keys_df = pd.DataFrame({
+        'region': df['region'].values,
+        'date': df['date'].values.astype('datetime64[Y]').astype('datetime64[ns]'),
+        'fire_size_class': df['fire_size_class'].values,
+        'stat_cause': df['stat_cause'].values,
+        'cell_y': np.floor(df['latitude'].to_numpy(dtype='float64') / cell_size).astype('int32'),
+        'cell_x': np.floor(df['longitude'].to_numpy(dtype='float64') / cell_size).astype('int32'),
+        'fire_size': df['fire_size'].to_numpy(dtype='float64'),
+    })
+    cube = keys_df.groupby(CELL_CUBE_KEYS + ['cell_y', 'cell_x'], observed=True, sort=True)['fire_size'] \
+        .agg(['size', 'sum']).reset_index()
+    cube.rename(columns={'size': 'incident', 'sum': 'fire_size'}, inplace=True)
+
+    return cube
+
+
+def group_cells(cell_y, cell_x, incident, fire_size):
+    # cells as one integer key (x is within [-720, 720] at the finest level)
+    codes, keys = pd.factorize(cell_y * 4096 + (cell_x + 2048))
+
+    return pd.DataFrame({
+        'cell_y': keys // 4096,
+        'cell_x': keys % 4096 - 2048,
+        'incident': np.bincount(codes, weights=incident, minlength=len(keys)).astype('int64'),
+        'fire_size': np.bincount(codes, weights=fire_size, minlength=len(keys)),
+    })
+
+
+# cells of a coarser level: factor (a power of 2) finest cells per side
+def coarsen_cells(cells, factor):
+    if factor == 1:
+        return cells
+
+    return group_cells(cells['cell_y'].values // factor, cells['cell_x'].values // factor,
+                       cells['incident'].values, cells['fire_size'].values)
+
+
+# the finest level with at most max_cells cells, with the latitude and longitude of the cell centers
+def get_map_cells(cells, max_cells=MAX_CELLS):
+    finest = CELL_SIZES[-1]
+    for cell_size in reversed(CELL_SIZES):
+        level_cells = coarsen_cells(cells, int(cell_size / finest))
+        if len(level_cells) <= max_cells:
+            break
+
+    level_cells = level_cells.assign(latitude=(level_cells['cell_y'] + 0.5) * cell_size,
+                                     longitude=(level_cells['cell_x'] + 0.5) * cell_size)
+
+    return level_cells, cell_size
+
+
+# map of the cells: one circle per cell, the area grows with the number of incidents
+def get_cells_deck(cells, cell_size):
+    cells = cells.assign(radius=np.sqrt(cells['incident'] / cells['incident'].max()) * cell_size * 111000 / 2,
+                         fire_size=cells['fire_size'].round())
+    layer = pdk.Layer(
+        'ScatterplotLayer',
+        data=cells[['latitude', 'longitude', 'incident', 'fire_size', 'radius']],
+        get_position='[longitude, latitude]',
+        get_radius='radius',
+        radius_min_pixels=2,
+        get_fill_color=[200, 30, 0, 160],
+        pickable=True,
+    )
+    view_state = pdk.ViewState(latitude=float(cells['latitude'].mean()), longitude=float(cells['longitude'].mean()),
+                               zoom=3)
+
+    return pdk.Deck(layers=[layer], initial_view_state=view_state, map_style=None,
+                    tooltip={'text': '{incident} incidents, {fire_size} acres'})
@@ -0,0 +1,55 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+import spans
+
+
+# concurrent startup of the pages: the independent loads (datasets, descriptions) are submitted at once to a
+# thread pool shared by all sessions, and the page renders each section as soon as the loads it needs are done.
+# The loads run outside of the script thread so they must not call streamlit (the dataset registry loaders and
+# utils.load_descriptions do not), the cached derivations (indexes, cubes) stay in the script thread
+
+STARTUP_WORKERS = 8
+executor = ThreadPoolExecutor(max_workers=STARTUP_WORKERS, thread_name_prefix='startup')
+
+
+class Startup:
+    def __init__(self):
+        self.start_time = time.perf_counter()
+        self.futures = {}
+        self.timings = []
+
+    def get_elapsed(self):
+        return time.perf_counter() - self.start_time
+
+    # start a load in the background, its result is read with get. The load runs in the trace of the page run
+    # (see spans.bind) so that the spans of the loaders are recorded
+    def submit(self, name, func, *args, **kwargs):
+        func = spans.bind(func)
+
+        def run():
+            start_time = time.perf_counter()
+            result = func(*args, **kwargs)
+            return result, start_time - self.start_time, time.perf_counter() - start_time
+
+        self.futures[name] = executor.submit(run)
+
+    # result of a load, waits for it if it is not done yet
+    def get(self, name):
+        result, started, duration = self.futures[name].result()
+        if name not in [step for step, _, _ in self.timings]:
+            self.timings.append((name, self.get_elapsed(), '{:.3f}s load from {:.3f}s'.format(duration, started)))
+
+        return result
+
+    # time of a point of the page (e.g. first paint, a section rendered) since the start of the run
+    def mark(self, name):
+        self.timings.append((name, self.get_elapsed(), ''))
+
+    def get_report(self):
+        report = pd.DataFrame(self.timings, columns=['step', 'seconds', 'detail'])
+        report['seconds'] = report['seconds'].round(3)
+
+        return report
@@ -0,0 +1,106 @@
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+
+
+# weather of individual fires from the nearest noaa stations reporting on the discovery date: the stations are
+# indexed once in a kd-tree (on 3d unit vectors, where the chord distance orders like the great-circle distance),
+# each fire queries its nearest stations and keeps the k closest that reported that day, and the weather values
+# are averaged with inverse distance weights
+
+EARTH_RADIUS = 6371.0  # in km
+KEY_SPAN = 1 << 20  # more days than any series spans
+CHUNK_SIZE = 200000  # fires per batch, bounds the memory of the (fires x candidates) arrays
+
+# weather columns attributed to the fires by default
+WEATHER_COLUMNS = ('temp', 'dew_point', 'max_temp', 'min_temp', 'wind_speed', 'max_sustained_wind', 'max_wind_gust',
+                   'precipitation')
+
+
+def get_unit_vectors(lat, lon):
+    lat = np.radians(np.asarray(lat, dtype='float64'))
+    lon = np.radians(np.asarray(lon, dtype='float64'))
+
+    return np.stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)], axis=1)
+
+
+class StationIndex:
+    # df: one row per station with the columns station, lat, lon
+    def __init__(self, df):
+        self.stations = pd.Index(df['station'].values)
+        self.tree = cKDTree(get_unit_vectors(df['lat'].values, df['lon'].values))
+
+    def __len__(self):
+        return len(self.stations)
+
+    # great-circle distances (km) and positions of the k nearest stations of each point
+    def query(self, lat, lon, k):
+        chords, positions = self.tree.query(get_unit_vectors(lat, lon), k=min(k, len(self)))
+        if chords.ndim == 1:
+            chords, positions = chords[:, None], positions[:, None]
+
+        return 2 * EARTH_RADIUS * np.arcsin(np.clip(chords / 2, 0, 1)), positions
+
+
+# stations of a station-level weather frame (first coordinates of each station) and its observations keyed by
+# station position * KEY_SPAN + day number
+def index_station_weather(df):
+    stations_df = df.drop_duplicates('station')[['station', 'lat', 'lon']]
+    stations_df = stations_df.loc[stations_df['lat'].notna() & stations_df['lon'].notna()]
+    index = StationIndex(stations_df)
+
+    codes = index.stations.get_indexer(df['station'].values)
+    days = df['date'].values.astype('datetime64[D]').astype('int64')
+    keys = np.where(codes >= 0, codes * KEY_SPAN + days, -1)
+
+    return index, pd.Index(keys)
+
+
+# weather columns of the fires (latitude, longitude, date), inverse distance weighted over the k nearest stations
+# that reported the column on the date, with the mean distance and the number of stations used
+def attribute_weather(fires_df, weather_df, columns, k=3, power=2, candidates=None, station_index=None):
+    if station_index is None:
+        station_index = index_station_weather(weather_df)
+    index, observations = station_index
+    values = {col: weather_df[col].to_numpy(dtype='float64', na_value=np.nan) for col in columns}
+
+    result = {col: np.full(len(fires_df), np.nan) for col in columns}
+    result['station_distance'] = np.full(len(fires_df), np.nan)
+    result['num_stations'] = np.zeros(len(fires_df), dtype='int64')
+
+    lat = fires_df['latitude'].to_numpy(dtype='float64')
+    lon = fires_df['longitude'].to_numpy(dtype='float64')
+    days = fires_df['date'].values.astype('datetime64[D]').astype('int64')
+    for start in range(0, len(fires_df), CHUNK_SIZE):
+        rows = np.arange(start, min(start + CHUNK_SIZE, len(fires_df)))
+        num_candidates = candidates or 4 * k
+
+        # widen the candidates of the fires with fewer than k stations reporting each column among them
+        while len(rows) > 0 and len(index) > 0:
+            distances, positions = index.query(lat[rows], lon[rows], num_candidates)
+            obs = observations.get_indexer((positions * KEY_SPAN + days[rows, None]).ravel()).reshape(positions.shape)
+            reported = obs >= 0
+            col_values = {col: np.where(reported, values[col][np.maximum(obs, 0)], np.nan) for col in columns}
+            num_valid = [(~np.isnan(col_values[col])).sum(axis=1) for col in columns] + [reported.sum(axis=1)]
+            done = (np.min(num_valid, axis=0) >= k) | (positions.shape[1] >= len(index))
+
+            finished = rows[done]
+            distances, reported = distances[done], reported[done]
+            weights = 1 / np.maximum(distances, 1e-3) ** power
+            for col in columns:
+                finished_values = col_values[col][done]
+                valid = ~np.isnan(finished_values)
+                # the k closest stations with a value (the candidates are in order of distance)
+                col_weights = np.where(valid & (np.cumsum(valid, axis=1) <= k), weights, 0)
+                with np.errstate(invalid='ignore'):
+                    result[col][finished] = np.nansum(finished_values * col_weights, axis=1) / col_weights.sum(axis=1)
+
+            used = reported & (np.cumsum(reported, axis=1) <= k)
+            result['num_stations'][finished] = used.sum(axis=1)
+            with np.errstate(invalid='ignore'):
+                result['station_distance'][finished] = (distances * used).sum(axis=1) / used.sum(axis=1)
+
+            rows = rows[~done]
+            num_candidates *= 4
+
+    return fires_df.assign(**result)
@@ -0,0 +1,43 @@
+import pandas as pd
+import pytest
+
+import benchmark
+import chunked
+import ingest
+import pushdown
+
+
+# generated rows of a few states over the years of the date range filter of the checks, dates with their time
+@pytest.fixture(scope='module')
+def raw_df():
+    return benchmark.generate_wildfire_data(20000, states=benchmark.US_STATES[:6], years=range(1998, 2006))
+
+
+# the rows as loaded by the pages, dates without their time of day
+@pytest.fixture(scope='module')
+def wildfire_df(raw_df):
+    return raw_df.assign(date=ingest.normalize_dates(raw_df['date']))
+
+
+def check(df, backend):
+    specs = pushdown.get_check_specs(backend.get_metadata())
+
+    return pushdown.check_backend(df, backend, specs, pushdown.CHECK_KEYS)
+
+
+def test_sqlite_backend_matches_pandas(wildfire_df):
+    assert check(wildfire_df, pushdown.create_sqlite_backend(wildfire_df)) == []
+
+
+# small chunks, so that the partial aggregates of many chunks are combined
+def test_chunked_backend_matches_pandas(tmp_path, raw_df, wildfire_df):
+    directory = str(tmp_path / 'wildfire_store')
+    for i, start in enumerate(range(0, len(raw_df), 5000)):
+        ingest.write_store_chunk(directory, raw_df.iloc[start:start + 5000], i)
+
+    assert check(wildfire_df, chunked.ChunkedBackend(directory, chunk_rows=1000)) == []
+
+
+def test_chunked_backend_refuses_empty_store(tmp_path):
+    with pytest.raises(ValueError):
+        chunked.ChunkedBackend(str(tmp_path)).get_metadata()
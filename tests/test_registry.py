@@ -0,0 +1,52 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import utils
+
+
+# one column of each dtype of the loaded datasets (plain and compact schemas, nullable bigquery integers)
+def make_frame():
+    return pd.DataFrame({
+        'float64': [1.5, np.nan, 3.5],
+        'float32': np.array([1, 2, 3], dtype='float32'),
+        'int64': [1, 2, 3],
+        'int8': np.array([1, 0, 1], dtype='int8'),
+        'bool': [True, False, True],
+        'object': ['CA', None, 'TX'],
+        'datetime': pd.to_datetime(['2015-01-01', None, '2015-01-03']),
+        'category': pd.Categorical(['A', 'B', None], categories=['A', 'B', 'C'], ordered=True),
+        'Int64': pd.array([1, None, 3], dtype='Int64'),
+        'Float64': pd.array([1.5, None, 3.5], dtype='Float64'),
+        'boolean': pd.array([True, None, False], dtype='boolean'),
+    })
+
+
+@pytest.fixture
+def registered():
+    registry = utils.DatasetRegistry()
+
+    return registry.get('test', make_frame)
+
+
+def test_registered_frame_keeps_its_values(registered):
+    pd.testing.assert_frame_equal(registered, make_frame())
+
+
+@pytest.mark.parametrize('col', list(make_frame().columns))
+def test_writes_to_registered_frame_raise(registered, col):
+    j = registered.columns.get_loc(col)
+    with pytest.raises(ValueError):
+        registered.iloc[0, j] = registered.iloc[2, j]
+    with pytest.raises(ValueError):
+        registered.loc[0, col] = registered.loc[2, col]
+    if isinstance(registered[col].dtype, np.dtype):
+        with pytest.raises(ValueError):
+            registered[col].to_numpy(copy=False)[0] = registered[col].iloc[2]
+
+    pd.testing.assert_frame_equal(registered, make_frame())
+
+
+def test_unsupported_dtype_is_refused():
+    with pytest.raises(TypeError):
+        utils.make_read_only(pd.DataFrame({'string': pd.array(['a', 'b'], dtype='string')}))
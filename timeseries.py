@@ -0,0 +1,129 @@
+import numpy as np
+import pandas as pd
+
+
+# multi-resolution time index of the wildfire totals: per series (region, fire size class) the cumulative daily
+# incidents and acres, so that the total of any date range is the difference of two prefix sums. The monthly and
+# yearly levels are the prefix sums at the month / year boundaries, a period chart is answered from the prefix sums
+# at the boundaries inside the date range (the first and last periods are clipped to the range)
+
+PERIOD_FREQS = {'D': 'D', 'M': 'MS', 'Y': 'AS'}
+# periods are labelled by their last day (as with resample)
+PERIOD_LABELS = {'D': pd.offsets.Day(0), 'M': pd.offsets.MonthEnd(0), 'Y': pd.offsets.YearEnd(0)}
+TREND_MAX_POINTS = 2000  # daily series longer than this are downsampled before they are charted
+
+
+class TimePyramid:
+    # df: rows or rollup cube with a date column, the keys and optionally incident (else each row is an incident)
+    def __init__(self, df, keys=('region', 'fire_size_class')):
+        self.keys = list(keys)
+
+        series_codes = np.zeros(len(df), dtype='int64')
+        self.key_values = []
+        for key in self.keys:
+            codes, uniques = pd.factorize(df[key], sort=True)
+            series_codes = series_codes * len(uniques) + codes
+            self.key_values.append(pd.Index(np.asarray(uniques)))
+        self.num_series = int(np.prod([len(values) for values in self.key_values]))
+
+        days = df['date'].values.astype('datetime64[D]')
+        self.start = days.min() if len(days) > 0 else np.datetime64('1970-01-01')
+        self.num_days = int((days.max() - self.start).astype('int64')) + 1 if len(days) > 0 else 0
+        offsets = (days - self.start).astype('int64')
+
+        incident = df['incident'].values if 'incident' in df.columns else np.ones(len(df), dtype='int64')
+        self.prefix = {}
+        for col, weights in [('incident', incident), ('fire_size', df['fire_size'].values)]:
+            daily = np.bincount(series_codes * self.num_days + offsets, weights=weights,
+                                minlength=self.num_series * self.num_days).reshape(self.num_series, self.num_days)
+            prefix = np.zeros((self.num_series, self.num_days + 1), dtype=daily.dtype)
+            np.cumsum(daily, axis=1, out=prefix[:, 1:])
+            self.prefix[col] = prefix.astype('int64') if col == 'incident' else prefix
+
+    def get_series_mask(self, selections):
+        mask = np.ones(self.num_series, dtype=bool)
+        for i, (key, values) in enumerate(zip(self.keys, self.key_values)):
+            selected = selections.get(key)
+            if selected is None:
+                continue
+            key_mask = values.isin(selected)
+            # series code = ((code_0 * n_1 + code_1) * n_2 + ...), repeat / tile the mask of this key accordingly
+            inner = int(np.prod([len(v) for v in self.key_values[i + 1:]]))
+            outer = int(np.prod([len(v) for v in self.key_values[:i]]))
+            mask &= np.tile(np.repeat(key_mask, inner), outer)
+
+        return mask
+
+    # day offsets of the period boundaries between date_from and date_to (inclusive), clipped to the range
+    def get_boundaries(self, period, date_from=None, date_to=None):
+        end = self.start + np.timedelta64(self.num_days, 'D')
+        lo = self.start if date_from is None else max(self.start, np.datetime64(date_from, 'D'))
+        hi = end if date_to is None else min(end, np.datetime64(date_to, 'D') + np.timedelta64(1, 'D'))
+        if hi <= lo:
+            return pd.DatetimeIndex([]), np.zeros(1, dtype='int64')
+
+        starts = pd.date_range(pd.Timestamp(lo).to_period(period).start_time, pd.Timestamp(hi), freq=PERIOD_FREQS[period])
+        starts = starts[starts < pd.Timestamp(hi)]
+        bounds = np.append(np.maximum(starts.values.astype('datetime64[D]'), lo), hi)
+
+        return starts, (bounds - self.start).astype('int64')
+
+    # incidents and acres per period ('D', 'M' or 'Y') of the selected series (key: values, None for all),
+    # between the first and the last period with an incident, like a resample of the rows
+    def query(self, selections=None, date_from=None, date_to=None, period='D'):
+        mask = self.get_series_mask(selections or {})
+        starts, bounds = self.get_boundaries(period, date_from, date_to)
+
+        # only the boundary columns of the selected series are gathered, not the full series
+        rows = np.ix_(mask, bounds)
+        columns = {}
+        for col, prefix in self.prefix.items():
+            columns[col] = np.diff(prefix[rows].sum(axis=0))
+        df = pd.DataFrame(columns, index=starts)
+
+        nonzero = np.flatnonzero(df['incident'].values > 0)
+        if period == 'D':
+            df = df.iloc[nonzero]
+        elif len(nonzero) > 0:
+            df = df.iloc[nonzero[0]:nonzero[-1] + 1]
+        else:
+            df = df.iloc[0:0]
+        df.index = (df.index + PERIOD_LABELS[period]).rename('date')
+
+        return df
+
+
+# largest-triangle-three-buckets downsampling of a series to num_out points (keeps the first and last points)
+def lttb(x, y, num_out):
+    num_in = len(x)
+    if num_out >= num_in or num_out < 3:
+        return np.arange(num_in)
+
+    x = np.asarray(x, dtype='float64')
+    y = np.asarray(y, dtype='float64')
+    edges = np.linspace(1, num_in - 1, num_out - 1).astype('int64')
+
+    selected = np.zeros(num_out, dtype='int64')
+    a = 0
+    for i in range(num_out - 2):
+        start, stop = edges[i], edges[i + 1]
+        # average point of the next bucket (the last point for the last bucket)
+        next_stop = edges[i + 2] if i + 2 < len(edges) else num_in
+        next_x, next_y = x[stop:next_stop].mean(), y[stop:next_stop].mean()
+
+        areas = np.abs((x[a] - next_x) * (y[start:stop] - y[a]) - (x[a] - x[start:stop]) * (next_y - y[a]))
+        a = start + int(np.argmax(areas))
+        selected[i + 1] = a
+    selected[-1] = num_in - 1
+
+    return selected
+
+
+# downsample a frame indexed by date to at most max_points rows, keeping the shape of column
+def downsample(df, column, max_points=TREND_MAX_POINTS):
+    if len(df) <= max_points:
+        return df
+
+    x = df.index.values.astype('datetime64[D]').astype('int64')
+
+    return df.iloc[lttb(x, df[column].values, max_points)]
@@ -1,160 +1,741 @@
 import streamlit as st
+import numpy as np
 import pandas as pd
-import glob
 import json
+import os
+import time
+import hashlib
+import threading
+from collections import namedtuple
+import pyarrow as pa
 
-# import sqlite3
 from google.oauth2 import service_account
 from google.cloud import bigquery
 
+import rollup
+import spatial
+import ingest
+import pushdown
+import chunked
+import timeseries
+import features
+import risk
+import stations
+import spans
+import analytics
+from filters import FilterIndex, WildfireFilter, sort_for_index
+
+
+# local columnar snapshots of query results, keyed by a hash of the query text and parameters
+SNAPSHOT_DIR = 'snapshots'
+SNAPSHOT_TTL = 7 * 24 * 60 * 60  # in seconds, None to never expire
+
+# chart results of the state x year views pre-rendered from the snapshots, see python . prerender
+PRERENDERED_FILE = os.path.join(SNAPSHOT_DIR, 'prerendered_views.pkl')
+
+# show debug information (e.g. dataset registry stats) in the sidebar
+DEBUG = os.environ.get('WILDFIRE_DEBUG', '0') == '1'
+
+# opt-in compact schema for the loaded data (categoricals, float32, int8), e.g. to fit the full dataset
+COMPACT_DTYPES = os.environ.get('WILDFIRE_COMPACT_DTYPES', '0') == '1'
+
+# 'local' filters and groups the loaded data in pandas,
+# 'pushdown' lets the database run the filters and compute the grouped totals used by the charts,
+# 'chunked' streams the filters and grouped totals over the partitioned store (e.g. the full dataset) in chunks
+QUERY_MODE = os.environ.get('WILDFIRE_QUERY_MODE', 'local')
+BACKEND_QUERY_MODES = ('pushdown', 'chunked')  # the wildfire rows are not loaded
+
+# partitioned store of the wildfire data (see python . store) and the rows per chunk read by the chunked mode
+WILDFIRE_STORE_DIR = 'dataset/wildfire_store'
+CHUNK_ROWS = int(os.environ.get('WILDFIRE_CHUNK_ROWS', str(chunked.CHUNK_ROWS)))
+
+# above this number of filtered incidents the map shows grid cells instead of points
+MAP_MAX_POINTS = int(os.environ.get('WILDFIRE_MAP_MAX_POINTS', '50000'))
+
+FIRE_SIZE_CLASSES = ['A', 'B', 'C', 'D', 'E', 'F', 'G']
+
+DESCRIPTIONS_SHARED_FILE = 'input/descr_shared_data.json'
+DESCRIPTIONS_WILDFIRE_FILE = 'input/descr_wildfire_data.json'
+DESCRIPTIONS_WEATHER_FILE = 'input/descr_weather_data.json'
+WEATHER_FLAG_COLUMNS = ['fog', 'rain_drizzle', 'snow_ice_pellets', 'hail', 'thunder', 'tornado_funnel_cloud']
+
+WILDFIRE_QUERY = "SELECT * FROM `vernal-shine-239106.US_Wildfire_Dataset.wildfire`"
+
+WEATHER_QUERY = "SELECT CONCAT(year,'-',mo,'-',da) as date, \
+                        country, state as region, AVG(s.lat) lat, AVG(s.lon) lon, COUNT(*) count, \
+                        AVG(IF (temp=9999.9, null, temp)) as temp, \
+                        AVG(IF (dewp=9999.9, null, dewp)) as dew_point, \
+                        AVG(IF (slp=9999.9, null, slp)) as sea_level_pressure, \
+                        AVG(IF (stp=9999.9, null, stp)) as station_pressure, \
+                        AVG(IF (visib=999.9, null, visib)) as visibility, \
+                        AVG(IF (wdsp='999.9', null, CAST(wdsp AS FLOAT64))) as wind_speed, \
+                        MAX(IF (mxpsd='999.9', null, CAST(mxpsd AS FLOAT64))) as max_sustained_wind, \
+                        MAX(IF (gust=999.9, null, gust)) as max_wind_gust, \
+                        MAX(IF (max=9999.9, null, max)) as max_temp, \
+                        MIN(IF (min=9999.9, null, min)) as min_temp, \
+                        AVG(IF (prcp=99.9, null, prcp)) as precipitation, \
+                        AVG(IF (sndp=999.9, null, sndp)) as snow_depth, \
+                        MAX(CAST(fog AS INT64)) as fog, \
+                        MAX(CAST(rain_drizzle AS INT64)) as rain_drizzle, \
+                        MAX(CAST(snow_ice_pellets AS INT64)) as snow_ice_pellets, \
+                        MAX(CAST(hail AS INT64)) as hail, \
+                        MAX(CAST(thunder AS INT64)) as thunder, \
+                        MAX(CAST(tornado_funnel_cloud AS INT64)) as tornado_funnel_cloud \
+                    FROM `bigquery-public-data.noaa_gsod.gsod*` w \
+                    JOIN `bigquery-public-data.noaa_gsod.stations` s \
+                    ON w.stn = s.usaf AND w.wban = s.wban  \
+                    AND _TABLE_SUFFIX BETWEEN '{}' AND '{}' \
+                    AND s.country = 'US' AND state IS NOT NULL \
+                    GROUP BY _TABLE_SUFFIX, date, country, state \
+                    ORDER BY date, country, state"
+
+# one row per us station per day, with the station coordinates (nearest-station weather of the fires)
+WEATHER_STATION_QUERY = "SELECT CONCAT(year,'-',mo,'-',da) as date, \
+                        CONCAT(w.stn, '-', w.wban) as station, state, s.lat, s.lon, \
+                        IF (temp=9999.9, null, temp) as temp, \
+                        IF (dewp=9999.9, null, dewp) as dew_point, \
+                        IF (slp=9999.9, null, slp) as sea_level_pressure, \
+                        IF (wdsp='999.9', null, CAST(wdsp AS FLOAT64)) as wind_speed, \
+                        IF (mxpsd='999.9', null, CAST(mxpsd AS FLOAT64)) as max_sustained_wind, \
+                        IF (gust=999.9, null, gust) as max_wind_gust, \
+                        IF (max=9999.9, null, max) as max_temp, \
+                        IF (min=9999.9, null, min) as min_temp, \
+                        IF (prcp=99.9, null, prcp) as precipitation, \
+                        CAST(fog AS INT64) as fog, \
+                        CAST(rain_drizzle AS INT64) as rain_drizzle, \
+                        CAST(thunder AS INT64) as thunder \
+                    FROM `bigquery-public-data.noaa_gsod.gsod*` w \
+                    JOIN `bigquery-public-data.noaa_gsod.stations` s \
+                    ON w.stn = s.usaf AND w.wban = s.wban  \
+                    AND _TABLE_SUFFIX BETWEEN '{}' AND '{}' \
+                    AND s.country = 'US' AND s.lat IS NOT NULL AND s.lon IS NOT NULL \
+                    ORDER BY date, station"
+
+
+# stand-in for the bigquery client when no gcp credentials are available (e.g. offline),
+# serves the same queries from the local csv exports (or the original sqlite database without the wildfire export)
+class LocalQueryJob:
+    def __init__(self, df):
+        self.df = df
+
+    def result(self):
+        return self
+
+    def to_dataframe(self):
+        return self.df
+
+
+class LocalClient:
+    def __init__(self, wildfire_filename='dataset/wildfire_data.csv',
+                 weather_filename='dataset/weather_noaa/weather_data_noaa_*.csv',
+                 wildfire_db_filename='dataset/FPA_FOD_20170508.sqlite',
+                 station_weather_filename='dataset/weather_noaa_stations/weather_stations_noaa_*.csv'):
+        self.wildfire_filename = wildfire_filename
+        self.weather_filename = weather_filename
+        self.wildfire_db_filename = wildfire_db_filename
+        self.station_weather_filename = station_weather_filename
+
+    # local source (kind, file or pattern) of a query, its parameters (e.g. the years of the weather) are not applied
+    def get_source(self, query_stmt):
+        if 'US_Wildfire_Dataset.wildfire' in query_stmt:
+            if os.path.exists(self.wildfire_filename) or not os.path.exists(self.wildfire_db_filename):
+                return 'wildfire_csv', self.wildfire_filename
+            return 'wildfire_db', self.wildfire_db_filename
+        if 'noaa_gsod' in query_stmt and 'as station,' in query_stmt:
+            return 'station_weather_csv', self.station_weather_filename
+        if 'noaa_gsod' in query_stmt:
+            return 'weather_csv', self.weather_filename
+
+        raise ValueError("Query not supported by the local client: {}".format(query_stmt))
+
+    # describes the local data a query is served from (files and their modification times), so that its snapshot
+    # is never mistaken for a bigquery result and is refreshed when the files change
+    def get_snapshot_source(self, query_stmt):
+        kind, filename = self.get_source(query_stmt)
+
+        return ['local', kind, ingest.get_files_signature(filename)]
+
+    def query(self, query_stmt, job_config=None):
+        kind, filename = self.get_source(query_stmt)
+        if kind == 'wildfire_csv':
+            df = ingest.read_csv_files(filename, ingest.WILDFIRE_CSV_SCHEMA)
+        elif kind == 'wildfire_db':
+            df = ingest.ingest_fires_sqlite(filename, min_fire_size=10)
+        elif kind == 'station_weather_csv':
+            df = ingest.read_csv_files(filename, ingest.WEATHER_STATION_CSV_SCHEMA)
+        else:
+            df = ingest.read_csv_files(filename, ingest.WEATHER_NOAA_CSV_SCHEMA)
+            df.rename(columns={'state': 'region'}, inplace=True)
+
+        return LocalQueryJob(df)
+
 
 @st.cache_resource
 def connect_gcp():
-    credentials = service_account.Credentials.from_service_account_info(
-        st.secrets["gcp_service_account"]
-    )
+    try:
+        credentials = service_account.Credentials.from_service_account_info(
+            st.secrets["gcp_service_account"]
+        )
+    except (KeyError, FileNotFoundError):
+        # no credentials configured, run offline from local files
+        return LocalClient()
     client = bigquery.Client(credentials=credentials)
 
     return client
 
-# load wildfire data from sqlite
-@st.cache_data
-def load_wildfire_data_local_db(filename='dataset/FPA_FOD_20170508.sqlite'):
-    cnx = sqlite3.connect()
 
-    df = pd.read_sql_query("SELECT fire_year as year, discovery_date as date, state, stat_cause_code, stat_cause_descr as stat_cause, latitude, longitude, fire_size, fire_size_class FROM 'Fires' ORDER BY fire_year, discovery_date", cnx)
-    df['date'] = pd.to_datetime(df['date'] - pd.Timestamp(0).to_julian_date(), unit='D')
+# the source (e.g. bigquery, or the local files of LocalClient) is part of the key, if any
+def get_snapshot_key(query_stmt, params=(), source=None):
+    payload = {'query': query_stmt, 'params': list(params)}
+    if source is not None:
+        payload['source'] = source
+    payload = json.dumps(payload, sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+def get_snapshot_path(key, snapshot_dir=SNAPSHOT_DIR):
+    return os.path.join(snapshot_dir, key + '.parquet')
+
+
+# returns None if the snapshot does not exist or is older than the ttl
+def read_snapshot(key, ttl=SNAPSHOT_TTL, snapshot_dir=SNAPSHOT_DIR):
+    path = get_snapshot_path(key, snapshot_dir)
+    if not os.path.exists(path):
+        return None
+    if ttl is not None and time.time() - os.path.getmtime(path) > ttl:
+        return None
+
+    return pd.read_parquet(path)
+
+
+def write_snapshot(df, key, snapshot_dir=SNAPSHOT_DIR):
+    os.makedirs(snapshot_dir, exist_ok=True)
+    path = get_snapshot_path(key, snapshot_dir)
+
+    # write to a temp file first so readers never see a partial snapshot
+    tmp_path = path + '.tmp'
+    df.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, path)
+
+    return path
+
+
+# run a query, or read its result from the local snapshot if there is a fresh one
+def query_snapshot(client, query_stmt, params=(), ttl=SNAPSHOT_TTL, refresh=False):
+    if isinstance(client, LocalClient):
+        # the local stand-in ignores the parameters
+        key = get_snapshot_key(query_stmt, source=client.get_snapshot_source(query_stmt))
+    else:
+        key = get_snapshot_key(query_stmt, params, source='bigquery')
+
+    df = None if refresh else read_snapshot(key, ttl)
+    if df is None:
+        query_job = client.query(query_stmt.format(*params))
+        df = (query_job.result().to_dataframe())
+        write_snapshot(df, key)
+
+    return df
+
+
+# re-query bigquery and overwrite the local snapshots
+def refresh_snapshots(client, from_year=1992, to_year=2015):
+    query_snapshot(client, WILDFIRE_QUERY, refresh=True)
+    query_snapshot(client, WEATHER_QUERY, (from_year, to_year), refresh=True)
+
+# load wildfire data from the original sqlite database, streamed in chunks with the filters pushed into sql,
+# by default only the wildfires of 10 acres or more (as in the bigquery dataset)
+@st.cache_data
+def load_wildfire_data_local_db(filename='dataset/FPA_FOD_20170508.sqlite', min_fire_size=10, states=None, years=None):
+    df = ingest.ingest_fires_sqlite(filename, min_fire_size, states, years)
     df['incident'] = 1
-    df.columns = df.columns.str.lower()
+    df['datetime'] = df['date']
+    df['date'] = ingest.normalize_dates(df['date'])
 
     return df
 
 
-# load weather data from csv file
+# load wildfire data from the partitioned store (see python . store), only the partitions of the states and years
 @st.cache_data
-def load_wildfire_data_local_csv(filename='dataset/wildfire_data.csv'):
-    df = pd.read_csv(filename)
+def load_wildfire_data_local_store(directory=WILDFIRE_STORE_DIR, states=None, years=None):
+    df = ingest.read_wildfire_store(directory, states, years)
     df['incident'] = 1
-    df['datetime'] = pd.to_datetime(df['date'])
-    df['date'] = pd.to_datetime(df['datetime'].dt.date)
+    df['datetime'] = df['date']
+    df['date'] = ingest.normalize_dates(df['date'])
 
     return df
 
 
-# load wildfire data from google cloud big query
+# load wildfire data from csv file
 @st.cache_data
-def load_wildfire_data_gcp(_client):
-    query_job = _client.query("SELECT * FROM `vernal-shine-239106.US_Wildfire_Dataset.wildfire`")
-    df = (query_job.result().to_dataframe())
-    
+def load_wildfire_data_local_csv(filename='dataset/wildfire_data.csv', engine='c'):
+    df = ingest.read_csv_files(filename, ingest.WILDFIRE_CSV_SCHEMA, list(ingest.WILDFIRE_CSV_SCHEMA), engine)
     df['incident'] = 1
     df['datetime'] = df['date']
-    df['date'] = pd.to_datetime(df['date'].dt.date)
+    df['date'] = ingest.normalize_dates(df['date'])
 
     return df
 
 
-# load weather data from visual crossing json files (api export)
+# small versioned handle of a dataset: derived caches (lists, ranges, rollups, indexes) are keyed on it,
+# so streamlit hashes a name and a fingerprint on each rerun instead of the whole dataframe
+DatasetHandle = namedtuple('DatasetHandle', ['name', 'fingerprint'])
+
+
+# content fingerprint of a dataframe, computed once when the dataset is loaded
+def get_dataset_fingerprint(df):
+    fingerprint = hashlib.sha1(str(list(zip(df.columns, df.dtypes.astype(str)))).encode('utf-8'))
+    fingerprint.update(pd.util.hash_pandas_object(df, index=False).values.tobytes())
+
+    return fingerprint.hexdigest()
+
+
+# handle of a dataset derived from another one (e.g. its rollup cube), same version as its source
+def get_derived_handle(handle, name):
+    return DatasetHandle(handle.name + '/' + name, handle.fingerprint)
+
+
+# read-only array of a column, a view of its data when it is a numpy array (a view of a read-only array cannot be
+# made writable again), the categorical codes and the nullable values and masks are copied once
+def get_read_only_array(series):
+    values = series.array
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        codes = series.cat.codes.to_numpy()
+        codes.setflags(write=False)
+        return pd.Categorical.from_codes(codes, dtype=series.dtype)
+    if isinstance(values, (pd.arrays.IntegerArray, pd.arrays.FloatingArray, pd.arrays.BooleanArray)):
+        data = values.to_numpy(dtype=series.dtype.numpy_dtype, na_value=0)
+        mask = series.isna().to_numpy()
+        data.setflags(write=False)
+        mask.setflags(write=False)
+        return type(values)(data, mask)
+    if isinstance(series.dtype, np.dtype):
+        data = series.to_numpy(copy=False)
+        data.setflags(write=False)
+        return data
+
+    raise TypeError("Cannot make the column {} ({}) read-only".format(series.name, series.dtype))
+
+
+# frame of the read-only arrays of the columns of df (numpy columns are not copied), so that no session can modify
+# the shared data. Raises if the constructor copied a column into a writable array
+def make_read_only(df):
+    read_only_df = pd.DataFrame({col: get_read_only_array(df[col]) for col in df.columns}, index=df.index,
+                                copy=False)
+    for col in read_only_df.columns:
+        if isinstance(read_only_df[col].dtype, np.dtype) and read_only_df[col].to_numpy(copy=False).flags.writeable:
+            raise TypeError("The column {} was copied into a writable array".format(col))
+
+    return read_only_df
+
+
+# process-wide registry of the loaded datasets, shared by all sessions and pages without copying:
+# each dataset is kept as a single read-only dataframe, the arrow table it is converted from is released
+# (only its size is kept for the stats)
+class DatasetRegistry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.load_locks = {}
+        self.entries = {}
+
+    def get(self, name, loader):
+        with self.lock:
+            load_lock = self.load_locks.setdefault(name, threading.Lock())
+
+        # concurrent sessions asking for the same dataset wait for a single load
+        with load_lock:
+            entry = self.entries.get(name)
+            if entry is None:
+                start_time = time.time()
+                table = pa.Table.from_pandas(loader(), preserve_index=False)
+                # one block per column, numeric columns without nulls are zero-copy (read-only) views,
+                # self_destruct frees the table buffers as the other columns are converted
+                num_rows, num_bytes = table.num_rows, table.nbytes
+                df = make_read_only(table.to_pandas(split_blocks=True, self_destruct=True))
+                del table
+                entry = {
+                    'rows': num_rows,
+                    'arrow_bytes': num_bytes,
+                    'df': df,
+                    'handle': DatasetHandle(name, get_dataset_fingerprint(df)),
+                    'hits': 0,
+                    'load_time': time.time() - start_time
+                }
+                self.entries[name] = entry
+            entry['hits'] += 1
+
+        return entry['df']
+
+    # handle of a registered frame, computed once at load time: the lookup never hashes the data (it runs on every
+    # rerun), so frames that were not loaded through the registry are refused instead of fingerprinted
+    def get_handle(self, df):
+        for entry in list(self.entries.values()):
+            if entry['df'] is df:
+                return entry['handle']
+
+        raise ValueError("Not a registered dataset, load it with DatasetRegistry.get (or derive its handle with "
+                         "get_derived_handle)")
+
+    def get_stats(self):
+        stats = []
+        for name, entry in list(self.entries.items()):
+            stats.append({
+                'dataset': name,
+                'version': entry['handle'].fingerprint[:8],
+                'rows': entry['rows'],
+                'arrow_MB': round(entry['arrow_bytes'] / 2**20, 2),
+                'frame_MB': round(entry['df'].memory_usage(index=False, deep=True).sum() / 2**20, 2),
+                'hits': entry['hits'],
+                'load_seconds': round(entry['load_time'], 2)
+            })
+
+        return pd.DataFrame(stats, columns=['dataset', 'version', 'rows', 'arrow_MB', 'frame_MB', 'hits', 'load_seconds'])
+
+
+# created once at import (not with st.cache_resource): the loads on the startup pool run outside of a script
+# thread, where streamlit must not be called
+dataset_registry = DatasetRegistry()
+
+
+def get_dataset_registry():
+    return dataset_registry
+
+
+def get_dataset_handle(df):
+    return get_dataset_registry().get_handle(df)
+
+
+# load wildfire data from google cloud big query, the result is shared read-only by all sessions, sorted in the
+# order of its filter index so that the index does not keep a sorted copy
+@spans.traced('load wildfire data')
+def load_wildfire_data_gcp(_client, compact=False):
+    return get_dataset_registry().get('wildfire' + ('_compact' if compact else ''), \
+        lambda: sort_for_index(read_wildfire_data_gcp(_client, compact)))
+
+
+def read_wildfire_data_gcp(client, compact=False):
+    df = query_snapshot(client, WILDFIRE_QUERY)
+
+    if not compact:
+        df['incident'] = 1
+        df['datetime'] = df['date']
+    df['date'] = ingest.normalize_dates(df['date'])
+
+    if compact:
+        df = compact_wildfire_df(df)
+
+    return df
+
+
+# load weather data from visual crossing json files (api export), parsed in parallel,
+# optionally saved to / read from a local snapshot that is refreshed when the files change
 @st.cache_data
-def load_weather_data_local_json(filename='dataset/weather_vcross/weather_hist_*_*.json'):
-    json_files = sorted(glob.glob(filename))
-
-    df = None
-    for json_file in json_files:
-        with open(json_file,'r') as f:
-            weather_dict = json.loads(f.read())
-            state = json_file.split('_')[2]
-
-            if df is None:
-                df = pd.json_normalize(weather_dict, record_path=['days'])
-                df['region'] = state
-            else:
-                tmp_df = pd.json_normalize(weather_dict, record_path=['days'])
-                tmp_df['region'] = state
-                df = pd.concat([df, tmp_df])
-                del tmp_df
-
-    df.rename(columns={'datetime': 'date'}, inplace=True)
-    df['date'] = pd.to_datetime(df['date'])
+def load_weather_data_local_json(filename='dataset/weather_vcross/weather_hist_*_*.json', processes=None, snapshot=False):
+    if snapshot:
+        key = get_snapshot_key(filename, ingest.get_files_signature(filename))
+        df = read_snapshot(key, ttl=None)
+        if df is not None:
+            return df
+
+    df = ingest.ingest_weather_json(filename, processes)
+    if snapshot:
+        write_snapshot(df, key)
 
     return df
 
 
-# load weather data csv from noaa (gcp export)
+# memory-mapped visual crossing weather store (see python . weather-store), opened once per version of the files
+@st.cache_resource
+def get_weather_store(directory, version):
+    return ingest.WeatherStore(directory)
+
+
+# load visual crossing weather from the memory-mapped store, only the rows of the states and dates are read
 @st.cache_data
-def load_weather_data_local_csv(filename='dataset/weather_noaa/weather_data_noaa_*.csv'):
-    csv_files = sorted(glob.glob(filename))
+def load_weather_data_local_store(directory='dataset/weather_store', states=None, date_from=None, date_to=None,
+                                  columns=None):
+    store = get_weather_store(directory, ingest.get_files_signature(os.path.join(directory, '*')))
 
-    df_list = []
-    for file in csv_files:
-        df = pd.read_csv(file, index_col=None, header=0)
-        df_list.append(df)
+    return store.read(states, date_from, date_to, columns)
 
-    df = pd.concat(df_list, ignore_index=True)
+
+# load weather data csv from noaa (gcp export), only the columns used by the weather page,
+# the files are read in parallel
+@st.cache_data
+def load_weather_data_local_csv(filename='dataset/weather_noaa/weather_data_noaa_*.csv',
+                                columns=ingest.WEATHER_NOAA_PAGE_COLUMNS, engine='c', workers=None):
+    df = ingest.read_csv_files(filename, ingest.WEATHER_NOAA_CSV_SCHEMA, columns, engine, workers)
     df.rename(columns={'state': 'region'}, inplace=True)
+
+    return df
+
+
+# load weather data direct from gcp bigquery noaa dataset, the result is shared read-only by all sessions, sorted
+# in the order of its filter index (the query orders by date, then state)
+@spans.traced('load weather data')
+def load_weather_data_gcp(_client, from_year=1992, to_year=2015, compact=False):
+    return get_dataset_registry().get('weather_{}_{}'.format(from_year, to_year) + ('_compact' if compact else ''), \
+        lambda: sort_for_index(read_weather_data_gcp(_client, from_year, to_year, compact)))
+
+
+def read_weather_data_gcp(client, from_year=1992, to_year=2015, compact=False):
+    df = query_snapshot(client, WEATHER_QUERY, (from_year, to_year))
     df['date'] = pd.to_datetime(df['date'])
-    
+
+    if compact:
+        df = compact_weather_df(df)
+
     return df
 
 
-# load weather data direct from gcp bigquery noaa dataset
-@st.cache_data
-def load_weather_data_gcp(_client, from_year=1992, to_year=2015):
-    query_stmt = "SELECT CONCAT(year,'-',mo,'-',da) as date, \
-                        country, state as region, AVG(s.lat) lat, AVG(s.lon) lon, COUNT(*) count, \
-                        AVG(IF (temp=9999.9, null, temp)) as temp, \
-                        AVG(IF (dewp=9999.9, null, dewp)) as dew_point, \
-                        AVG(IF (slp=9999.9, null, slp)) as sea_level_pressure, \
-                        AVG(IF (stp=9999.9, null, stp)) as station_pressure, \
-                        AVG(IF (visib=999.9, null, visib)) as visibility, \
-                        AVG(IF (wdsp='999.9', null, CAST(wdsp AS FLOAT64))) as wind_speed, \
-                        MAX(IF (mxpsd='999.9', null, CAST(mxpsd AS FLOAT64))) as max_sustained_wind, \
-                        MAX(IF (gust=999.9, null, gust)) as max_wind_gust, \
-                        MAX(IF (max=9999.9, null, max)) as max_temp, \
-                        MIN(IF (min=9999.9, null, min)) as min_temp, \
-                        AVG(IF (prcp=99.9, null, prcp)) as precipitation, \
-                        AVG(IF (sndp=999.9, null, sndp)) as snow_depth, \
-                        MAX(CAST(fog AS INT64)) as fog, \
-                        MAX(CAST(rain_drizzle AS INT64)) as rain_drizzle, \
-                        MAX(CAST(snow_ice_pellets AS INT64)) as snow_ice_pellets, \
-                        MAX(CAST(hail AS INT64)) as hail, \
-                        MAX(CAST(thunder AS INT64)) as thunder, \
-                        MAX(CAST(tornado_funnel_cloud AS INT64)) as tornado_funnel_cloud \
-                    FROM `bigquery-public-data.noaa_gsod.gsod*` w \
-                    JOIN `bigquery-public-data.noaa_gsod.stations` s \
-                    ON w.stn = s.usaf AND w.wban = s.wban  \
-                    AND _TABLE_SUFFIX BETWEEN '{}' AND '{}' \
-                    AND s.country = 'US' AND state IS NOT NULL \
-                    GROUP BY _TABLE_SUFFIX, date, country, state \
-                    ORDER BY date, country, state".format(from_year, to_year)
+# load the station-level weather (one row per station per day) from gcp, shared read-only by all sessions
+def load_station_weather_gcp(_client, from_year=1992, to_year=2015):
+    return get_dataset_registry().get('station_weather_{}_{}'.format(from_year, to_year), \
+        lambda: read_station_weather_gcp(_client, from_year, to_year))
+
 
-    query_job = _client.query(query_stmt)
-    df = (query_job.result().to_dataframe())
+def read_station_weather_gcp(client, from_year=1992, to_year=2015):
+    df = query_snapshot(client, WEATHER_STATION_QUERY, (from_year, to_year))
     df['date'] = pd.to_datetime(df['date'])
 
     return df
 
 
+# compact schema of the wildfire data: categorical strings, float32 coordinates, smallest ints,
+# and no constant incident / redundant datetime column (incidents are counted as rows instead)
+def compact_wildfire_df(df):
+    df = df.drop(columns=['incident', 'datetime'], errors='ignore')
+
+    for col in df.columns:
+        if col == 'fire_size_class':
+            df[col] = pd.Categorical(df[col], categories=FIRE_SIZE_CLASSES, ordered=True)
+        elif col in ('region', 'stat_cause'):
+            df[col] = df[col].astype('category')
+        elif col in ('latitude', 'longitude'):
+            df[col] = df[col].astype('float32')
+        elif pd.api.types.is_integer_dtype(df[col]) and not df[col].hasnans:
+            df[col] = pd.to_numeric(df[col].astype('int64'), downcast='integer')
+
+    return df
+
+
+# compact schema of the weather data: categorical strings, float32 measures, int8 flags
+def compact_weather_df(df):
+    for col in df.columns:
+        if col in WEATHER_FLAG_COLUMNS:
+            df[col] = df[col].fillna(0).astype('int8')
+        elif col in ('region', 'country'):
+            df[col] = df[col].astype('category')
+        elif col == 'count':
+            df[col] = df[col].fillna(0).astype('int32')
+        elif pd.api.types.is_float_dtype(df[col]):
+            df[col] = df[col].astype('float32')
+
+    return df
+
+
+# memory used per column, to check how much the compact schema saves
+def get_memory_report(df):
+    report = pd.DataFrame({
+        'dtype': df.dtypes.astype(str),
+        'bytes': df.memory_usage(index=False, deep=True)
+    })
+    report.loc['total'] = ['', report['bytes'].sum()]
+    report['MB'] = (report['bytes'] / 2**20).round(2)
+
+    return report
+
+
 # precompute values (lists, ranges) to be used in forms
+@spans.traced('cache: wildfire lists')
 @st.cache_data
-def get_wildfire_lists(df):
-    list_fire_size_classes = df['fire_size_class'].sort_values().unique()
-    list_states = df['region'].sort_values().unique()
-    list_years = df['date'].dt.year.sort_values().astype(str).unique()
-    list_causes = df['stat_cause'].sort_values().unique()
+def get_wildfire_lists(_df, handle):
+    list_fire_size_classes = np.asarray(_df['fire_size_class'].sort_values().unique())
+    list_states = np.asarray(_df['region'].sort_values().unique())
+    list_years = _df['date'].dt.year.sort_values().astype(str).unique()
+    list_causes = np.asarray(_df['stat_cause'].sort_values().unique())
 
     return list_fire_size_classes, list_states, list_years, list_causes
 
 
+@spans.traced('cache: wildfire ranges')
 @st.cache_data
-def get_wildfire_ranges(df):
-    max_fire_size = int(max(df['fire_size'])) + 1
-    min_date = min(df['date'])
-    max_date = max(df['date'])
+def get_wildfire_ranges(_df, handle):
+    max_fire_size = int(_df['fire_size'].max()) + 1
+    min_date = _df['date'].min()
+    max_date = _df['date'].max()
 
     return max_fire_size, min_date, max_date
 
 
+# sorted (region, date) index used to filter the data, shared as is (not copied) across sessions
+@spans.traced('cache: filter index')
+@st.cache_resource
+def get_filter_index(_df, handle):
+    return FilterIndex(_df)
+
+
+# rollup cube of the wildfire data, built once and sliced by the charts instead of the raw rows
+@spans.traced('cache: rollup cube')
+@st.cache_resource
+def get_wildfire_cube(_df, handle):
+    return rollup.build_wildfire_cube(_df)
+
+
+# incidents and acres per map cell, year, state, class and cause, built once and sliced by the map
+@spans.traced('cache: cell cube')
+@st.cache_resource
+def get_cell_cube(_df, handle):
+    return spatial.build_cell_cube(_df)
+
+
+# prefix sums of the daily totals per region and fire size class, answers the trend charts
+@spans.traced('cache: time pyramid')
+@st.cache_resource
+def get_time_pyramid(_df, handle):
+    return timeseries.TimePyramid(_df)
+
+
+# daily weather features per region (rolling windows, lags, dry streaks, seasonality) for the risk model
+@spans.traced('cache: weather features')
+@st.cache_resource
+def get_weather_features(_df, handle):
+    return features.compute_features(_df)
+
+
+# version of the saved risk model (see python . train-risk), None if there is none
+def get_risk_model_version(filename=risk.MODEL_FILE):
+    return os.path.getmtime(filename) if os.path.exists(filename) else None
+
+
+@st.cache_resource
+def load_risk_model(filename, version):
+    return risk.RiskModel.load(filename)
+
+
+# risk scores of every weather row (region, date), indexed like the data, from the saved risk model
+# or from a model trained on the loaded data if none was saved
+# (in chunked mode, the labels are computed from the daily fires streamed by the backend instead of the rows)
+@spans.traced('cache: risk index')
+@st.cache_resource
+def get_risk_index(_weather_df, _wildfire_df, weather_handle, wildfire_handle, model_version, _backend=None):
+    features_df = get_weather_features(_weather_df, weather_handle)
+    if model_version is None:
+        labels_df = None
+        if _backend is not None:
+            spec = WildfireFilter((risk.RISK_CLASS_MIN, FIRE_SIZE_CLASSES[-1]), None, 'All', 'All', None, None, None)
+            labels_df = risk.get_daily_labels(_weather_df, _backend.reduce_daily_fires(spec, FIRE_SIZE_CLASSES),
+                                              FIRE_SIZE_CLASSES)
+        model, _ = risk.train(_weather_df, _wildfire_df, FIRE_SIZE_CLASSES, features_df=features_df,
+                              labels_df=labels_df)
+    else:
+        model = load_risk_model(risk.MODEL_FILE, model_version)
+
+    return FilterIndex(model.score(features_df))
+
+
+# kd-tree of the stations of the station-level weather and its (station, day) observation keys
+@st.cache_resource
+def get_station_index(_df, handle):
+    return stations.index_station_weather(_df)
+
+
+# weather of each fire from its k nearest stations reporting on the discovery date (inverse distance weighted)
+@st.cache_resource
+def get_fire_weather(_fires_df, _weather_df, fires_handle, weather_handle, columns=stations.WEATHER_COLUMNS, k=3):
+    return stations.attribute_weather(_fires_df, _weather_df, list(columns), k,
+                                      station_index=get_station_index(_weather_df, weather_handle))
+
+
+# sql backend of the push-down query mode, an embedded sqlite copy of the local data when running offline,
+# or the partitioned store read in chunks in chunked mode, opened again when the store is rebuilt (python . store)
+def get_query_backend(client):
+    version = chunked.get_store_version(WILDFIRE_STORE_DIR) if QUERY_MODE == 'chunked' else None
+
+    return load_query_backend(client, version)
+
+
+@spans.traced('cache: query backend')
+@st.cache_resource
+def load_query_backend(_client, version):
+    if QUERY_MODE == 'chunked':
+        return chunked.ChunkedBackend(WILDFIRE_STORE_DIR, CHUNK_ROWS)
+    if not isinstance(_client, bigquery.Client):
+        return pushdown.create_sqlite_backend(read_wildfire_data_gcp(_client))
+
+    return pushdown.BigQueryBackend(_client)
+
+
+# option lists and ranges of the forms, per version of the data behind the backend
+def get_wildfire_metadata(backend):
+    return load_wildfire_metadata(backend, get_backend_handle(backend))
+
+
+@spans.traced('cache: wildfire metadata')
+@st.cache_data
+def load_wildfire_metadata(_backend, handle):
+    return _backend.get_metadata()
+
+
+# data of the charts computed by analytics.py, from the cached derivations of the loaded data
+def get_wildfire_analytics(df, handle):
+    cube = get_wildfire_cube(df, handle)
+    cube_handle = get_derived_handle(handle, 'cube')
+    list_fire_size_classes, list_states, _, _ = get_wildfire_lists(df, handle)
+    max_fire_size, _, _ = get_wildfire_ranges(df, handle)
+
+    cells = get_cell_cube(df, handle)
+
+    return analytics.WildfireData(handle, get_filter_index(df, handle), get_filter_index(cube, cube_handle),
+                                  get_time_pyramid(cube, cube_handle),
+                                  get_filter_index(cells, get_derived_handle(handle, 'cells')), None,
+                                  list_fire_size_classes, list_states, get_wildfire_size_class_range(max_fire_size))
+
+
+def get_weather_analytics(weather_df, wildfire_df, weather_handle, wildfire_handle):
+    list_fire_size_classes, _, _, _ = get_wildfire_lists(wildfire_df, wildfire_handle)
+
+    return analytics.WeatherData((weather_handle, wildfire_handle), get_filter_index(weather_df, weather_handle),
+                                 get_filter_index(wildfire_df, wildfire_handle), None, list_fire_size_classes)
+
+
+# same as get_weather_analytics, with the fires streamed by the backend of the chunked mode
+def get_weather_backend_analytics(weather_df, backend, weather_handle):
+    (list_fire_size_classes, _, _, _), _ = get_wildfire_metadata(backend)
+
+    return analytics.WeatherData((weather_handle, get_backend_handle(backend)),
+                                 get_filter_index(weather_df, weather_handle), None, backend, list_fire_size_classes)
+
+
+# risk scores of the weather rows, from the wildfire rows (wildfire_df) or the fires streamed by a backend
+def get_risk_analytics(weather_df, wildfire_df, weather_handle, wildfire_handle, backend=None):
+    model_version = get_risk_model_version()
+    risk_index = get_risk_index(weather_df, wildfire_df, weather_handle, wildfire_handle, model_version, backend)
+
+    return analytics.RiskData((weather_handle, wildfire_handle, model_version), risk_index)
+
+
+# pre-rendered chart results (see python . prerender) shared by all sessions, None if there are none, loaded again
+# when the analytics code is reloaded (its MISSING results are not those of the previous module)
+def get_prerendered_views(filename=PRERENDERED_FILE):
+    version = os.path.getmtime(filename) if os.path.exists(filename) else None
+
+    return load_prerendered_views(filename, version, analytics.CODE_VERSION)
+
+
+@st.cache_resource
+def load_prerendered_views(filename, version, code_version):
+    if version is None:
+        return None
+
+    return analytics.PrerenderedViews(filename)
+
+
+# handle of the data behind the push-down or chunked backend, versions the results of its queries in
+# analytics.result_cache (the chunked backend changes with the part files of the store)
+def get_backend_handle(backend):
+    return DatasetHandle('query backend', getattr(backend, 'version', type(backend).__name__))
+
+
 @st.cache_data
 def get_wildfire_size_class_range(max_fire_size):
     # fire size class range based on the values given by the dataset owners
@@ -170,9 +751,10 @@ def get_wildfire_size_class_range(max_fire_size):
     return fire_size_class_range
 
 
+@spans.traced('cache: weather lists')
 @st.cache_data
-def get_weather_lists(df):
-    list_states = df['region'].sort_values().unique()
+def get_weather_lists(_df, handle):
+    list_states = np.asarray(_df['region'].sort_values().unique())
 
     return list_states
 
@@ -185,15 +767,15 @@ def load_descriptions(filename):
 
 
 @st.cache_data
-def load_descriptions_shared(filename='input/descr_shared_data.json'):
+def load_descriptions_shared(filename=DESCRIPTIONS_SHARED_FILE):
     return load_descriptions(filename)
 
 
 @st.cache_data
-def load_descriptions_wildfire(filename='input/descr_wildfire_data.json'):
+def load_descriptions_wildfire(filename=DESCRIPTIONS_WILDFIRE_FILE):
     return load_descriptions(filename)
 
 
 @st.cache_data
-def load_descriptions_weather(filename='input/descr_weather_data.json'):
+def load_descriptions_weather(filename=DESCRIPTIONS_WEATHER_FILE):
     return load_descriptions(filename)
\ No newline at end of file
@@ -6,35 +6,71 @@ import pandas as pd
 import altair as alt
 
 import utils  # saved shared functions in utils
-
-
-# load data and vars
+import filters
+import spatial
+import timeseries
+import analytics
+import startup
+import spans
+
+
+# start the independent loads at once, each section below renders as soon as the data it needs is ready
+page_startup = startup.Startup()
+page_trace = spans.start_trace('wildfire')
+spans.section('startup')
 client = utils.connect_gcp()
-wildfire_df = utils.load_wildfire_data_gcp(client)
-list_fire_size_classes, list_states, list_years, list_causes = utils.get_wildfire_lists(wildfire_df)
-max_fire_size, min_date, max_date = utils.get_wildfire_ranges(wildfire_df)
-fire_size_class_range = utils.get_wildfire_size_class_range(max_fire_size)
-
-descr_dict = utils.load_descriptions_wildfire()
-shared_descr_dict = utils.load_descriptions_shared()
-if(list_fire_size_classes[0] == 'A'):
-    chart_key_alt = "charts_full"
-else:
-    chart_key_alt = "charts"
+if utils.QUERY_MODE not in utils.BACKEND_QUERY_MODES:
+    page_startup.submit('wildfire data', utils.load_wildfire_data_gcp, client, compact=utils.COMPACT_DTYPES)
+page_startup.submit('descriptions', utils.load_descriptions, utils.DESCRIPTIONS_WILDFIRE_FILE)
+page_startup.submit('shared descriptions', utils.load_descriptions, utils.DESCRIPTIONS_SHARED_FILE)
 
 # tile and short background
 st.title("U.S. Wildfire Data")
 st.sidebar.header("U.S. Wildfire Data")
 st.sidebar.subheader("Background:")
 
+descr_dict = page_startup.get('descriptions')
+shared_descr_dict = page_startup.get('shared descriptions')
 for descr in descr_dict['header']:
     st.sidebar.markdown(descr)
 for descr in shared_descr_dict['header']:
     st.sidebar.markdown(descr)
 for descr in shared_descr_dict['caption']:
     st.sidebar.caption(descr)
+page_startup.mark('first paint')
+
+if utils.DEBUG:
+    debug_placeholder = st.sidebar.empty()
+
+# load data and vars
+spans.section('load data')
+with st.spinner("Loading the wildfire data..."):
+    if utils.QUERY_MODE in utils.BACKEND_QUERY_MODES:
+        # the filters and groupings are run by the database (or streamed over the store in chunks),
+        # the wildfire rows are not loaded
+        backend = utils.get_query_backend(client)
+        (list_fire_size_classes, list_states, list_years, list_causes), (max_fire_size, min_date, max_date) = \
+            utils.get_wildfire_metadata(backend)
+        fire_size_class_range = utils.get_wildfire_size_class_range(max_fire_size)
+        wildfire_data = analytics.WildfireData(utils.get_backend_handle(backend), None, None, None, None, backend, \
+            list_fire_size_classes, list_states, fire_size_class_range)
+    else:
+        wildfire_df = page_startup.get('wildfire data')
+        wildfire_handle = utils.get_dataset_handle(wildfire_df)
+        wildfire_data = utils.get_wildfire_analytics(wildfire_df, wildfire_handle)
+        list_fire_size_classes, list_states, list_years, list_causes = utils.get_wildfire_lists(wildfire_df, wildfire_handle)
+        max_fire_size, min_date, max_date = utils.get_wildfire_ranges(wildfire_df, wildfire_handle)
+        fire_size_class_range = utils.get_wildfire_size_class_range(max_fire_size)
+    analytics.set_prerendered(utils.get_prerendered_views())
+page_startup.mark('widgets')
+
+if(list_fire_size_classes[0] == 'A'):
+    chart_key_alt = "charts_full"
+else:
+    chart_key_alt = "charts"
 
 # define forms
+spans.section('widgets')
 st.markdown("Use the following widgets to filter the data used in below charts:")
 left_col, right_col = st.columns((4, 1))
 choice_fire_class_min, choice_fire_class_max = left_col.select_slider("Filter by Fire Size Class:", list_fire_size_classes, \
@@ -54,73 +90,66 @@ choice_date_to = right_col.date_input("", min_value=choice_date_from, max_value=
     value=max_date, disabled=(choice_year != 'All'), label_visibility='hidden')
 
 # filter data based on form inputs
+spans.section('filter')
 st.header("Wildfire Incidents and their Location")
-if choice_fire_class_min != 'A' or choice_fire_class_max != 'G':
-    wildfire_df = wildfire_df.loc[(wildfire_df['fire_size_class'] >= choice_fire_class_min) & \
-        (wildfire_df['fire_size_class'] <= choice_fire_class_max)]
-if choice_fire_size_min > 0 or choice_fire_size_max < max_fire_size:
-    wildfire_df = wildfire_df.loc[(wildfire_df['fire_size'] >= choice_fire_size_min) & \
-        (wildfire_df['fire_size'] < choice_fire_size_max)]
+# the charts below are computed by analytics.py (cached per filter for all sessions)
+wildfire_filter = filters.make_wildfire_filter(choice_fire_class_min, choice_fire_class_max, \
+    choice_fire_size_min, choice_fire_size_max, max_fire_size, choice_state, choice_year, choice_date_from, choice_date_to, \
+    min_date=min_date, max_date=max_date)
 
-if choice_state != 'All':
-    wildfire_df = wildfire_df.loc[wildfire_df['region'] == choice_state]
+# the map shows the points of the incidents, or grid cells when there are too many points
+map_df, cell_size = analytics.get_map(wildfire_data, wildfire_filter, utils.MAP_MAX_POINTS)
 
 if choice_year != 'All':
     choice_year = int(choice_year)
-    wildfire_df = wildfire_df.loc[wildfire_df['date'].dt.year == choice_year]
-else:
-    wildfire_df = wildfire_df.loc[(wildfire_df['date'].dt.date >= choice_date_from) & \
-        (wildfire_df['date'].dt.date <= choice_date_to)]
 
 # display a map of fire incidents
-st.map(wildfire_df[['latitude', 'longitude']])
+spans.section('map')
+if cell_size is not None:
+    st.caption("Showing incidents per {}° cell, filter the data to see each incident.".format(cell_size))
+    st.pydeck_chart(spatial.get_cells_deck(map_df, cell_size))
+else:
+    st.map(map_df)
 expander = st.expander(shared_descr_dict["charts"]["label"])
 expander.markdown(descr_dict["charts"]["map"])
+page_startup.mark('map')
 
 # display bar chart (trend) by period
+spans.section('trend charts')
 st.header("Wildfire Trend by Count and Total Size")
 if choice_year == 'All':
     choice_display_period = st.radio("Display by Period:", options=['Daily', 'Monthly', 'Yearly'], horizontal=True)
 else:
     choice_display_period = st.radio("Display by Period:", options=['Daily', 'Monthly'], horizontal=True)
 
-if choice_display_period == 'Monthly':
-    tmp_group = wildfire_df[['date', 'fire_size']].resample('M', on='date')
-elif choice_display_period == 'Yearly':
-    tmp_group = wildfire_df[['date', 'fire_size']].resample('Y', on='date')
-else:
-    tmp_group = wildfire_df[['date', 'fire_size']].groupby('date')
+tmp_df = analytics.get_trend(wildfire_data, wildfire_filter, {'Daily': 'D', 'Monthly': 'M', 'Yearly': 'Y'}[choice_display_period])
 
+# long daily series are downsampled (keeping their peaks) before they are sent to the charts
 left_col, right_col = st.columns(2)
-tmp_df = tmp_group.count()
-tmp_df.rename(columns={'fire_size':'fire count'}, inplace=True)
-left_col.line_chart(tmp_df)
-tmp_df = tmp_group.sum(numeric_only=True)
-tmp_df.rename(columns={'fire_size':'fire size'}, inplace=True)
-right_col.line_chart(tmp_df)
+left_col.line_chart(timeseries.downsample(tmp_df, 'incident')[['incident']].rename(columns={'incident':'fire count'}))
+right_col.line_chart(timeseries.downsample(tmp_df, 'fire_size')[['fire_size']].rename(columns={'fire_size':'fire size'}))
 expander = st.expander(shared_descr_dict["charts"]["label"])
 expander.markdown(descr_dict["charts"]["trend"])
 
 
 # display per fire size class, state
+spans.section('fire size and state charts')
 # table and bar chart
 st.header("Wildfire Incidents by Fire Size and U.S. State")
 st.write("Display by:")
 choice_display_fire = st.checkbox("Fire Size Class", value=True)
 choice_display_state = st.checkbox("U.S. State ", value=True)
-tmp_df = wildfire_df[['fire_size_class', 'region', 'incident', 'fire_size']]
 if choice_display_fire and choice_display_state:
-    tmp_df2 = tmp_df.groupby(['region', 'fire_size_class']).sum(numeric_only=True).reset_index()
+    tmp_df2 = analytics.aggregate(wildfire_data, wildfire_filter, ['region', 'fire_size_class'])
     st.dataframe(tmp_df2, use_container_width=True)
-    tmp_df2 = tmp_df2.pivot(index='region', columns='fire_size_class', values='incident')
-    st.bar_chart(tmp_df2)
+    st.bar_chart(analytics.get_pivot(wildfire_data, wildfire_filter, 'region', 'fire_size_class'))
 elif choice_display_fire:
-    tmp_df2 = tmp_df.groupby(['fire_size_class']).sum(numeric_only=True).reset_index()
+    tmp_df2 = analytics.aggregate(wildfire_data, wildfire_filter, ['fire_size_class'])
     tmp_df2 = tmp_df2.sort_values(by='incident', ascending=False)
     st.dataframe(tmp_df2, use_container_width=True)
     st.bar_chart(tmp_df2[['fire_size_class', 'incident']], x='fire_size_class')
 elif choice_display_state:
-    tmp_df2 = tmp_df.groupby(['region']).sum(numeric_only=True)
+    tmp_df2 = analytics.aggregate(wildfire_data, wildfire_filter, ['region']).set_index('region')
     tmp_df2 = tmp_df2.sort_values(by='incident', ascending=False)
     st.dataframe(tmp_df2, use_container_width=True)
     st.bar_chart(tmp_df2[['incident']])
@@ -130,12 +159,11 @@ if choice_display_fire or choice_display_state:
     expander.markdown(descr_dict[chart_key_alt]["region_and_size"])
 
 # pie charts
+spans.section('pie charts')
 st.markdown("Percentage distribution of fire occurrences based on fire size class and U.S. state:")
 left_col, right_col = st.columns(2)
 if choice_display_fire:
-    tmp_df2 = tmp_df.groupby(['fire_size_class']).sum(numeric_only=True).reset_index()
-    tmp_df2['incident'] = tmp_df2['incident'] / tmp_df2['incident'].sum(numeric_only=True) * 100
-    tmp_df2['incident'] = tmp_df2['incident'].round(decimals=2)
+    tmp_df2 = analytics.get_shares(wildfire_data, wildfire_filter, ['fire_size_class'])
     chart = alt.Chart(tmp_df2).mark_arc(innerRadius=50, outerRadius=110).encode(
         theta=alt.Theta(field="incident", type="quantitative", title="% of occurence"),
         color=alt.Color(field="fire_size_class", type="nominal")
@@ -143,9 +171,7 @@ if choice_display_fire:
     left_col.altair_chart(chart, use_container_width=True)
 
 if choice_display_state:
-    tmp_df2 = tmp_df.groupby(['region']).sum(numeric_only=True).reset_index()
-    tmp_df2['incident'] = tmp_df2['incident'] / tmp_df2['incident'].sum(numeric_only=True) * 100
-    tmp_df2['incident'] = tmp_df2['incident'].round(decimals=2)
+    tmp_df2 = analytics.get_shares(wildfire_data, wildfire_filter, ['region'])
     chart = alt.Chart(tmp_df2).mark_arc(innerRadius=50, outerRadius=110).encode(
         theta=alt.Theta(field="incident", type="quantitative", title="% of occurence"),
         color=alt.Color(field="region", type="nominal")
@@ -157,12 +183,10 @@ if choice_display_fire or choice_display_state:
     expander.markdown(descr_dict[chart_key_alt]["region_and_size_perc"])
 
 # display per fire size and year
-tmp_df = wildfire_df[['date', 'fire_size_class', 'region', 'incident', 'fire_size']]
+spans.section('year charts')
 if choice_display_fire:
     st.subheader("By Fire Size and Year")
-    tmp_df2 = tmp_df.groupby([tmp_df.date.dt.year, 'fire_size_class']).sum(numeric_only=True).reset_index()
-    print(tmp_df2)
-    tmp_df2 = tmp_df2.pivot(index='date', columns='fire_size_class', values='incident')
+    tmp_df2 = analytics.get_pivot(wildfire_data, wildfire_filter, 'year', 'fire_size_class')
     st.bar_chart(tmp_df2)
     if choice_year == 'All':
         st.line_chart(tmp_df2)
@@ -172,14 +196,12 @@ if choice_display_fire:
 
 if choice_display_state:
     st.subheader("By U.S. State and Year")
-    tmp_df2 = tmp_df.groupby([tmp_df.date.dt.year, 'region']).sum(numeric_only=True).reset_index()
-    tmp_df2 = tmp_df2.pivot(index='date', columns='region', values='incident')
+    tmp_df2 = analytics.get_pivot(wildfire_data, wildfire_filter, 'year', 'region')
     st.bar_chart(tmp_df2)
     if choice_year == 'All':
         if choice_state == 'All':
             st.write("Displaying Top 5 U.S. States with Most Fires")
-            top_states = tmp_df[['region', 'incident']].groupby('region').sum(numeric_only=True)
-            top_states = top_states.sort_values(by='incident').index[-5::].values 
+            top_states = analytics.get_top(wildfire_data, wildfire_filter, 'region')
             st.line_chart(tmp_df2.loc[:, top_states])
         else:
             st.line_chart(tmp_df2)
@@ -187,55 +209,41 @@ if choice_display_state:
     expander = st.expander(shared_descr_dict["charts"]["label"])
     expander.markdown(descr_dict[chart_key_alt]["state_and_year"])
 
-    list_dates = tmp_df['date'].sort_values().unique()
-    tmp_df2 = tmp_df[['date', 'incident', 'region']].groupby(['date', 'region']).count()
-    tmp_df2 = tmp_df2.reindex(pd.MultiIndex.from_product([list_dates, list_states], names=['date', 'region']), fill_value=0)
-    tmp_df2 = tmp_df2['incident'].reset_index()
-    tmp_df2.loc[tmp_df2['incident'] > 0, 'incident'] = 1
-    tmp_df2 = tmp_df2.groupby(['incident', 'region']).count().reset_index()
-    tmp_df2 = tmp_df2.pivot(index='region', columns='incident', values='date').sort_index(axis=1)
-    tmp_df2 = tmp_df2.rename(columns={0: "days with no fire", 1: "days with fire"})
-
-    st.bar_chart(tmp_df2)
+    # out of the days with a fire in any state
+    st.bar_chart(analytics.get_active_days(wildfire_data, wildfire_filter))
 
     expander = st.expander(shared_descr_dict["charts"]["label"])
     expander.markdown(descr_dict[chart_key_alt]["state_daily"])
 
 # display per cause
+spans.section('cause charts')
 st.header("Wildfire Incidents by Cause")
 choice_cause = st.multiselect("Filter by Cause of Fire:", list_causes, default=list_causes)
+cause_filter = wildfire_filter._replace(causes=tuple(sorted(choice_cause)))
 
 if len(choice_cause) > 0:
     # summary
-    tmp_df = wildfire_df[['date', 'fire_size_class', 'region', 'stat_cause', 'incident']]
-    tmp_df = tmp_df.loc[tmp_df['stat_cause'].isin(choice_cause)]
-    tmp_df2 = tmp_df.groupby(['stat_cause']).sum(numeric_only=True)
-    st.bar_chart(tmp_df2[['incident']])
+    tmp_df = analytics.aggregate(wildfire_data, cause_filter, ['stat_cause']).set_index('stat_cause')
+    st.bar_chart(tmp_df[['incident']])
 
     _, mid_col, _ = st.columns((2,4,1))
-    tmp_df2['incident'] = tmp_df2['incident'] / tmp_df2['incident'].sum(numeric_only=True) * 100
-    tmp_df2['incident'] = tmp_df2['incident'].round(decimals=2)
-    chart = alt.Chart(tmp_df2.reset_index()).mark_arc(innerRadius=50, outerRadius=110).encode(
+    tmp_df2 = analytics.get_shares(wildfire_data, cause_filter, ['stat_cause'])[['stat_cause', 'incident']]
+    chart = alt.Chart(tmp_df2).mark_arc(innerRadius=50, outerRadius=110).encode(
         theta=alt.Theta(field="incident", type="quantitative", title="% of occurence"),
         color=alt.Color(field="stat_cause", type="nominal")
     )
     mid_col.altair_chart(chart)
 
-    tmp_df2 = tmp_df.groupby(['region', 'stat_cause']).sum(numeric_only=True).reset_index()
-    tmp_df2 = tmp_df2.pivot(index='stat_cause', columns='region', values='incident')
-
     expander = st.expander(shared_descr_dict["charts"]["label"])
     expander.markdown(descr_dict[chart_key_alt]["cause"])
 
     # and by yearly trend
     st.subheader("By Cause and Year")
-    tmp_df2 = tmp_df.groupby([tmp_df.date.dt.year, 'stat_cause']).sum(numeric_only=True).reset_index()
-    tmp_df2 = tmp_df2.pivot(index='date', columns='stat_cause', values='incident')
+    tmp_df2 = analytics.get_pivot(wildfire_data, cause_filter, 'year', 'stat_cause')
     st.bar_chart(tmp_df2)
     if choice_year == 'All':
         st.write("Displaying Trends in the Top 5 Causes of Fires")
-        top_causes = tmp_df[['stat_cause', 'incident']].groupby('stat_cause').sum(numeric_only=True)
-        top_causes = top_causes.sort_values(by='incident').index[-5::].values 
+        top_causes = analytics.get_top(wildfire_data, cause_filter, 'stat_cause')
         st.line_chart(tmp_df2.loc[:, top_causes])
 
     expander = st.expander(shared_descr_dict["charts"]["label"])
@@ -243,15 +251,13 @@ if len(choice_cause) > 0:
 
     # and by fire size
     st.subheader("By Cause and Fire Size")
-    tmp_df2 = tmp_df.groupby(['fire_size_class', 'stat_cause']).sum(numeric_only=True).reset_index()
-    tmp_df2 = tmp_df2.pivot(index='stat_cause', columns='fire_size_class', values='incident')
+    tmp_df2 = analytics.get_pivot(wildfire_data, cause_filter, 'stat_cause', 'fire_size_class')
     st.bar_chart(tmp_df2)
 
     top_fire_class = choice_fire_class_max
     st.markdown("Displaying % Causes in the Largest Fire Size Class: " + top_fire_class)
     _, mid_col, _ = st.columns((2,4,1))
-    tmp_df2[top_fire_class] = tmp_df2[top_fire_class] / tmp_df2[top_fire_class].sum(numeric_only=True) * 100
-    tmp_df2[top_fire_class] = tmp_df2[top_fire_class].round(decimals=2)
+    tmp_df2[top_fire_class] = analytics.get_percentages(tmp_df2[top_fire_class])
     chart = alt.Chart(tmp_df2[top_fire_class].reset_index()).mark_arc(innerRadius=50, outerRadius=110).encode(
         theta=alt.Theta(field=top_fire_class, type="quantitative", title="% of occurence"),
         color=alt.Color(field="stat_cause", type="nominal")
@@ -263,8 +269,7 @@ if len(choice_cause) > 0:
 
     # and by U.S. state
     st.subheader("By Cause and U.S. State")
-    tmp_df2 = tmp_df.groupby(['region', 'stat_cause']).sum(numeric_only=True).reset_index()
-    tmp_df2 = tmp_df2.pivot(index='region', columns='stat_cause', values='incident')
+    tmp_df2 = analytics.get_pivot(wildfire_data, cause_filter, 'region', 'stat_cause')
     st.bar_chart(tmp_df2)
 
     expander = st.expander(shared_descr_dict["charts"]["label"])
@@ -272,8 +277,7 @@ if len(choice_cause) > 0:
 
     st.markdown("Displaying % States of Wildfires Caused by: " + top_causes[-1])
     _, mid_col, _ = st.columns((2,4,1))
-    tmp_df2[top_causes[0]] = tmp_df2[top_causes[0]] / tmp_df2[top_causes[0]].sum(numeric_only=True) * 100
-    tmp_df2[top_causes[0]] = tmp_df2[top_causes[0]].round(decimals=2)
+    tmp_df2[top_causes[0]] = analytics.get_percentages(tmp_df2[top_causes[0]])
     chart = alt.Chart(tmp_df2[top_causes[0]].reset_index()).mark_arc(innerRadius=50, outerRadius=110).encode(
         theta=alt.Theta(field=top_causes[0], type="quantitative", title="% of occurence"),
         color=alt.Color(field="region", type="nominal")
@@ -282,3 +286,17 @@ if len(choice_cause) > 0:
 
     expander = st.expander(shared_descr_dict["charts"]["label"])
     expander.markdown(descr_dict[chart_key_alt]["cause_and_state_perc"])
+page_startup.mark('charts')
+spans.end_trace()
+
+# debug information (loaded datasets, startup timings, stages of this run, result cache) in the sidebar
+if utils.DEBUG:
+    with debug_placeholder.container():
+        expander = st.expander("Dataset Registry")
+        expander.dataframe(utils.get_dataset_registry().get_stats())
+        expander = st.expander("Startup Timings")
+        expander.dataframe(page_startup.get_report())
+        expander = st.expander("Stage Spans")
+        expander.dataframe(page_trace.get_report())
+        expander = st.expander("Result Cache")
+        expander.dataframe(analytics.result_cache.get_stats())